@@ -15,6 +15,64 @@ class Settings(BaseSettings):
     redis_host: str = os.getenv("REDIS_HOST")
     redis_port: int = os.getenv("REDIS_PORT")
 
+    # storage image downloads
+    image_fetch_timeout: float = os.getenv("IMAGE_FETCH_TIMEOUT", 15)
+    image_fetch_connect_timeout: float = os.getenv(
+        "IMAGE_FETCH_CONNECT_TIMEOUT", 5)
+    image_fetch_max_bytes: int = os.getenv(
+        "IMAGE_FETCH_MAX_BYTES", 30 * 1024 * 1024)
+    image_fetch_per_host_concurrency: int = os.getenv(
+        "IMAGE_FETCH_PER_HOST_CONCURRENCY", 8)
+    image_fetch_pool_size: int = os.getenv("IMAGE_FETCH_POOL_SIZE", 16)
+
+    # content-addressed cache of CLIP features, labels and face encodings
+    result_cache_enabled: bool = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+    result_cache_path: str = os.getenv(
+        "RESULT_CACHE_PATH", ".cache/result_cache.sqlite3")
+    result_cache_max_bytes: int = os.getenv(
+        "RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024)
+
+    # normalized search query -> CLIP text embedding
+    text_embedding_cache_size: int = os.getenv(
+        "TEXT_EMBEDDING_CACHE_SIZE", 4096)
+    text_embedding_redis_enabled: bool = os.getenv(
+        "TEXT_EMBEDDING_REDIS_ENABLED", "0") == "1"
+    text_embedding_redis_ttl: int = os.getenv(
+        "TEXT_EMBEDDING_REDIS_TTL", 7 * 24 * 3600)
+    # most frequent search_history queries encoded at startup, 0 disables
+    text_embedding_prewarm: int = os.getenv("TEXT_EMBEDDING_PREWARM", 500)
+
+    # per-user in-memory image feature index for text search, the RPC is the fallback
+    vector_index_enabled: bool = os.getenv("VECTOR_INDEX_ENABLED", "1") == "1"
+    vector_index_dtype: str = os.getenv("VECTOR_INDEX_DTYPE", "float32")
+    vector_index_max_users: int = os.getenv("VECTOR_INDEX_MAX_USERS", 256)
+    # seconds before a user's index is rebuilt: picks up writes of other processes /
+    # replicas and deleted images, 0 -> kept until evicted
+    vector_index_ttl: float = os.getenv("VECTOR_INDEX_TTL", 300)
+    # IVF approximate search for large libraries: users past ann_min_images get a trained index
+    ann_index_enabled: bool = os.getenv("ANN_INDEX_ENABLED", "0") == "1"
+    ann_min_images: int = os.getenv("ANN_MIN_IMAGES", 20000)
+    ann_nprobe: int = os.getenv("ANN_NPROBE", 8)
+    ann_index_dir: str = os.getenv("ANN_INDEX_DIR", ".cache/ann_index")
+
+    # memory-mapped local copy of image.image_features, synced by updated_at
+    embedding_store_enabled: bool = os.getenv(
+        "EMBEDDING_STORE_ENABLED", "0") == "1"
+    embedding_store_dir: str = os.getenv(
+        "EMBEDDING_STORE_DIR", ".cache/embedding_store")
+    embedding_store_sync_interval: float = os.getenv(
+        "EMBEDDING_STORE_SYNC_INTERVAL", 60)
+    # seconds each sync re-reads before the watermark, covers writes committed late
+    embedding_store_sync_lag: float = os.getenv(
+        "EMBEDDING_STORE_SYNC_LAG", 300)
+    # seconds between checks of the stored ids against the database (deleted images)
+    embedding_store_reconcile_interval: float = os.getenv(
+        "EMBEDDING_STORE_RECONCILE_INTERVAL", 3600)
+
+    # seconds between bulk increments of search_history hit_count / last_used_at
+    search_history_flush_interval: float = os.getenv(
+        "SEARCH_HISTORY_FLUSH_INTERVAL", 30)
+
     class Config:
         env_file = ".env"
 
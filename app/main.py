@@ -1,28 +1,28 @@
 import asyncio
 import json
-from typing import List
-from fastapi import FastAPI, Request, Depends
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 import numpy as np
-from sklearn.cluster import DBSCAN
 from app.libs.logger.log import log_error, log_info
 from app.services.redis_service import RedisService
 from app.tasks.check_db_on_startup import cleanup_background_thread, start_background_processor
 from app.tasks.db_listener import start_listener, stop_listener
-from app.services.ai_services import AIService, get_ai_service
+from app.services.ai_services import AIService
+from app.services.classify_pipeline import ClassifyPipeline
+from app.services.model_loader import ModelLoader
 from app.services.supabase_service import SupabaseService
 from app.tasks.redis_processor import start_stream_processors, stop_stream_processors
 from dotenv import load_dotenv
 from pydantic import BaseModel
 import os
 import traceback
-import os
 
-from app.test.face_image.test_face_image import process_face_images
-from app.test.open_clip.test_open_clip import process_test_open_clip
 from app.utils.compare_centroit import compare_centroids, remove_duplicates_by_image_name
+import app.utils.image_fetcher as image_fetcher_module
 
 os.environ['LOKY_MAX_CPU_COUNT'] = '10'
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
@@ -35,27 +35,45 @@ def reload_env():
 
 reload_env()
 
-app = FastAPI()
+# test / benchmark scripts run on their own:
+#   python -m app.test.open_clip.test_open_clip
+#   python -m app.test.face_image.test_face_image
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-# process_face_images()
-process_test_open_clip()
+def create_model_loader(app: FastAPI):
+    # heavy imports stay inside the loader thread
+    def load_labels():
+        from app.models.label_artifact import get_label_artifact
+        return get_label_artifact()
 
-# dependency injection -> AI labeling service + Supabase service into -> bg_tasks
+    def load_clip():
+        from app.models.model import AIModel
+        return AIModel()
+
+    def load_face():
+        from app.models.model import FaceCategoryModel
+        return FaceCategoryModel()
+
+    def load_ai_service():
+        app.state.ai_service = AIService(
+            app.state.supabase_service, loader.get("clip"), loader.get("face"))
+        return app.state.ai_service
+
+    loader = ModelLoader()
+    loader.register("labels", load_labels)
+    loader.register("clip", load_clip, warm_up_fn=lambda model: model.warm_up())
+    loader.register("face", load_face)
+    loader.register("ai_service", load_ai_service)
+    return loader
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # app.state.supabase_service = SupabaseService()
-    # app.state.ai_service = AIService(app.state.supabase_service)
-    # app.state.redis_service = RedisService()
+    app.state.supabase_service = SupabaseService()
+    app.state.redis_service = RedisService()
+    app.state.ai_service = None
+    # models load in the background, the server is up in seconds -> poll /ready
+    app.state.model_loader = create_model_loader(app).start()
 
     # # # # init consumer group
     # app.state.redis_service.create_consumer_group(
@@ -74,12 +92,35 @@ async def lifespan(app: FastAPI):
     # # stop_listener()
     # stop_stream_processors()
     # # cleanup_background_thread()
+    if app.state.ai_service is not None:
+        app.state.ai_service.search_history.stop()
+        inference_service = app.state.ai_service.inference_service
+        if inference_service.workers is not None:
+            inference_service.workers.close()
+        if inference_service.face_executor is not None:
+            inference_service.face_executor.close()
+        if inference_service.image_ring is not None:
+            inference_service.image_ring.close()
+    if image_fetcher_module.image_fetcher is not None:
+        await image_fetcher_module.image_fetcher.aclose()
 
 app = FastAPI(lifespan=lifespan)
 
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 
 def get_ai_service(request: Request) -> AIService:
-    return request.app.state.ai_service
+    service = getattr(request.app.state, 'ai_service', None)
+    if service is None:
+        raise HTTPException(
+            status_code=503, detail="Models are still loading.")
+    return service
 
 
 def get_redis_service(request: Request) -> RedisService:
@@ -90,6 +131,32 @@ def get_supabase_service(request: Request) -> SupabaseService:
     return request.app.state.supabase_service
 
 
+def get_classify_pipeline(request: Request) -> ClassifyPipeline:
+    # one pipeline (and its thread pools) shared by every batch request
+    if getattr(request.app.state, 'classify_pipeline', None) is None:
+        request.app.state.classify_pipeline = ClassifyPipeline(
+            get_ai_service(request), request.app.state.redis_service)
+    return request.app.state.classify_pipeline
+
+
+# per-model load state + warm up latency, 503 until every model is ready
+@app.get("/ready")
+def ready(request: Request):
+    loader = getattr(request.app.state, 'model_loader', None)
+    status = loader.status() if loader is not None else {
+        "ready": False, "models": {}}
+    if status["ready"]:
+        state = "ready"
+    elif any(model["state"] == "failed" for model in status["models"].values()):
+        state = "failed"
+    else:
+        state = "loading"
+    return JSONResponse(status_code=200 if status["ready"] else 503, content={
+        "status": state,
+        "data": status,
+    })
+
+
 class PersonClustering(BaseModel):
     user_id: str
 
@@ -117,6 +184,8 @@ def person_clustering(request: PersonClustering, supabase_service: SupabaseServi
         embeddings = [json.loads(person['embedding'])
                       for person in person_list]
 
+        # sklearn imported on first use, keep it off the app.main import path
+        from sklearn.cluster import DBSCAN
         dbscan = DBSCAN(eps=eps, metric='euclidean', min_samples=min_samples)
         labels = dbscan.fit(embeddings)
 
@@ -253,7 +322,7 @@ class ImageBatchRequest(BaseModel):
 
 
 @app.post("/api/classify-images")
-async def classify_images(request: ImageBatchRequest, service: AIService = Depends(get_ai_service), redis_service: RedisService = Depends(get_redis_service)):
+async def classify_images(request: ImageBatchRequest, pipeline: ClassifyPipeline = Depends(get_classify_pipeline)):
     # if len(request.data) > 3:
     #     return {"status": "error", "message": "Only up to 3 images are allowed."}
 
@@ -261,46 +330,8 @@ async def classify_images(request: ImageBatchRequest, service: AIService = Depen
     if request.user_id == '' or request.user_id is None:
         return {"status": "error", "message": "User id is required."}
 
-    async def process_image(image_request: ImageRequest):
-        try:
-            image_id = image_request.image_id
-            image_bucket_id = image_request.image_bucket_id
-            image_name = image_request.image_name
-
-            # update redis label job -> processing
-            redis_service.update_image_label_job(
-                image_id, image_bucket_id, image_name
-            )
-
-            image_url = service.inference_service.supabase_service.get_image_public_url(
-                image_bucket_id, image_name)
-
-            results, image_features = service.classify_image(
-                image_bucket_id, image_name, image_url)
-
-            # update redis label job -> completed
-            redis_service.update_hash(
-                f"image_job:{image_id}",
-                {
-                    "labels": json.dumps(results),
-                    "label_status": "completed"
-                }
-            )
-
-            supabase_service: SupabaseService = service.inference_service.supabase_service
-            image_row = supabase_service.save_image_features_and_labels(
-                image_bucket_id, image_name, results, image_features.squeeze(0).tolist(), user_id=request.user_id)
-            image_row.pop('image_features')
-            return image_row
-        except Exception as e:
-            log_error(e)
-            log_error(f"Error at API endpoint: {e}\n{traceback.format_exc()}")
-            #  throw error to the caller
-            raise Exception(e)
-
     try:
-        tasks = [process_image(img_req) for img_req in request.data]
-        image_rows = await asyncio.gather(*tasks)
+        image_rows = await pipeline.run(request.user_id, request.data)
     except Exception as e:
         # add statuscode 500
         return {"status": "error", "message": str(e)}
@@ -311,6 +342,11 @@ class QueryImageRequest(BaseModel):
     user_id: str
     query: str
     threshold: float
+    # page size, None -> every image above threshold in one response
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    # NDJSON: a meta line, one line per image as each page is ready, an end line
+    stream: bool = False
 
 
 @app.post("/api/query-image")
@@ -325,9 +361,76 @@ def query_image(request: QueryImageRequest, service: AIService = Depends(get_ai_
     if request.query == '' or request.query is None:
         return {"status": "error", "message": "Query is required."}
 
+    if request.limit is not None and request.limit < 1:
+        return {"status": "error", "message": "Limit must be at least 1."}
+
+    if request.stream:
+        return StreamingResponse(
+            stream_search_results(service, request), media_type="application/x-ndjson")
+
+    try:
+        if request.limit is not None or request.cursor is not None:
+            result = service.search_text_page(
+                request.query, request.user_id, request.threshold, request.limit or 50, request.cursor)
+        else:
+            result = service.save_text_search_history(
+                request.query, request.user_id, request.threshold)
+        return {
+            "status": "success",
+            "data": result
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
+def stream_search_results(service: AIService, request: QueryImageRequest):
+    try:
+        pages = service.iter_search_pages(
+            request.query, request.user_id, request.threshold, request.limit or 50, request.cursor)
+        page = next(pages)
+        yield json.dumps({"type": "meta", "search_history_id": page["search_history_id"],
+                          "total": page["total"]}) + "\n"
+        while True:
+            for row in page["result"]:
+                yield json.dumps({"type": "image", **row}, default=str) + "\n"
+            page = next(pages, None)
+            if page is None:
+                break
+        yield json.dumps({"type": "end"}) + "\n"
+    except Exception as e:
+        log_error(f"Error streaming search results: {e}\n{traceback.format_exc()}")
+        yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+
+
+class QueryImagesRequest(BaseModel):
+    user_id: str
+    queries: List[str]
+    threshold: float
+    limit: int = 20
+
+
+# several searches in one call -> one text encoder pass + one scoring matmul
+@app.post("/api/query-images")
+def query_images(request: QueryImagesRequest, service: AIService = Depends(get_ai_service)):
+    # check user id
+    if request.user_id == '' or request.user_id is None:
+        return {"status": "error", "message": "User id is required."}
+
+    if request.threshold < 0 or request.threshold > 1:
+        return {"status": "error", "message": "Threshold must be between 0 and 1."}
+
+    if len(request.queries) == 0 or len(request.queries) > 32:
+        return {"status": "error", "message": "Between 1 and 32 queries are allowed."}
+
+    if any(query is None or query.strip() == '' for query in request.queries):
+        return {"status": "error", "message": "Query is required."}
+
+    if request.limit < 1:
+        return {"status": "error", "message": "Limit must be at least 1."}
+
     try:
-        result = service.save_text_search_history(
-            request.query, request.user_id, request.threshold)
+        result = service.save_text_search_history_batch(
+            request.queries, request.user_id, request.threshold, request.limit)
         return {
             "status": "success",
             "data": result
@@ -335,6 +438,27 @@ def query_image(request: QueryImageRequest, service: AIService = Depends(get_ai_
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+
+# batch size / queue wait stats of the CLIP image encoder + selected execution policy -> tune config
+@app.get("/api/inference-stats")
+def inference_stats(service: AIService = Depends(get_ai_service)):
+    return {
+        "status": "success",
+        "data": {
+            "image_encoder": service.model.image_encoder.get_stats(),
+            "text_embedding_cache": service.text_embeddings.get_stats(),
+            "image_index": service.image_index.get_stats() if service.image_index else None,
+            "inference_workers": service.inference_service.workers.get_stats() if service.inference_service.workers else None,
+            "image_ring": service.inference_service.image_ring.get_stats() if service.inference_service.image_ring else None,
+            "face_executor": service.inference_service.face_executor.get_stats() if service.inference_service.face_executor else None,
+            "person_gate": service.inference_service.person_gate.get_stats() if service.inference_service.person_gate else None,
+            "execution_policy": {
+                **service.model.execution_policy.describe(),
+                "benchmark": service.model.execution_report,
+            },
+        }
+    }
+
 # hello world test endpoint
 
 
@@ -0,0 +1,161 @@
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+import torch
+from app.libs.logger.log import log_error, log_info
+
+
+class ImageBatchEncoder:
+    """
+    Micro-batching scheduler in front of the CLIP image encoder.
+
+    Callers submit single preprocessed image tensors from any thread. A worker
+    thread gathers pending tensors until either `max_batch_size` images are
+    queued or the oldest one has waited `max_wait_ms`, runs one forward pass
+    and hands every caller back its own normalized feature row.
+
+    :param encode_fn: function mapping a [N, 3, H, W] tensor to [N, D] features
+    :param max_batch_size: maximum number of images per forward pass
+    :param max_wait_ms: maximum time the oldest queued image waits for a batch
+    """
+
+    def __init__(self, encode_fn, max_batch_size: int = 8, max_wait_ms: float = 15):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def submit(self, image_tensor: torch.Tensor) -> Future:
+        """Queue one preprocessed image ([3, H, W] or [1, 3, H, W])."""
+        if image_tensor.dim() == 3:
+            image_tensor = image_tensor.unsqueeze(0)
+
+        self._ensure_started()
+        future = Future()
+        self._queue.put((image_tensor, future, time.perf_counter()))
+        return future
+
+    def encode(self, image_tensor: torch.Tensor, timeout: float = None) -> torch.Tensor:
+        """Blocking helper returning the [1, D] normalized features of one image."""
+        return self.submit(image_tensor).result(timeout=timeout)
+
+    def stop(self, timeout: float = 5):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def get_stats(self):
+        with self._stats_lock:
+            batches = self._stats["batches"]
+            images = self._stats["images"]
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_size": self._queue.qsize(),
+                "batches": batches,
+                "images": images,
+                "avg_batch_size": images / batches if batches else 0.0,
+                "batch_size_histogram": dict(self._stats["batch_size_histogram"]),
+                "avg_queue_wait_ms": self._stats["queue_wait_total"] * 1000 / images if images else 0.0,
+                "max_queue_wait_ms": self._stats["queue_wait_max"] * 1000,
+                "avg_forward_ms": self._stats["forward_total"] * 1000 / batches if batches else 0.0,
+                "errors": self._stats["errors"],
+            }
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats = {
+            "batches": 0,
+            "images": 0,
+            "batch_size_histogram": {},
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "forward_total": 0.0,
+            "errors": 0,
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name="clip-batch-encoder")
+                self._thread.daemon = True
+                self._thread.start()
+                log_info(
+                    f"Image batch encoder started (max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait * 1000:.1f})")
+
+    def _collect_batch(self):
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    # take whatever is already waiting, but do not wait longer
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            futures = [future for _, future, _ in batch]
+            try:
+                images = torch.cat([tensor for tensor, _, _ in batch], dim=0)
+                image_features = self.encode_fn(images)
+                forward_time = time.perf_counter() - start
+                for i, future in enumerate(futures):
+                    if future.set_running_or_notify_cancel():
+                        future.set_result(image_features[i:i + 1])
+                self._record(batch, start, forward_time)
+            except Exception as e:
+                log_error(
+                    f"Error in image batch encoder: {e}\n{traceback.format_exc()}")
+                with self._stats_lock:
+                    self._stats["errors"] += 1
+                for future in futures:
+                    if not future.done() and future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+
+    def _record(self, batch, start, forward_time):
+        with self._stats_lock:
+            size = len(batch)
+            self._stats["batches"] += 1
+            self._stats["images"] += size
+            histogram = self._stats["batch_size_histogram"]
+            histogram[size] = histogram.get(size, 0) + 1
+            for _, _, enqueued_at in batch:
+                wait = start - enqueued_at
+                self._stats["queue_wait_total"] += wait
+                self._stats["queue_wait_max"] = max(
+                    self._stats["queue_wait_max"], wait)
+            self._stats["forward_total"] += forward_time
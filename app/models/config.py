@@ -4,6 +4,12 @@ import torch
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# face detector working area per image (resized pixels x 4^upsample), 0 -> legacy size bands.
+# Opt-in until bench_face_plan shows the recall holds: a budget detects large photos at a
+# lower resolution than the bands (e.g. 4_000_000 with FACE_MIN_FACE_PX=40)
+FACE_PIXEL_BUDGET = int(os.getenv("FACE_PIXEL_BUDGET", 0))
+FACE_DETECTION_POLICY = os.getenv("FACE_DETECTION_POLICY", "cnn")
+
 CONFIG = {
     "device": "cuda" if torch.cuda.is_available() else "cpu",
     "labels": {
@@ -19,4 +25,109 @@ CONFIG = {
         "action": os.path.join(BASE_DIR, "features", "action", "text_features_action.pt"),
         "event": os.path.join(BASE_DIR, "features", "event", "text_features_event.pt"),
     },
+    # all label files + feature tensors compiled into one mmap-loaded artifact
+    "label_artifact": {
+        "path": os.getenv("LABEL_ARTIFACT_DIR", os.path.join(BASE_DIR, "artifacts", "labels")),
+        # compare source file checksums with the manifest on load
+        "verify": os.getenv("LABEL_ARTIFACT_VERIFY", "1") == "1",
+    },
+    # decode JPEGs with libjpeg DCT scaling (PIL draft) near the size each model needs
+    "decode": {
+        "jpeg_draft": os.getenv("JPEG_DRAFT_DECODE", "1") == "1",
+    },
+    # opt-in int8 CPU inference for the CLIP image + text towers: "none" | "dynamic"
+    "quantization": os.getenv("CLIP_QUANTIZATION", "none"),
+    # micro-batching of concurrent CLIP image encoder calls
+    "batching": {
+        "max_batch_size": int(os.getenv("CLIP_MAX_BATCH_SIZE", 8)),
+        "max_wait_ms": float(os.getenv("CLIP_MAX_WAIT_MS", 15)),
+    },
+    # forked inference worker processes sharing the loaded weights copy-on-write, 0 -> in-process threads
+    "workers": {
+        "processes": int(os.getenv("INFERENCE_WORKERS", 0)),
+        # torch intra-op threads per worker
+        "threads": int(os.getenv("INFERENCE_WORKER_THREADS", 1)),
+        # jobs run at once per worker, lets its CLIP batcher form batches
+        "concurrency": int(os.getenv("INFERENCE_WORKER_CONCURRENCY", 4)),
+        "timeout": float(os.getenv("INFERENCE_WORKER_TIMEOUT", 120)),
+    },
+    # face detector / encoder settings
+    "face": {
+        # cnn: dlib CNN on every image | hog: HOG only |
+        # cascade: HOG first, CNN only when HOG finds nothing or only small faces.
+        # The cascade only saves time together with the person gate: without it every
+        # image HOG finds no face in (scenery, documents, ...) still goes to the CNN
+        "policy": FACE_DETECTION_POLICY,
+        # upsampling of the CNN pass (also the cascade escalation) and of the HOG pass,
+        # with a pixel budget the CNN upsampling is planned per image up to "upsample"
+        "upsample": int(os.getenv("FACE_UPSAMPLE", 2)),
+        "hog_upsample": int(os.getenv("FACE_HOG_UPSAMPLE", 1)),
+        # a HOG face smaller than this (detector pixels) -> escalate, smaller faces are likely missed
+        "small_face_px": int(os.getenv("FACE_SMALL_FACE_PX", 60)),
+        "pixel_budget": FACE_PIXEL_BUDGET,
+        # smallest face (original image pixels) the planned resolution should still find, budget permitting
+        "min_face_px": int(os.getenv("FACE_MIN_FACE_PX", 40)),
+        # large: 68 point landmarks | small: 5 point (faster)
+        "landmarks": os.getenv("FACE_LANDMARKS", "large"),
+        # re-samples per encoding, higher -> slightly more accurate, linearly slower
+        "jitters": int(os.getenv("FACE_JITTERS", 1)),
+        # images per CNN detector call in the startup backlog (same-size images only), 0 -> one job per image
+        "batch_size": int(os.getenv("FACE_BATCH_SIZE", 16)),
+    },
+    # skip the CNN face detector on images whose CLIP features score confidently low
+    # against "people present" prompts (needs the image features: labeled in the same job or cached)
+    "person_gate": {
+        # on by default with the cascade policy, which relies on it (see CONFIG["face"]["policy"])
+        "enabled": os.getenv("PERSON_GATE", "1" if FACE_DETECTION_POLICY == "cascade" else "0") == "1",
+        # softmax mass of the people prompts below which an image has no people
+        "threshold": float(os.getenv("PERSON_GATE_THRESHOLD", 0.1)),
+        "person_prompts": [
+            "a photo of a person",
+            "a photo of people",
+            "a selfie",
+            "a group photo of friends",
+            "a portrait photo of a face",
+        ],
+        "other_prompts": [
+            "a landscape photo with no people",
+            "a photo of a building",
+            "a photo of an object",
+            "a photo of food",
+            "a photo of an animal",
+            "a screenshot",
+            "a photo of a document",
+        ],
+    },
+    # dlib face detection in a process pool when the inference workers are off, 0 -> inline.
+    # Opt-in like INFERENCE_WORKERS: the pool is forked from the model loader thread while the
+    # server already runs other threads (see InferenceWorkerPool)
+    "face_executor": {
+        "processes": int(os.getenv("FACE_WORKERS", 0)),
+        # queued + running images, 0 -> 2 per process
+        "max_pending": int(os.getenv("FACE_MAX_PENDING", 0)),
+        "timeout": float(os.getenv("FACE_DETECTION_TIMEOUT", 300)),
+        # detector pixels (see detector_pixels) per batch task, keeps a startup batch within the
+        # per-task timeout above, about one 1200px photo at upsample 2
+        "batch_pixels": int(os.getenv("FACE_BATCH_PIXELS", 24_000_000)),
+    },
+    # shared memory slots handing decoded images to the inference workers without pickling,
+    # 0 -> workers get the encoded bytes and decode themselves. Lives in /dev/shm
+    "image_ring": {
+        "slots": int(os.getenv("IMAGE_RING_SLOTS", 0)),
+        "face_max_pixels": int(os.getenv("IMAGE_RING_FACE_MAX_PIXELS", max(1200 * 1200, FACE_PIXEL_BUDGET))),
+    },
+    # CLIP forward pass settings, "auto" values are decided by the startup self-benchmark
+    "execution": {
+        "precision": os.getenv("CLIP_PRECISION", "auto"),  # auto | fp32 | bf16 | fp16
+        "channels_last": os.getenv("CLIP_CHANNELS_LAST", "auto"),  # auto | 1 | 0
+        "compile": os.getenv("CLIP_COMPILE", "0") == "1",
+        # Opt-in: runs warm up + `benchmark_repeat` passes of every candidate (up to 8 with
+        # CLIP_COMPILE, each compiled once) before the model is ready, seconds to minutes on CPU.
+        # Off -> "auto" means fp16 on GPU, fp32 on CPU
+        "self_benchmark": os.getenv("CLIP_POLICY_BENCHMARK", "0") == "1",
+        # min cosine similarity to the fp32 image features
+        "tolerance": float(os.getenv("CLIP_POLICY_TOLERANCE", 0.995)),
+        "benchmark_batch_size": int(os.getenv("CLIP_POLICY_BENCHMARK_BATCH", 4)),
+        "benchmark_repeat": int(os.getenv("CLIP_POLICY_BENCHMARK_REPEAT", 3)),
+    },
 }
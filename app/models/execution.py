@@ -0,0 +1,209 @@
+import itertools
+import time
+from contextlib import contextmanager
+
+import torch
+
+from app.libs.logger.log import log_error, log_info
+
+PRECISIONS = {
+    "fp32": None,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+
+
+class ExecutionPolicy:
+    """
+    How the CLIP model runs a forward pass.
+
+    One object owns every inference setting (autocast dtype, memory format,
+    torch.compile) so callers only write `policy.encode_image(model, images)`
+    instead of stacking context managers at each call site. Every forward pass
+    runs under `torch.inference_mode` and returns float32 features whatever
+    the autocast dtype.
+
+    :param device: device type of the model weights ("cpu" | "cuda")
+    :param precision: "fp32" | "bf16" | "fp16", fp32 disables autocast
+    :param channels_last: run the image tower with NHWC activations (ConvNeXt is conv heavy)
+    :param compile: wrap encode_image with torch.compile
+    """
+
+    def __init__(self, device: str = "cpu", precision: str = "fp32", channels_last: bool = False, compile: bool = False):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported CLIP precision: {precision}")
+        self.device = device
+        self.precision = precision
+        self.autocast_dtype = PRECISIONS[precision]
+        self.channels_last = channels_last
+        self.compile = compile
+        self._encode_image = None
+
+    @property
+    def name(self):
+        parts = [self.device, self.precision]
+        if self.channels_last:
+            parts.append("channels_last")
+        if self.compile:
+            parts.append("compiled")
+        return "/".join(parts)
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "device": self.device,
+            "precision": self.precision,
+            "channels_last": self.channels_last,
+            "compile": self.compile,
+        }
+
+    @contextmanager
+    def inference(self):
+        with torch.inference_mode():
+            if self.autocast_dtype is None:
+                yield
+            else:
+                with torch.autocast(device_type=self.device, dtype=self.autocast_dtype):
+                    yield
+
+    def apply(self, model):
+        """Put the model weights in the memory format of this policy (idempotent)."""
+        memory_format = torch.channels_last if self.channels_last else torch.contiguous_format
+        model.visual.to(memory_format=memory_format)
+        self._encode_image = torch.compile(
+            model.encode_image) if self.compile else model.encode_image
+        return model
+
+    def encode_image(self, model, images: torch.Tensor):
+        if self._encode_image is None:
+            self.apply(model)
+        if self.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        with self.inference():
+            return self._encode_image(images).float()
+
+    def encode_text(self, model, tokens: torch.Tensor):
+        with self.inference():
+            return model.encode_text(tokens).float()
+
+
+def model_device(model):
+    """Device type the model weights live on (quantized models -> cpu)."""
+    for parameter in model.parameters():
+        return parameter.device.type
+    return "cpu"
+
+
+def low_precision(device: str):
+    """Fastest reduced precision autocast supports on this host, None if there is none."""
+    if device == "cuda":
+        return "bf16" if torch.cuda.is_bf16_supported() else "fp16"
+    if device == "cpu" and torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported():
+        return "bf16"
+    return None
+
+
+def default_policy(device: str, config: dict, quantized: bool = False):
+    """Policy used without self-benchmark: the explicit settings, else the safe defaults."""
+    precision = config["precision"]
+    if quantized or precision == "auto":
+        # keep the previous behaviour: fp16 autocast on GPU, fp32 on CPU
+        precision = "fp16" if device == "cuda" and not quantized else "fp32"
+    return ExecutionPolicy(
+        device,
+        precision=precision,
+        channels_last=config["channels_last"] == "1",
+        compile=config["compile"] and not quantized,
+    )
+
+
+def candidate_policies(device: str, config: dict, quantized: bool = False):
+    """Every policy allowed by the config, the fp32 baseline first."""
+    if quantized:
+        # int8 dynamic linear kernels take fp32 activations only
+        precisions = ["fp32"]
+    elif config["precision"] == "auto":
+        precisions = ["fp32"] + [p for p in [low_precision(device)] if p]
+    else:
+        precisions = [config["precision"]]
+
+    if config["channels_last"] == "auto":
+        channels_last = [False, True]
+    else:
+        channels_last = [config["channels_last"] == "1"]
+
+    compile = [False, True] if config["compile"] and not quantized else [False]
+
+    return [
+        ExecutionPolicy(device, precision=p, channels_last=c, compile=k)
+        for p, c, k in itertools.product(precisions, channels_last, compile)
+    ]
+
+
+def select_execution_policy(model, images: torch.Tensor, candidates: list, tolerance: float = 0.995, repeat: int = 3,
+                            tokens: torch.Tensor = None):
+    """
+    Benchmark every candidate policy on a sample batch and keep the fastest one
+    whose image features, and text features of `tokens` when given, stay within
+    `tolerance` cosine similarity of fp32: the policy runs encode_text too.
+
+    :param model: open_clip model (already quantized if requested)
+    :param images: [N, 3, H, W] preprocessed sample batch
+    :param candidates: ExecutionPolicy list, the first one is the reference and always valid
+    :param tokens: [M, context] tokenized sample prompts, None -> image features only
+    :return: (selected policy, {policy name: {"ms": ..., "min_cosine": ..., "accepted": ...}})
+    """
+    reference = ExecutionPolicy(model_device(model))
+    baseline = _normalize(reference.encode_image(model, images))
+    text_baseline = None if tokens is None else _normalize(
+        reference.encode_text(model, tokens))
+
+    report = {}
+    best, best_time = None, float("inf")
+    for policy in candidates:
+        try:
+            policy.apply(model)
+            # first call warms up kernels / compiles the graph
+            features = policy.encode_image(model, images)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                policy.encode_image(model, images)
+                timings.append(time.perf_counter() - start)
+        except Exception as e:
+            log_error(f"Execution policy {policy.name} failed: {e}")
+            report[policy.name] = {"error": str(e), "accepted": False}
+            continue
+
+        min_cosine = (_normalize(features) * baseline).sum(dim=-1).min().item()
+        elapsed = sorted(timings)[len(timings) // 2]
+        accepted = min_cosine >= tolerance
+        report[policy.name] = {
+            "ms": elapsed * 1000,
+            "min_cosine": min_cosine,
+            "accepted": accepted,
+        }
+        if text_baseline is not None:
+            try:
+                text_features = _normalize(policy.encode_text(model, tokens))
+            except Exception as e:
+                log_error(f"Execution policy {policy.name} failed on text: {e}")
+                report[policy.name].update(error=str(e), accepted=False)
+                continue
+            min_text_cosine = (
+                text_features * text_baseline).sum(dim=-1).min().item()
+            accepted = accepted and min_text_cosine >= tolerance
+            report[policy.name].update(
+                min_text_cosine=min_text_cosine, accepted=accepted)
+        if accepted and elapsed < best_time:
+            best, best_time = policy, elapsed
+
+    if best is None:
+        best = reference
+    best.apply(model)
+    log_info(f"Execution policy selected: {best.name} ({report})")
+    return best, report
+
+
+def _normalize(features: torch.Tensor):
+    return features / features.norm(dim=-1, keepdim=True)
@@ -1,81 +1,372 @@
 from io import BytesIO
 import traceback
 import torch
-from collections import defaultdict
 from app.libs.logger.log import log_error, log_info
-from app.models.preprocess import load_features_parallel, load_labels_parallel, read_grouped_items, load_filter_items
+from app.models.batching import ImageBatchEncoder
 from app.models.config import CONFIG
-from app.models.model import FaceCategoryModel
+from app.models.label_artifact import get_label_artifact
+from app.models.label_heads import FusedLabelHeads
+from app.models.model import FaceCategoryModel, plan_face_detection, resize_for_face_detection, split_by_detector_pixels
+from app.models.person_gate import create_person_gate
+from app.services.result_cache import FACES, IMAGE_FEATURES, LABELS, ResultCache, content_key
 from app.services.supabase_service import SupabaseService
-from app.utils.image_utils import load_image_file_from_url, load_image_from_url
+from app.utils.image_utils import decode_image, fetch_image_bytes
 
 
 class AIInferenceService:
-    def __init__(self, model, supabase_service: SupabaseService, face_model: FaceCategoryModel):
+    def __init__(self, model, supabase_service: SupabaseService, face_model: FaceCategoryModel,
+                 result_cache: ResultCache = None):
         self.model = model
         self.face_model = face_model
         self.supabase_service = supabase_service
+        self.result_cache = result_cache
+        # InferenceWorkerPool running run_image_models, None -> in this process
+        self.workers = None
+        # SharedImageRing carrying decoded images to the workers, None -> workers get the bytes
+        self.image_ring = None
+        # FaceDetectionExecutor, None -> face detection runs in the calling thread
+        self.face_executor = None
+        # PersonGate keeping the CNN face detector off images without people, None -> always detect
+        self.person_gate = create_person_gate(model)
+        if self.person_gate is None and face_model is not None and face_model.config["policy"] == "cascade":
+            log_info(
+                "Face detection cascade without the person gate: every image HOG finds no face in runs the CNN")
 
-        # load text features
-        (
-            self.location_filter_text_features,
-            self.location_text_features,
-            self.action_text_features,
-            self.event_text_features,
-        ) = load_features_parallel(CONFIG)
-
-        # load labels
-        (
-            self.location_labels,
-            self.action_labels,
-            self.event_labels,
-        ) = load_labels_parallel(CONFIG)
-        self.location_filter_labels = load_filter_items(
-            CONFIG["labels"]["location_filter"])
-        self.location_group_labels = read_grouped_items(
-            CONFIG["labels"]["location_group"])
+        # labels + pre-normalized text features, one mmap shared by every service
+        load_label_artifact_into(self)
 
     # face model
     def category_face(self, image_url: str):
         try:
-            image_file = load_image_file_from_url(image_url)
-            face_locations, face_encoding = self.face_model.category_image(
-                image_file)
-            return face_locations, face_encoding
+            result = self.analyze_image(
+                image_url, label=False, detect_faces=True)
+            return result["face_locations"], result["face_encodings"]
         except Exception as e:
             log_error(
                 f"Error category face: {e}\n{traceback.format_exc()}")
 
+    # one download + one decode shared by the CLIP and the face model
+    def analyze_image(self, image_url: str, label: bool = True, detect_faces: bool = True):
+        return self.analyze_image_bytes(fetch_image_bytes(image_url), label, detect_faces)
+
+    def analyze_image_bytes(self, image_data: bytes, label: bool = True, detect_faces: bool = True):
+        cache_key = self.cache_key(image_data)
+        result = self.lookup_cache(cache_key, label, detect_faces)
+        run_label = label and "labels" not in result
+        run_faces = detect_faces and "face_locations" not in result
+        if not run_label and not run_faces:
+            return result
+
+        person_hint = None
+        if run_faces and not run_label:
+            # labeled in an earlier job -> gate on the known image features
+            person_hint = self.gate_faces(
+                result, self.cached_image_features(cache_key, result))
+
+        try:
+            result.update(self.run_models(
+                image_data, run_label, run_faces, person_hint))
+        except Exception as e:
+            if not (run_label and run_faces):
+                raise
+            # a worker crash / timeout in the face half takes the whole job down -> keep the labels
+            log_error(f"Image models failed, retrying labels only: {e}")
+            result.update(self.run_models(image_data, True, False))
+            result["face_error"] = f"{type(e).__name__}: {e}"
+
+        # a gated result depends on the gate settings, not only on the face model
+        gated = result.get("person_gate", {}).get("skip", False)
+        self.store_cache(cache_key, result, run_label,
+                         run_faces and not gated and "face_error" not in result)
+        return result
+
+    def run_models(self, image_data: bytes, label: bool, detect_faces: bool, person_hint: bool = None):
+        if self.workers is not None:
+            return self.submit_image_models(
+                image_data, label, detect_faces, person_hint).result(CONFIG["workers"]["timeout"])
+        return self.run_image_models(image_data, label, detect_faces, person_hint)
+
+    def run_image_models(self, image_data: bytes, label: bool = True, detect_faces: bool = True,
+                         person_hint: bool = None):
+        """Decode + CLIP labels and / or face detection of one image, no cache (runs in the inference workers)."""
+        result = {}
+        image, original_size = decode_image(
+            image_data,
+            lambda width, height: self.draft_size(width, height, label, detect_faces))
+
+        if label:
+            image_features = self.model.image_encoder.encode(
+                self.model.preprocess(image))
+            result["labels"] = self.label_image_features(image_features)[0]
+            result["image_features"] = image_features
+            if detect_faces and person_hint is None:
+                person_hint = self.gate_faces(result, image_features)
+
+        if detect_faces:
+            try:
+                face_image, plan = resize_for_face_detection(
+                    image, original_size=original_size)
+                face_locations, face_encodings = self.detect_faces(
+                    face_image, plan, person_hint)
+                result["face_locations"] = face_locations
+                result["face_encodings"] = face_encodings
+            except Exception as e:
+                if not label:
+                    raise
+                # the labels stay usable, the caller retries the faces
+                log_error(
+                    f"Face detection failed: {e}\n{traceback.format_exc()}")
+                result["face_error"] = f"{type(e).__name__}: {e}"
+
+        return result
+
+    def detect_faces(self, face_image, plan, person_hint: bool = None):
+        if self.face_executor is not None:
+            return self.face_executor.detect(face_image, plan, person_hint)
+        return self.face_model.category_image_array(face_image, plan, person_hint)
+
+    def gate_faces(self, result: dict, image_features):
+        """
+        Person gate decision on the image features, stored as result["person_gate"].
+
+        :return: person_hint for face detection, False -> no people
+        """
+        if self.person_gate is None or image_features is None:
+            return None
+        decision = self.person_gate.decide(image_features)
+        result["person_gate"] = decision
+        return False if decision["skip"] else None
+
+    def cached_image_features(self, cache_key: str, result: dict):
+        if "image_features" in result:
+            return result["image_features"]
+        if cache_key is None or self.person_gate is None:
+            return None
+        image_features = self.result_cache.get(
+            cache_key, IMAGE_FEATURES, self.cache_versions()[IMAGE_FEATURES])
+        return None if image_features is None else torch.from_numpy(image_features).unsqueeze(0)
+
+    def analyze_faces_batch(self, image_datas: list, person_hints: list = None):
+        """
+        Face detection of many downloaded images at once (startup backlog).
+
+        :param person_hints: optional person_hint per image (see gate_faces)
+        :return: one (face_locations, face_encodings) per image, or the
+            exception a single image failed with
+        """
+        results = [None] * len(image_datas)
+        person_hints = person_hints or [None] * len(image_datas)
+        cache_keys = [self.cache_key(image_data) for image_data in image_datas]
+        pending, face_images = [], []
+        for i, (image_data, cache_key) in enumerate(zip(image_datas, cache_keys)):
+            cached = self.lookup_cache(cache_key, label=False, detect_faces=True)
+            if cached:
+                results[i] = cached["face_locations"], cached["face_encodings"]
+                continue
+            try:
+                image, original_size = decode_image(
+                    image_data,
+                    lambda width, height: self.draft_size(width, height, label=False, detect_faces=True))
+                face_images.append(resize_for_face_detection(
+                    image, original_size=original_size))
+                pending.append(i)
+            except Exception as e:
+                results[i] = e
+
+        if face_images:
+            hints = [person_hints[i] for i in pending]
+            for i, (face_locations, face_encodings) in zip(pending, self.detect_faces_batch(face_images, hints)):
+                results[i] = face_locations, face_encodings
+                if person_hints[i] is not False:
+                    self.store_cache(cache_keys[i], {"face_locations": face_locations, "face_encodings": face_encodings},
+                                     label=False, detect_faces=True)
+        return results
+
+    def detect_faces_batch(self, face_images: list, person_hints: list = None):
+        """FaceCategoryModel.category_image_batch wherever face detection runs (workers, executor or here)."""
+        if self.workers is not None:
+            # one job per chunk, each fits the per-job timeout
+            person_hints = person_hints or [None] * len(face_images)
+            futures = [self.workers.submit("detect_faces_batch", [face_images[i] for i in chunk],
+                                           [person_hints[i] for i in chunk])
+                       for chunk in split_by_detector_pixels([plan for _, plan in face_images],
+                                                             CONFIG["face_executor"]["batch_pixels"])]
+            return [result for future in futures for result in future.result(CONFIG["workers"]["timeout"])]
+        if self.face_executor is not None:
+            return self.face_executor.detect_batch(face_images, person_hints)
+        return self.face_model.category_image_batch(face_images, person_hints)
+
+    # inference workers
+    def submit_image_models(self, image_data: bytes, label: bool = True, detect_faces: bool = True,
+                            person_hint: bool = None):
+        """run_image_models in an inference worker -> Future, pixels handed over in a ring slot when there is one."""
+        job = None
+        if self.image_ring is not None:
+            job = self.write_image_slot(
+                image_data, label, detect_faces, person_hint)
+        if job is None:
+            return self.workers.submit("run_image_models", image_data, label, detect_faces, person_hint)
+        return self.submit_image_slot(job)
+
+    def write_image_slot(self, image_data: bytes, label: bool = True, detect_faces: bool = True,
+                         person_hint: bool = None):
+        """
+        Decode + preprocess an image straight into a free slot of the shared
+        image ring.
+
+        :return: job dict for run_image_models_slot, None when the face image
+            does not fit in a slot
+        """
+        image, original_size = decode_image(
+            image_data,
+            lambda width, height: self.draft_size(width, height, label, detect_faces))
+
+        face_image = None
+        if detect_faces:
+            face_image, plan = resize_for_face_detection(
+                image, original_size=original_size)
+            if not self.image_ring.fits_face(*face_image.shape[:2]):
+                return None
+
+        index = self.image_ring.acquire(CONFIG["workers"]["timeout"])
+        try:
+            job = {"slot": index, "label": label,
+                   "face_shape": None, "plan": None, "person_hint": person_hint}
+            if label:
+                self.image_ring.write_clip(index, self.model.preprocess(image))
+            if face_image is not None:
+                job["face_shape"] = self.image_ring.write_face(
+                    index, face_image)
+                job["plan"] = plan
+            return job
+        except Exception:
+            self.image_ring.release(index)
+            raise
+
+    def submit_image_slot(self, job: dict):
+        future = self.workers.submit("run_image_models_slot", job)
+        # the worker is done reading the slot once its result / failure is back
+        future.add_done_callback(
+            lambda _: self.image_ring.release(job["slot"]))
+        return future
+
+    def run_image_models_slot(self, job: dict):
+        """run_image_models on an image already decoded into a ring slot (runs in the inference workers)."""
+        result = {}
+        if job["label"]:
+            image_features = self.model.image_encoder.encode(
+                self.image_ring.clip_tensor(job["slot"]))
+            result["labels"] = self.label_image_features(image_features)[0]
+            result["image_features"] = image_features
+
+        person_hint = job["person_hint"]
+        if job["label"] and job["face_shape"] is not None and person_hint is None:
+            person_hint = self.gate_faces(result, image_features)
+
+        if job["face_shape"] is not None:
+            face_locations, face_encodings = self.face_model.category_image_slot(
+                self.image_ring, job["slot"], job["face_shape"], job["plan"], person_hint)
+            result["face_locations"] = face_locations
+            result["face_encodings"] = face_encodings
+
+        return result
+
+    # content-addressed result cache
+    def cache_key(self, image_data: bytes):
+        if self.result_cache is None:
+            return None
+        return content_key(image_data)
+
+    def cache_versions(self):
+        return {
+            IMAGE_FEATURES: self.model.cache_version,
+            LABELS: f"{self.model.cache_version}:{self.label_heads.version}",
+            FACES: self.face_model.cache_version,
+        }
+
+    def lookup_cache(self, cache_key: str, label: bool, detect_faces: bool):
+        """Cached results of the image -> subset of the analyze_image result dict."""
+        if cache_key is None:
+            return {}
+
+        versions = self.cache_versions()
+        result = {}
+        if label:
+            image_features = self.result_cache.get(
+                cache_key, IMAGE_FEATURES, versions[IMAGE_FEATURES])
+            if image_features is not None:
+                result["image_features"] = torch.from_numpy(
+                    image_features).unsqueeze(0)
+                labels = self.result_cache.get(
+                    cache_key, LABELS, versions[LABELS])
+                if labels is None:
+                    # label set changed -> relabel the cached features, no model call
+                    labels = self.label_image_features(
+                        result["image_features"])[0]
+                    self.result_cache.set(
+                        cache_key, LABELS, versions[LABELS], labels)
+                result["labels"] = labels
+        if detect_faces:
+            faces = self.result_cache.get(cache_key, FACES, versions[FACES])
+            if faces is not None:
+                result["face_locations"], result["face_encodings"] = faces
+        if result:
+            log_info(f"Result cache hit for image {cache_key[:12]}")
+        return result
+
+    def store_cache(self, cache_key: str, result: dict, label: bool, detect_faces: bool):
+        if cache_key is None:
+            return
+
+        versions = self.cache_versions()
+        if label:
+            self.result_cache.set(cache_key, IMAGE_FEATURES, versions[IMAGE_FEATURES],
+                                  result["image_features"].squeeze(0).float().cpu().numpy())
+            self.result_cache.set(
+                cache_key, LABELS, versions[LABELS], result["labels"])
+        if detect_faces:
+            self.result_cache.set(cache_key, FACES, versions[FACES],
+                                  (result["face_locations"], result["face_encodings"]))
+
+    def draft_size(self, width: int, height: int, label: bool, detect_faces: bool):
+        """Smallest decode size covering every consumer of the image (None -> full decode)."""
+        if not CONFIG["decode"]["jpeg_draft"]:
+            return None
+        sizes = []
+        if label:
+            sizes.append(self.model.image_size)
+        if detect_faces:
+            sizes.append(plan_face_detection(width, height)["size"])
+        if not sizes:
+            return None
+        return (max(size[0] for size in sizes), max(size[1] for size in sizes))
+
     # image_label model
 
+    def encode_image(self, image_url: str):
+        image, _ = decode_image(
+            fetch_image_bytes(image_url),
+            lambda width, height: self.draft_size(width, height, label=True, detect_faces=False))
+        image = self.model.preprocess(image)
+        # batched with concurrent callers -> [1, D] normalized features
+        return self.model.image_encoder.encode(image)
+
     def is_relate_image(self, image_url: str):
         try:
-            image = self.model.preprocess(load_image_from_url(
-                image_url)).unsqueeze(0)
-            with torch.no_grad(), torch.amp.autocast('cuda'):
-                image_features = self.model.model.encode_image(image)
-                image_features /= image_features.norm(dim=-1, keepdim=True)
-                relate_probs = (100.0 * image_features @
-                                self.location_filter_text_features.T).softmax(dim=-1)
-            _, top_index = torch.topk(relate_probs[0], 1)
-            is_relate = self.location_filter_labels[top_index.item(
-            )]["is_relate"]
-            return is_relate, image_features
+            image_features = self.encode_image(image_url)
+            label = self.label_heads.classify(image_features)[0]
+            return label["relate"]["is_relate"], image_features
         except RuntimeError as e:
             raise RuntimeError(f"Error in is_relate_image: {e}")
 
-    def get_top_labels(self, labels, text_features, image_features):
+    def label_image_features(self, image_features: torch.Tensor):
+        """Label a [N, D] batch of image features -> one result dict per image."""
         try:
-            with torch.no_grad(), torch.amp.autocast('cuda'):
-                probs = (100.0 * image_features @
-                         text_features.T).softmax(dim=-1)
-                labels_probs, labels_indices = torch.topk(probs[0], 2)
-                return [{labels[labels_indices[i].item()]: labels_probs[i].item()}for i in range(2)]
+            return [label["labels"] for label in self.label_heads.classify(image_features)]
         except Exception as e:
-            raise RuntimeError(f"Error in get_top_labels: {e}")
+            raise RuntimeError(f"Error in label_image_features: {e}")
 
     def classify_image(self, image_bucket_id: str, image_name: str, image_id: str):
-        results = defaultdict(list)
         try:
             # use supabase service to get the image_url
             image_url = self.supabase_service.get_image_public_url(
@@ -83,27 +374,10 @@ class AIInferenceService:
 
             log_info(f"Classifying image: {image_name}")
 
-            is_relate, image_features = self.is_relate_image(image_url)
-            if is_relate:
-                location_labels = self.get_top_labels(
-                    self.location_labels, self.location_text_features, image_features)
-                action_labels = self.get_top_labels(
-                    self.action_labels, self.action_text_features, image_features)
-                event_labels = self.get_top_labels(
-                    self.event_labels, self.event_text_features, image_features)
-                results = {
-                    "location_labels": location_labels,
-                    "action_labels": action_labels,
-                    "event_labels": event_labels,
-                }
-            else:
-                results = {
-                    "location_labels": [],
-                    "action_labels": [],
-                    "event_labels": [],
-                }
-
-            return results, image_features
+            result = self.analyze_image(
+                image_url, label=True, detect_faces=False)
+
+            return result["labels"], result["image_features"]
         except RuntimeError as e:
             raise RuntimeError(f"Error in classify_image: {e}")
 
@@ -112,64 +386,63 @@ class AILabelTestService:
     def __init__(self, model):
         self.model = model
 
-        # load text features
-        (
-            self.location_filter_text_features,
-            self.location_text_features,
-            self.action_text_features,
-            self.event_text_features,
-        ) = load_features_parallel(CONFIG)
-
-        # load labels
-        (
-            self.location_labels,
-            self.action_labels,
-            self.event_labels,
-        ) = load_labels_parallel(CONFIG)
-        self.location_filter_labels = load_filter_items(
-            CONFIG["labels"]["location_filter"])
-        self.location_group_labels = read_grouped_items(
-            CONFIG["labels"]["location_group"])
+        # labels + pre-normalized text features, one mmap shared by every service
+        load_label_artifact_into(self)
 
        # testing function
     def return_relate_status_with_name(self, image_file):
         try:
-            image = self.model.preprocess(image_file).unsqueeze(0)
-            with torch.no_grad(), torch.amp.autocast('cuda'):
-                image_features = self.model.model.encode_image(image)
-                image_features /= image_features.norm(dim=-1, keepdim=True)
-                relate_probs = (100.0 * image_features @
-                                self.location_filter_text_features.T).softmax(dim=-1)
-            _, top_index = torch.topk(relate_probs[0], 1)
-            result = self.location_filter_labels[top_index.item(
-            )]
+            image = self.model.preprocess(image_file)
+            image_features = self.model.image_encoder.encode(image)
+            result = self.label_heads.classify(image_features)[0]["relate"]
             return result['name'], result['is_relate'], image_features
         except RuntimeError as e:
             raise RuntimeError(f"Error in detect relate status: {e}")
 
-    def get_top_labels(self, labels, text_features, image_features):
-        try:
-            with torch.no_grad(), torch.amp.autocast('cuda'):
-                probs = (100.0 * image_features @
-                         text_features.T).softmax(dim=-1)
-                labels_probs, labels_indices = torch.topk(probs[0], 2)
-                return [{labels[labels_indices[i].item()]: labels_probs[i].item()}for i in range(2)]
-        except Exception as e:
-            raise RuntimeError(f"Error in get_top_labels: {e}")
-
     # function return all labels after relate status
     def return_all_labels(self, image_features):
         try:
-            location_labels = self.get_top_labels(
-                self.location_labels, self.location_text_features, image_features)
-            action_labels = self.get_top_labels(
-                self.action_labels, self.action_text_features, image_features)
-            event_labels = self.get_top_labels(
-                self.event_labels, self.event_text_features, image_features)
+            top_probs, top_indices = self.label_heads.top_k_per_head(
+                image_features)
+            probs, indices = top_probs[0], top_indices[0]
+            # head 0 is the location filter, labels are returned regardless of it
             return {
-                "location_labels": location_labels,
-                "action_labels": action_labels,
-                "event_labels": event_labels,
+                "location_labels": [{self.location_labels[i]: p} for i, p in zip(indices[1], probs[1])],
+                "action_labels": [{self.action_labels[i]: p} for i, p in zip(indices[2], probs[2])],
+                "event_labels": [{self.event_labels[i]: p} for i, p in zip(indices[3], probs[3])],
             }
         except RuntimeError as e:
             raise RuntimeError(f"Error in return all labels: {e}")
+
+
+def init_inference_worker(service: AIInferenceService):
+    """InferenceWorkerPool initializer: runs in each forked worker."""
+    # threads are not copied by fork -> a fresh batcher, no inherited queue
+    service.model.image_encoder = ImageBatchEncoder(
+        service.model.encode_images, **CONFIG["batching"])
+    service.workers = None
+    service.face_executor = None
+    # the API process reads / writes the cache
+    service.result_cache = None
+    torch.set_num_threads(CONFIG["workers"]["threads"])
+
+
+def load_label_artifact_into(service):
+    artifact = get_label_artifact()
+
+    # text features (views of the fused matrix)
+    service.location_filter_text_features = artifact.head_features(
+        "location_filter")
+    service.location_text_features = artifact.head_features("location")
+    service.action_text_features = artifact.head_features("action")
+    service.event_text_features = artifact.head_features("event")
+
+    # labels
+    service.location_labels = artifact.labels["location"]
+    service.action_labels = artifact.labels["action"]
+    service.event_labels = artifact.labels["event"]
+    service.location_filter_labels = artifact.labels["location_filter"]
+    service.location_group_labels = artifact.location_group
+
+    # all four heads fused into one matrix -> one matmul per image batch
+    service.label_heads = FusedLabelHeads.from_artifact(artifact)
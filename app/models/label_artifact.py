@@ -0,0 +1,215 @@
+"""
+Label artifact: every label file and text-feature tensor compiled into one
+directory that loads with a single mmap.
+
+    manifest.json          labels, filter items, location groups, head offsets,
+                           matrix shape / dtype, sha256 of every source file
+    features-<sha>.npy     pre-normalized [K, D] float32 matrix of all heads
+
+Build it ahead of deploys with
+
+    python -m app.models.label_artifact [--output DIR]
+
+At startup get_label_artifact() loads it (rebuilding it when missing or when
+a label / feature file changed since the build) and every service instance
+in the process shares the same read-only matrix; worker processes share its
+page cache.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+import warnings
+
+import numpy as np
+import torch
+
+from app.libs.logger.log import log_info
+from app.models.config import CONFIG
+from app.models.label_heads import FILTER_HEAD, LABEL_HEADS
+from app.models.preprocess import load_features_parallel, load_filter_items, load_labels_parallel, read_grouped_items
+
+ARTIFACT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+HEAD_NAMES = [FILTER_HEAD] + list(LABEL_HEADS)
+
+
+class StaleArtifactError(RuntimeError):
+    pass
+
+
+class LabelArtifact:
+    """Loaded artifact: the fused [K, D] matrix plus everything needed to read its rows."""
+
+    def __init__(self, manifest: dict, weight: torch.Tensor):
+        self.manifest = manifest
+        self.weight = weight
+        self.offsets = {name: tuple(offset)
+                        for name, offset in manifest["offsets"].items()}
+        self.labels = manifest["labels"]
+        self.location_group = manifest["location_group"]
+        self.checksum = manifest["checksum"]
+
+    def head_features(self, name: str):
+        start, end = self.offsets[name]
+        return self.weight[start:end]
+
+
+def source_files(config: dict = CONFIG):
+    files = {f"features/{name}": path for name,
+             path in config["features"].items()}
+    files.update({f"labels/{name}": path for name,
+                 path in config["labels"].items()})
+    return files
+
+
+def file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_checksums(config: dict = CONFIG):
+    return {name: file_sha256(path) for name, path in sorted(source_files(config).items())}
+
+
+def build_label_artifact(output_dir: str = None, config: dict = CONFIG):
+    """Compile the label files + feature tensors into output_dir -> manifest dict."""
+    output_dir = output_dir or config["label_artifact"]["path"]
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.time()
+
+    (
+        location_filter_text_features,
+        location_text_features,
+        action_text_features,
+        event_text_features,
+    ) = load_features_parallel(config)
+    location_labels, action_labels, event_labels = load_labels_parallel(config)
+    text_features = {
+        "location_filter": location_filter_text_features,
+        "location": location_text_features,
+        "action": action_text_features,
+        "event": event_text_features,
+    }
+    labels = {
+        "location_filter": load_filter_items(config["labels"]["location_filter"]),
+        "location": location_labels,
+        "action": action_labels,
+        "event": event_labels,
+    }
+
+    weights, offsets, row = [], {}, 0
+    for name in HEAD_NAMES:
+        features = text_features[name].float()
+        if len(labels[name]) != features.shape[0]:
+            raise ValueError(
+                f"Head {name} has {features.shape[0]} features but {len(labels[name])} labels")
+        weights.append(features / features.norm(dim=-1, keepdim=True))
+        offsets[name] = [row, row + features.shape[0]]
+        row += features.shape[0]
+    weight = torch.cat(weights, dim=0).contiguous().numpy().astype(np.float32)
+
+    checksums = source_checksums(config)
+    checksum = hashlib.sha256(json.dumps(
+        checksums, sort_keys=True).encode("utf-8")).hexdigest()
+    features_file = f"features-{checksum[:12]}.npy"
+
+    # data file first, manifest last (atomic rename) -> readers never see a half-built artifact
+    tmp = os.path.join(output_dir, f".{features_file}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, weight)
+    os.replace(tmp, os.path.join(output_dir, features_file))
+
+    manifest = {
+        "version": ARTIFACT_VERSION,
+        "checksum": checksum,
+        "sources": checksums,
+        "features_file": features_file,
+        "dtype": "float32",
+        "shape": list(weight.shape),
+        "offsets": offsets,
+        "labels": labels,
+        "location_group": read_grouped_items(config["labels"]["location_group"]),
+    }
+    tmp = os.path.join(output_dir, f".{MANIFEST_FILE}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(output_dir, MANIFEST_FILE))
+
+    # older builds; processes still mapping them keep their inode
+    for path in glob.glob(os.path.join(output_dir, "features-*.npy")):
+        if os.path.basename(path) != features_file:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    log_info(
+        f"Label artifact built in {output_dir}: {weight.shape[0]} labels in {time.time() - start:.2f} seconds")
+    return manifest
+
+
+def load_label_artifact(path: str = None, config: dict = CONFIG, verify: bool = True):
+    """Open the artifact with mmap; StaleArtifactError when a source file changed since the build."""
+    path = path or config["label_artifact"]["path"]
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise StaleArtifactError(f"No label artifact in {path}")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != ARTIFACT_VERSION:
+        raise StaleArtifactError(
+            f"Label artifact version {manifest.get('version')} != {ARTIFACT_VERSION}")
+    if verify and manifest["sources"] != source_checksums(config):
+        raise StaleArtifactError(
+            "Label artifact is stale, label or feature files changed")
+
+    weight = np.load(os.path.join(
+        path, manifest["features_file"]), mmap_mode="r")
+    if list(weight.shape) != manifest["shape"]:
+        raise StaleArtifactError("Label artifact matrix does not match its manifest")
+    with warnings.catch_warnings():
+        # read-only mmap: the matrix is never written
+        warnings.simplefilter("ignore", UserWarning)
+        weight = torch.from_numpy(weight)
+    return LabelArtifact(manifest, weight)
+
+
+_artifact = None
+_artifact_lock = threading.Lock()
+
+
+def get_label_artifact(config: dict = CONFIG):
+    """Process-wide artifact, (re)built on first use when missing or stale."""
+    global _artifact
+    with _artifact_lock:
+        if _artifact is None:
+            settings = config["label_artifact"]
+            try:
+                _artifact = load_label_artifact(
+                    settings["path"], config, verify=settings["verify"])
+            except StaleArtifactError as e:
+                log_info(f"{e}, rebuilding")
+                build_label_artifact(settings["path"], config)
+                _artifact = load_label_artifact(settings["path"], config)
+        return _artifact
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", default=CONFIG["label_artifact"]["path"])
+    args = parser.parse_args()
+    manifest = build_label_artifact(args.output)
+    print(json.dumps({key: manifest[key] for key in (
+        "checksum", "features_file", "shape", "offsets")}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+
+import torch
+
+# head name -> key of the label list in the classify_image result
+LABEL_HEADS = {
+    "location": "location_labels",
+    "action": "action_labels",
+    "event": "event_labels",
+}
+FILTER_HEAD = "location_filter"
+
+
+def empty_label_results():
+    return {result_key: [] for result_key in LABEL_HEADS.values()}
+
+
+class FusedLabelHeads:
+    """
+    All label heads (location filter, location, action, event) packed into one
+    pre-normalized [K, D] text-feature matrix with an offset table per head.
+
+    One matmul scores a whole [N, D] image feature batch against every label,
+    then a segmented softmax / top-k is taken per head and all results are
+    moved to Python with a single `tolist()` instead of one `.item()` per label.
+
+    :param text_features: {head_name: [K_head, D] tensor}, must contain FILTER_HEAD
+    :param labels: {head_name: list of labels}, FILTER_HEAD labels are the
+        {"name", "is_relate"} items returned by load_filter_items
+    :param top_k: number of labels returned per head
+    """
+
+    def __init__(self, text_features: dict, labels: dict, top_k: int = 2):
+        self.head_names = [FILTER_HEAD] + list(LABEL_HEADS)
+        self.labels = labels
+        self.top_k = top_k
+
+        weights = []
+        self.offsets = {}
+        start = 0
+        for name in self.head_names:
+            features = text_features[name].float()
+            if len(labels[name]) != features.shape[0]:
+                raise ValueError(
+                    f"Head {name} has {features.shape[0]} features but {len(labels[name])} labels")
+            if features.shape[0] < top_k:
+                raise ValueError(
+                    f"Head {name} has fewer than {top_k} labels")
+            weights.append(features / features.norm(dim=-1, keepdim=True))
+            self.offsets[name] = (start, start + features.shape[0])
+            start += features.shape[0]
+
+        self._set_weight(torch.cat(weights, dim=0).contiguous())
+
+    @classmethod
+    def from_artifact(cls, artifact, top_k: int = 2):
+        """Heads reading the pre-normalized (mmap) matrix of a LabelArtifact, no copy."""
+        heads = cls.__new__(cls)
+        heads.head_names = [FILTER_HEAD] + list(LABEL_HEADS)
+        heads.labels = artifact.labels
+        heads.top_k = top_k
+        heads.offsets = {name: artifact.offsets[name]
+                         for name in heads.head_names}
+        for name, (start, end) in heads.offsets.items():
+            if end - start < top_k:
+                raise ValueError(
+                    f"Head {name} has fewer than {top_k} labels")
+        heads._set_weight(artifact.weight)
+        return heads
+
+    def _set_weight(self, weight: torch.Tensor):
+        self.weight = weight
+        # identifies the label set, e.g. for caching label outputs
+        self.version = hashlib.sha1(json.dumps(
+            [self.labels[name] for name in self.head_names] + [list(weight.shape), self.top_k]).encode("utf-8")).hexdigest()[:12]
+
+    def scores(self, image_features: torch.Tensor):
+        """Return [N, K] probabilities, softmax taken separately per head."""
+        with torch.no_grad():
+            logits = 100.0 * image_features.to(self.weight.dtype) @ self.weight.T
+            probs = torch.empty_like(logits)
+            for start, end in self.offsets.values():
+                probs[:, start:end] = logits[:, start:end].softmax(dim=-1)
+        return probs
+
+    def top_k_per_head(self, image_features: torch.Tensor):
+        """Return ([N, H, k] probabilities, [N, H, k] label indices) as Python lists."""
+        probs = self.scores(image_features)
+        with torch.no_grad():
+            top_probs, top_indices = [], []
+            for start, end in self.offsets.values():
+                values, indices = torch.topk(probs[:, start:end], self.top_k)
+                top_probs.append(values)
+                top_indices.append(indices)
+            top_probs = torch.stack(top_probs, dim=1)
+            top_indices = torch.stack(top_indices, dim=1)
+        return top_probs.tolist(), top_indices.tolist()
+
+    def classify(self, image_features: torch.Tensor):
+        """
+        Label a [N, D] batch of normalized image features.
+
+        :return: one dict per image with the matched location filter item
+            ({"name", "is_relate"}) and the labels in classify_image format
+            (empty lists when the image is not related)
+        """
+        if image_features.dim() == 1:
+            image_features = image_features.unsqueeze(0)
+
+        top_probs, top_indices = self.top_k_per_head(image_features)
+
+        results = []
+        for probs, indices in zip(top_probs, top_indices):
+            relate = self.labels[FILTER_HEAD][indices[0][0]]
+            labels = empty_label_results()
+            if relate["is_relate"]:
+                for head, (name, result_key) in enumerate(LABEL_HEADS.items(), start=1):
+                    labels[result_key] = [
+                        {self.labels[name][index]: prob}
+                        for index, prob in zip(indices[head], probs[head])
+                    ]
+            results.append({"relate": relate, "labels": labels})
+        return results
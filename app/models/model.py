@@ -1,21 +1,34 @@
 from io import BytesIO
+import math
 import traceback
-import open_clip
+import numpy as np
 import torch
 from app.libs.logger.log import log_error, log_info
+from app.models.batching import ImageBatchEncoder
 from app.models.config import CONFIG
+from app.models.execution import candidate_policies, default_policy, model_device, select_execution_policy
 import time
-import face_recognition
-import dlib
 import os
 from PIL import Image, ImageDraw
 import datetime
 import os
 
+# text side of the execution policy benchmark: a search query, label prompts, a long query
+BENCHMARK_PROMPTS = [
+    "dog",
+    "a photo of a beach at sunset",
+    "a screenshot of a document",
+    "a group of friends smiling at a birthday party with a cake and candles",
+]
+
 
 class AIModel:
-    def __init__(self):
+    def __init__(self, quantization: str = None):
+        # imported here: open_clip (+ timm) is slow to import, keep it off the app.main import path
+        import open_clip
+
         self.device = CONFIG["device"]
+        self.quantization = quantization or CONFIG["quantization"]
         log_info(f"CUDA Available: {torch.cuda.is_available()}")
         if torch.cuda.is_available():
             log_info(f"CUDA Device: {torch.cuda.get_device_name()}")
@@ -24,25 +37,143 @@ class AIModel:
         self.model, _, self.preprocess = open_clip.create_model_and_transforms(
             'convnext_base', pretrained='laion400m_s13b_b51k')
         self.model.eval()
+        if self.device != "cpu":
+            # quantized kernels are CPU only
+            self.quantization = "none"
+        self.model = quantize_clip_model(self.model, self.quantization)
+        # identifies the weights producing cached image features
+        self.cache_version = "convnext_base/laion400m_s13b_b51k"
+        if self.quantization != "none":
+            self.cache_version += f"/{self.quantization}"
         self.tokenizer = open_clip.get_tokenizer("ViT-B-32")
+        image_size = getattr(self.model.visual, "image_size", 224)
+        self.image_size = tuple(image_size) if isinstance(
+            image_size, (tuple, list)) else (image_size, image_size)
+        self.execution_policy, self.execution_report = self.select_execution_policy()
+        if self.execution_policy.precision != "fp32":
+            # reduced precision features differ slightly: keep them apart in
+            # the result cache and the text embedding cache
+            self.cache_version += f"/{self.execution_policy.precision}"
+        self.image_encoder = ImageBatchEncoder(
+            self.encode_images, **CONFIG["batching"])
         log_info("CLIP mode done loading")
 
+    def select_execution_policy(self):
+        """Pick precision / memory format / compile, benchmarked on the warm up image."""
+        config = CONFIG["execution"]
+        device = model_device(self.model)
+        quantized = self.quantization != "none"
+        candidates = candidate_policies(device, config, quantized)
+        if not config["self_benchmark"] or len(candidates) == 1:
+            policy = default_policy(device, config, quantized)
+            policy.apply(self.model)
+            log_info(f"Execution policy: {policy.name}")
+            return policy, {}
+
+        try:
+            start = time.time()
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            image = Image.open(os.path.join(
+                current_dir, "../utils/image/warm_up.jpg")).convert("RGB")
+            # flipped / rotated copies -> a less degenerate sample batch
+            variants = [image, image.transpose(Image.Transpose.FLIP_LEFT_RIGHT),
+                        image.rotate(90, expand=True), image.rotate(270, expand=True)]
+            images = torch.stack([
+                self.preprocess(variants[i % len(variants)])
+                for i in range(config["benchmark_batch_size"])
+            ])
+            # the policy runs the text tower too (search queries, label prompts)
+            tokens = self.tokenizer(BENCHMARK_PROMPTS)
+            policy, report = select_execution_policy(
+                self.model, images, candidates, config["tolerance"], config["benchmark_repeat"], tokens)
+            log_info(
+                f"Execution policy benchmark took {time.time() - start:.2f} seconds")
+            return policy, report
+        except Exception as e:
+            log_error(
+                f"Execution policy benchmark failed: {e}\n{traceback.format_exc()}")
+            policy = default_policy(device, config, quantized)
+            policy.apply(self.model)
+            return policy, {}
+
+    def warm_up(self):
+        """One image + one text pass, so the first request does not pay for lazy init."""
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        image = Image.open(os.path.join(
+            current_dir, "../utils/image/warm_up.jpg")).convert("RGB")
+        self.encode_images(self.preprocess(image).unsqueeze(0))
+        self.get_text_features("a photo")
+
+    def encode_images(self, images: torch.Tensor):
+        image_features = self.execution_policy.encode_image(self.model, images)
+        return image_features / image_features.norm(dim=-1, keepdim=True)
+
     def get_text_features(self, text: str):
-        with torch.no_grad(), torch.amp.autocast('cuda'):
-            tokenizer_text = self.tokenizer(text)
-            text_features = self.model.encode_text(tokenizer_text)
-            text_features /= text_features.norm(dim=-1, keepdim=True)
-        return text_features
+        tokenizer_text = self.tokenizer(text)
+        text_features = self.execution_policy.encode_text(
+            self.model, tokenizer_text)
+        return text_features / text_features.norm(dim=-1, keepdim=True)
+
+
+def quantize_clip_model(model, mode: str):
+    """
+    Apply int8 quantization to the CLIP image and text towers.
+
+    "dynamic" converts every nn.Linear (ConvNeXt MLP blocks, text transformer
+    MLPs, projections; ~70% of the weights) to int8 weights with activations
+    quantized on the fly. Quantized kernels only run on CPU.
+
+    :param mode: "none" or "dynamic"
+    :return: the model to use for inference
+    """
+    if mode in (None, "none"):
+        return model
+    if mode != "dynamic":
+        raise ValueError(f"Unsupported CLIP quantization mode: {mode}")
+
+    start = time.time()
+    # open_clip reads the text tower cast dtype from this layer's weight -> keep it fp32
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if type(module) is torch.nn.Linear and name != "transformer.resblocks.0.mlp.c_fc"
+    }
+    quantized = torch.ao.quantization.quantize_dynamic(
+        model, qconfig_spec, dtype=torch.qint8)
+    log_info(
+        f"CLIP model quantized ({mode} int8) in {time.time() - start:.2f} seconds")
+    return quantized
+
+
+FACE_POLICIES = ("cnn", "hog", "cascade")
 
 
 class FaceCategoryModel:
-    def __init__(self):
-        if dlib.DLIB_USE_CUDA:
+    """
+    dlib face detection + encoding (face_recognition).
+
+    :param config: overrides of CONFIG["face"] (policy, upsample, landmarks, ...)
+    """
+
+    def __init__(self, config: dict = None):
+        import dlib
+        import face_recognition
+
+        self.config = {**CONFIG["face"], **(config or {})}
+        if self.config["policy"] not in FACE_POLICIES:
+            raise ValueError(
+                f"Unknown face detection policy {self.config['policy']}, expected one of {FACE_POLICIES}")
+
+        self.use_cuda = dlib.DLIB_USE_CUDA
+        if self.use_cuda:
             log_info("DLIB is using CUDA")
         else:
             log_info("DLIB is using CPU")
 
+        self.dlib = dlib
         self.model = face_recognition
+        # identifies the detector settings producing cached face results
+        self.cache_version = face_cache_version(self.config)
 
         # warm up model
         # try:
@@ -73,106 +204,334 @@ class FaceCategoryModel:
             #     image_file.seek(0)
 
             # Use the improved image loader
-            image, ratio = load_image_file(image_file)
-            log_info(f"Image loaded and processed with resize ratio: {ratio}")
-
-            # Face detection
-            face_locations = self.model.face_locations(
-                image, model="cnn", number_of_times_to_upsample=2)
-            log_info(f"Found {len(face_locations)} faces in image")
-
-            # Face encoding
-            face_encodings = self.model.face_encodings(
-                image, face_locations, model="large")
-
-            # If ratio was applied, scale face locations back to original dimensions
-            if ratio > 0 and ratio != 1:
-                if ratio < 1:  # We scaled down
-                    inverse_ratio = 1/ratio
-                else:  # We divided by ratio
-                    inverse_ratio = ratio
-
-                # Scale face locations back to original dimensions
-                face_locations = [(int(top*inverse_ratio), int(right*inverse_ratio),
-                                   int(bottom*inverse_ratio), int(left*inverse_ratio))
-                                  for top, right, bottom, left in face_locations]
-
-            # # If faces were detected, save the image with bounding boxes
-            # if face_locations and len(face_locations) > 0:
-            #     # Reset file position to beginning for saving
-            #     if hasattr(image_file, 'seek'):
-            #         image_file.seek(0)
-            #     # Save image with face bounding boxes
-            #     save_image_with_faces(image_file, face_locations)
-            #     # Reset file position
-            #     if hasattr(image_file, 'seek'):
-            #         image_file.seek(pos)
-
-            return face_locations, face_encodings
+            image, plan = load_image_file(image_file)
+            log_info(f"Image loaded and processed with face detection plan: {plan}")
+
+            return self.category_image_array(image, plan)
         except Exception as e:
             log_error(f"Error in face categorization: {e}")
             log_error(traceback.format_exc())
             raise Exception(e)
 
+    def category_image_slot(self, image_ring, index: int, face_shape, plan, person_hint: bool = None):
+        """category_image_array of a face image already decoded into a SharedImageRing slot."""
+        return self.category_image_array(image_ring.face_array(index, *face_shape), plan, person_hint)
+
+    def category_image_array(self, image, plan, person_hint: bool = None):
+        """
+        Detect + encode faces of an already decoded and resized image.
+
+        :param image: numpy RGB array returned by resize_for_face_detection
+        :param plan: face detection plan returned alongside the array
+        :param person_hint: False when the image is known not to show people,
+            the CNN detector is then not run (cnn policy: no detection,
+            hog / cascade: the HOG result only)
+        :return: (face_locations in original image coordinates, face_encodings)
+        """
+        # Face detection
+        face_locations, detector = self.detect_face_locations(
+            image, person_hint, plan["upsample"])
+        log_info(f"Found {len(face_locations)} faces in image ({detector})")
+
+        # Face encoding
+        face_encodings = self.model.face_encodings(
+            image, face_locations, num_jitters=self.config["jitters"], model=self.config["landmarks"])
+
+        return scale_face_locations(face_locations, plan), face_encodings
+
+    def category_image_batch(self, images, person_hints=None):
+        """
+        category_image_array of many images at once (startup backlog).
+
+        The CNN detector runs on batches of same-size images
+        (batch_face_locations, one detector call per batch on the GPU) and
+        the encodings of every face of the batch come from one dlib call.
+
+        :param images: list of (numpy RGB array, plan) from resize_for_face_detection
+        :param person_hints: optional person_hint per image (see category_image_array)
+        :return: list of (face_locations, face_encodings), in the order of `images`
+        """
+        config = self.config
+        person_hints = person_hints or [None] * len(images)
+        locations = [None] * len(images)
+        if config["policy"] == "cnn":
+            escalate = [i for i in range(len(images))
+                        if person_hints[i] is not False]
+            for i in set(range(len(images))) - set(escalate):
+                locations[i] = []
+        else:
+            escalate = []
+            for i, (image, _) in enumerate(images):
+                locations[i] = self.model.face_locations(
+                    image, model="hog", number_of_times_to_upsample=config["hog_upsample"])
+                if config["policy"] == "cascade" and self._escalation(locations[i], person_hints[i]):
+                    escalate.append(i)
+
+        # the CNN batches images of one size (and upsampling) only
+        by_shape = {}
+        for i in escalate:
+            image, plan = images[i]
+            by_shape.setdefault((image.shape, plan["upsample"]), []).append(i)
+        for (_, upsample), indices in by_shape.items():
+            for start in range(0, len(indices), config["batch_size"]):
+                chunk = indices[start:start + config["batch_size"]]
+                batch_locations = self.model.batch_face_locations(
+                    [images[i][0] for i in chunk], number_of_times_to_upsample=upsample,
+                    batch_size=len(chunk))
+                for i, face_locations in zip(chunk, batch_locations):
+                    locations[i] = face_locations
+
+        log_info(
+            f"Found {sum(len(face_locations) for face_locations in locations)} faces in {len(images)} images "
+            f"({len(escalate)} on the CNN in {len(by_shape)} size groups)")
+        encodings = self.batch_face_encodings(
+            [image for image, _ in images], locations)
+        return [(scale_face_locations(face_locations, plan), face_encodings)
+                for (_, plan), face_locations, face_encodings in zip(images, locations, encodings)]
+
+    def batch_face_encodings(self, images, locations):
+        """face_encodings of several images with one dlib call -> list of encoding lists."""
+        api = self.model.api
+        encodings = [[] for _ in images]
+        with_faces = [i for i, face_locations in enumerate(locations) if face_locations]
+        if not with_faces:
+            return encodings
+
+        batch_shapes = []
+        for i in with_faces:
+            shapes = self.dlib.full_object_detections()
+            shapes.extend(raw_face_landmarks(
+                api, self.dlib, images[i], locations[i], self.config["landmarks"]))
+            batch_shapes.append(shapes)
+        descriptors = api.face_encoder.compute_face_descriptor(
+            [images[i] for i in with_faces], batch_shapes, self.config["jitters"])
+        for i, image_descriptors in zip(with_faces, descriptors):
+            encodings[i] = [np.array(descriptor)
+                            for descriptor in image_descriptors]
+        return encodings
+
+    def detect_face_locations(self, image, person_hint: bool = None, upsample: int = None):
+        """Face locations in detector image coordinates + the detector path that produced them."""
+        config = self.config
+        if upsample is None:
+            upsample = config["upsample"]
+        if config["policy"] == "cnn":
+            if person_hint is False:
+                return [], "skipped (no people)"
+            return self.model.face_locations(
+                image, model="cnn", number_of_times_to_upsample=upsample), "cnn"
+
+        face_locations = self.model.face_locations(
+            image, model="hog", number_of_times_to_upsample=config["hog_upsample"])
+        if config["policy"] == "hog":
+            return face_locations, "hog"
+
+        reason = self._escalation(face_locations, person_hint)
+        if reason is None:
+            return face_locations, "hog"
+
+        return self.model.face_locations(
+            image, model="cnn", number_of_times_to_upsample=upsample), f"cnn ({reason})"
+
+    def _escalation(self, face_locations, person_hint: bool = None):
+        """
+        Why the cascade reruns an image on the CNN after HOG found `face_locations`, None -> keep them.
+
+        Only the person gate (person_hint False) keeps an image HOG finds no
+        face in off the CNN; without it the cascade saves time on the images
+        with large faces only.
+        """
+        if person_hint is False:
+            return None
+        if not face_locations:
+            return "hog-empty"
+        if min(min(bottom - top, right - left) for top, right, bottom, left in face_locations) < self.config["small_face_px"]:
+            # HOG misses faces smaller than its 80px window -> the others in the picture are likely missed too
+            return "hog-small-faces"
+        return None
 
-def load_image_file(file, mode='RGB'):
+
+def raw_face_landmarks(api, dlib, image, face_locations, model: str = "large"):
+    """
+    dlib landmark shapes of the faces, as face_recognition.api computes them
+    for face_encodings. Uses its private _raw_face_landmarks when present,
+    else the public shape predictors of the module.
+    """
+    if hasattr(api, "_raw_face_landmarks"):
+        return api._raw_face_landmarks(image, face_locations, model)
+    predictor = api.pose_predictor_5_point if model == "small" else api.pose_predictor_68_point
+    return [predictor(image, dlib.rectangle(left, top, right, bottom))
+            for top, right, bottom, left in face_locations]
+
+
+def scale_face_locations(face_locations, plan):
+    """Face locations of the resized detector image -> original image coordinates."""
+    scale_x, scale_y = plan["scale"]
+    if scale_x == 1 and scale_y == 1:
+        return face_locations
+    return [(round(top * scale_y), round(right * scale_x), round(bottom * scale_y), round(left * scale_x))
+            for top, right, bottom, left in face_locations]
+
+
+def face_cache_version(config: dict):
+    """Cache version of the face results of a CONFIG["face"]-like dict."""
+    version = f"{config['policy']}-upsample{config['upsample']}-{config['landmarks']}"
+    if config["policy"] != "cnn":
+        version += f"-hog{config['hog_upsample']}"
+    if config["policy"] == "cascade":
+        version += f"-small{config['small_face_px']}"
+    if config["jitters"] != 1:
+        version += f"-jitter{config['jitters']}"
+    if config.get("pixel_budget", 0) > 0:
+        version += f"-budget{config['pixel_budget']}-min{config['min_face_px']}"
+    return version
+
+
+def load_image_file(file, mode='RGB', draft=None):
     """
     Loads an image file (.jpg, .png, etc) into a numpy array with smart resizing
     to avoid memory issues with large images.
 
     :param file: image file name or file object to load
     :param mode: format to convert the image to. Only 'RGB' and 'L' (grayscale) are supported.
-    :return: tuple of (image contents as numpy array, resize ratio)
+    :param draft: decode JPEGs directly near the target size, defaults to CONFIG["decode"]["jpeg_draft"]
+    :return: tuple of (image contents as numpy array, face detection plan)
     """
-    from PIL import Image
-    import numpy as np
-
     try:
         im = Image.open(file)
-        width, height = im.size
-        w, h = width, height
-
-        log_info(f"Loading image with dimensions: {width}x{height}")
-
-        ratio = -1
-        # Determine appropriate resize ratio based on dimensions
-        if width > 3600 or height > 3600:
-            # Very large images
-            if width > height:
-                ratio = width / 800
-            else:
-                ratio = height / 800
-        elif 1200 <= width <= 1600 or 1200 <= height <= 1600:
-            ratio = 1 / 2
-        elif 1600 <= width <= 3600 or 1600 <= height <= 3600:
-            ratio = 1 / 3
-
-        if ratio > 0:
-            if ratio < 1:
-                # Scale down slightly large images
-                w = int(width * ratio)
-                h = int(height * ratio)
-            else:
-                # Scale down very large images
-                w = int(width / ratio)
-                h = int(height / ratio)
+        if draft is None:
+            draft = CONFIG["decode"]["jpeg_draft"]
+        if draft and im.format == "JPEG":
+            original_size = im.size
+            im.draft(None, plan_face_detection(*im.size)["size"])
+            return resize_for_face_detection(im, mode, original_size=original_size)
+        return resize_for_face_detection(im, mode)
+    except Exception as e:
+        log_error(f"Error loading image: {e}")
+        log_error(traceback.format_exc())
+        raise
 
-            log_info(
-                f"Resizing image from {width}x{height} to {w}x{h} (ratio: {ratio:.2f})")
 
-            # Use modern resampling method (LANCZOS replaces deprecated ANTIALIAS)
-            im = im.resize((w, h), Image.Resampling.LANCZOS)
+# smallest face (pixels) dlib's HOG and CNN detectors find without upsampling
+DETECTOR_MIN_FACE_PX = 80
 
-        if mode:
-            im = im.convert(mode)
 
-        # Convert to numpy array
-        return np.array(im), ratio
+def plan_face_detection(width, height, config: dict = None):
+    """
+    Working resolution + CNN upsampling of the face detector for an image of
+    the given original size.
+
+    With a pixel budget (CONFIG["face"]["pixel_budget"]) the detector scale
+    is the smallest that still finds faces of `min_face_px` original pixels,
+    capped so the detector's working area (resized pixels x 4^upsample)
+    stays within the budget. Shrinking happens here, enlarging through
+    dlib's upsampling, so the image handed to the detector stays small.
+    Without a budget -> the legacy size bands (face_detection_size).
+
+    :return: plan dict: "size" (working width, height), "upsample" and
+        "scale" (original / working size, x and y) to map boxes back exactly
+    """
+    config = config or CONFIG["face"]
+    if config.get("pixel_budget", 0) > 0:
+        budget = config["pixel_budget"]
+        # detector scale relative to the original image
+        scale = min(DETECTOR_MIN_FACE_PX / config["min_face_px"],
+                    math.sqrt(budget / (width * height)), 2 ** config["upsample"])
+        upsample = max(0, math.ceil(math.log2(scale) - 1e-9))
+        resize = scale / 2 ** upsample
+        if resize > 0.9 and width * height * 4 ** upsample <= budget:
+            # not worth a resize pass
+            resize = 1
+        w, h = max(1, round(width * resize)), max(1, round(height * resize))
+    else:
+        w, h, _ = face_detection_size(width, height)
+        upsample = config["upsample"]
+    return {"size": (w, h), "upsample": upsample, "scale": (width / w, height / h)}
+
+
+def detector_pixels(plan):
+    """Working area of the detector for a plan, its cost scales with it."""
+    width, height = plan["size"]
+    return width * height * 4 ** plan["upsample"]
+
+
+def split_by_detector_pixels(plans, max_pixels: int):
+    """Indices of `plans` in consecutive chunks of at most `max_pixels` detector pixels (a larger image: alone)."""
+    chunks, chunk, pixels = [], [], 0
+    for i, plan in enumerate(plans):
+        cost = detector_pixels(plan)
+        if chunk and pixels + cost > max_pixels:
+            chunks.append(chunk)
+            chunk, pixels = [], 0
+        chunk.append(i)
+        pixels += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def face_detection_size(width, height):
+    """
+    Legacy working size of the face detector for an image of the given original size.
 
-    except Exception as e:
-        log_error(f"Error loading image: {e}")
-        log_error(traceback.format_exc())
-        raise
+    :return: tuple of (width, height, resize ratio), ratio is -1 when the image is kept as is
+    """
+    w, h = width, height
+
+    ratio = -1
+    # Determine appropriate resize ratio based on dimensions
+    if width > 3600 or height > 3600:
+        # Very large images
+        if width > height:
+            ratio = width / 800
+        else:
+            ratio = height / 800
+    elif 1200 <= width <= 1600 or 1200 <= height <= 1600:
+        ratio = 1 / 2
+    elif 1600 <= width <= 3600 or 1600 <= height <= 3600:
+        ratio = 1 / 3
+
+    if ratio > 0:
+        if ratio < 1:
+            # Scale down slightly large images
+            w = int(width * ratio)
+            h = int(height * ratio)
+        else:
+            # Scale down very large images
+            w = int(width / ratio)
+            h = int(height / ratio)
+
+    return w, h, ratio
+
+
+def resize_for_face_detection(im, mode='RGB', original_size=None):
+    """
+    Resizes an already opened / decoded PIL image for face detection.
+
+    :param im: PIL image, possibly decoded at a reduced (draft) resolution
+    :param mode: format to convert the image to. Only 'RGB' and 'L' (grayscale) are supported.
+    :param original_size: (width, height) before draft decoding, defaults to im.size
+    :return: tuple of (image contents as numpy array, face detection plan relative to the original size)
+    """
+
+    width, height = original_size or im.size
+    plan = plan_face_detection(width, height)
+    w, h = plan["size"]
+
+    log_info(f"Loading image with dimensions: {width}x{height}")
+
+    if im.size != (w, h):
+        log_info(
+            f"Resizing image from {im.size[0]}x{im.size[1]} to {w}x{h} (upsample: {plan['upsample']})")
+
+        # Use modern resampling method (LANCZOS replaces deprecated ANTIALIAS)
+        im = im.resize((w, h), Image.Resampling.LANCZOS)
+
+    if mode:
+        im = im.convert(mode)
+
+    # Convert to numpy array
+    return np.array(im), plan
 
 
 def save_image_with_faces(image_file, face_locations, output_dir="detected_faces"):
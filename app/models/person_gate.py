@@ -0,0 +1,89 @@
+import threading
+from collections import deque
+
+import torch
+
+from app.libs.logger.log import log_info
+from app.models.config import CONFIG
+
+
+class PersonGate:
+    """
+    Zero-shot "are there people in the photo" score of CLIP image features,
+    used to keep the dlib CNN face detector off scenery, objects and
+    documents.
+
+    The image features are scored against a few "people present" prompts
+    and a few "no people" prompts with one matmul (logit scale of the label
+    heads). The score is the softmax mass of the people prompts; below
+    `threshold` the image is confidently without people.
+
+    Decisions are recorded (counters + the last `audit_size` ones) for
+    /api/inference-stats; the durable record is on the image row
+    (person_gate_score / person_gate_skipped), written with the face flag.
+
+    :param person_features: [P, D] text features of the people prompts
+    :param other_features: [Q, D] text features of the no-people prompts
+    """
+
+    def __init__(self, person_features: torch.Tensor, other_features: torch.Tensor, threshold: float = 0.1,
+                 audit_size: int = 200):
+        weight = torch.cat([person_features, other_features]).float()
+        self.weight = weight / weight.norm(dim=-1, keepdim=True)
+        self.person_count = person_features.shape[0]
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._stats = {"checked": 0, "skipped": 0}
+        self._recent = deque(maxlen=audit_size)
+
+    @classmethod
+    def from_prompts(cls, encode_text, person_prompts, other_prompts, threshold: float = 0.1):
+        """:param encode_text: function(prompt) -> [1, D] text features, e.g. AIModel.get_text_features"""
+        with torch.no_grad():
+            person_features = torch.cat([encode_text(prompt)
+                                        for prompt in person_prompts])
+            other_features = torch.cat([encode_text(prompt)
+                                       for prompt in other_prompts])
+        log_info(
+            f"Person gate: {len(person_prompts)} people / {len(other_prompts)} other prompts, threshold {threshold}")
+        return cls(person_features, other_features, threshold)
+
+    def scores(self, image_features: torch.Tensor):
+        """[N, D] normalized image features -> N people scores in [0, 1]."""
+        if image_features.dim() == 1:
+            image_features = image_features.unsqueeze(0)
+        with torch.no_grad():
+            logits = 100.0 * image_features.to(self.weight.dtype) @ self.weight.T
+            probs = logits.softmax(dim=-1)
+            return probs[:, :self.person_count].sum(dim=-1).tolist()
+
+    def decide(self, image_features: torch.Tensor):
+        """Decision for one image -> {"score", "skip"}, skip -> run no CNN face detector on it."""
+        score = self.scores(image_features)[0]
+        return {"score": round(score, 4), "skip": score < self.threshold}
+
+    def record(self, image_id: str, decision: dict):
+        with self._lock:
+            self._stats["checked"] += 1
+            self._stats["skipped"] += int(decision["skip"])
+            self._recent.append({"image_id": image_id, **decision})
+        if decision["skip"]:
+            log_info(
+                f"Person gate skipped face detection of image {image_id} (score {decision['score']})")
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                **self._stats,
+                "recent": list(self._recent),
+            }
+
+
+def create_person_gate(model, config: dict = None):
+    """PersonGate from the CONFIG["person_gate"] prompts, None when the gate is disabled."""
+    config = config or CONFIG["person_gate"]
+    if not config["enabled"]:
+        return None
+    return PersonGate.from_prompts(
+        model.get_text_features, config["person_prompts"], config["other_prompts"], config["threshold"])
@@ -1,28 +1,272 @@
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 import json
 import time
 
 import numpy as np
 import torch
+from app.core.config import settings
+from app.libs.logger.log import log_error, log_info
 from app.models.model import AIModel, FaceCategoryModel
-from app.models.inference import AIInferenceService
-from app.services.supabase_service import SupabaseService
+from app.models.config import CONFIG
+from app.models.inference import AIInferenceService, init_inference_worker
+from app.services.face_executor import FaceDetectionExecutor
+from app.services.image_ring import SharedImageRing
+from app.services.inference_workers import InferenceWorkerPool
+from app.services.image_job import FACE_PART, FAILED_PARTS, LABEL_PART, ImageJobTracker
+from app.services.result_cache import ResultCache
+from app.services.search_history import SearchHistoryStore
+from app.services.search_pagination import decode_cursor, encode_cursor, order_matches, page_after, rows_page_after
+from app.services.redis_service import RedisService
+from app.services.supabase_service import SupabaseService, person_records
+from app.services.text_embedding_cache import TextEmbeddingCache, prewarm_text_embedding_cache
+from app.services.ann_index import ivf_index_factory
+from app.services.embedding_store import EmbeddingStore, EmbeddingStoreSyncer
+from app.services.vector_index import UserVectorIndexRegistry, on_image_features_saved
+from app.utils.image_utils import fetch_image_bytes
+import os
+import threading
+import traceback
 import torch.nn.functional as F
 
 
 class AIService:
-    def __init__(self, supabase_service: SupabaseService):
-        self.model = AIModel()
-        self.face_model = FaceCategoryModel()
+    def __init__(self, supabase_service: SupabaseService, model: AIModel = None, face_model: FaceCategoryModel = None):
+        # already loaded models can be passed in (see ModelLoader)
+        self.model = model or AIModel()
+        self.face_model = face_model or FaceCategoryModel()
+        self.result_cache = ResultCache(
+            settings.result_cache_path, settings.result_cache_max_bytes) if settings.result_cache_enabled else None
         self.inference_service = AIInferenceService(
-            self.model, supabase_service, self.face_model)
+            self.model, supabase_service, self.face_model, self.result_cache)
+        # forked before any thread below starts using the models
+        self.inference_service.workers = self.start_inference_workers()
+        self.inference_service.face_executor = self.start_face_executor()
+        self.image_jobs = ImageJobTracker()
+
+        # repeated queries never reach the text encoder
+        self.text_embeddings = TextEmbeddingCache(
+            self.model.get_text_features,
+            self.model.cache_version,
+            max_entries=settings.text_embedding_cache_size,
+            redis_client=RedisService().binary_client if settings.text_embedding_redis_enabled else None,
+            redis_ttl=settings.text_embedding_redis_ttl,
+        )
+        if settings.text_embedding_prewarm > 0:
+            threading.Thread(
+                target=prewarm_text_embedding_cache,
+                args=(self.text_embeddings, supabase_service,
+                      settings.text_embedding_prewarm),
+                daemon=True,
+            ).start()
+
+        # one search_history row per (user, normalized query)
+        self.search_history = SearchHistoryStore(
+            supabase_service, settings.search_history_flush_interval).start()
+
+        # warm restarts read image features from disk instead of PostgREST
+        self.image_store = None
+        self.image_store_syncer = None
+        if settings.embedding_store_enabled:
+            self.image_store = EmbeddingStore(
+                os.path.join(settings.embedding_store_dir, "image_features"),
+                dim=self.inference_service.label_heads.weight.shape[1])
+            self.image_store_syncer = EmbeddingStoreSyncer(
+                self.image_store, supabase_service.get_image_features_page,
+                interval=settings.embedding_store_sync_interval,
+                fetch_ids=supabase_service.get_image_feature_ids,
+                lag=settings.embedding_store_sync_lag,
+                reconcile_interval=settings.embedding_store_reconcile_interval).start()
+
+        # text search without a database scan, kept in sync with every features write
+        self.image_index = None
+        if settings.vector_index_enabled:
+            dtype = np.dtype(settings.vector_index_dtype)
+            self.image_index = UserVectorIndexRegistry(
+                self.load_user_image_features,
+                dtype=dtype,
+                max_users=settings.vector_index_max_users,
+                ttl=settings.vector_index_ttl or None,
+                index_factory=ivf_index_factory(
+                    dtype=dtype,
+                    min_train_size=settings.ann_min_images,
+                    nprobe=settings.ann_nprobe,
+                    index_dir=settings.ann_index_dir,
+                ) if settings.ann_index_enabled else None,
+            )
+            supabase_service.add_image_features_listener(
+                on_image_features_saved(self.image_index))
+
+    def start_inference_workers(self):
+        config = CONFIG["workers"]
+        if config["processes"] <= 0:
+            return None
+        if self.model.device != "cpu" or getattr(self.face_model, "use_cuda", False):
+            # a CUDA context does not survive fork
+            log_info("Inference workers disabled on GPU, running in-process")
+            return None
+        ring = CONFIG["image_ring"]
+        if ring["slots"] > 0:
+            # created before the fork -> every worker shares the mapping
+            self.inference_service.image_ring = SharedImageRing(
+                ring["slots"], self.model.image_size, ring["face_max_pixels"])
+        return InferenceWorkerPool(
+            self.inference_service, config["processes"], config["concurrency"], init_inference_worker)
+
+    def start_face_executor(self):
+        config = CONFIG["face_executor"]
+        if config["processes"] <= 0 or self.inference_service.workers is not None:
+            # the inference workers already detect faces out of this process
+            return None
+        if getattr(self.face_model, "use_cuda", False):
+            log_info("Face detection executor disabled on GPU, running in-process")
+            return None
+        return FaceDetectionExecutor(
+            self.face_model, config["processes"], config["max_pending"] or None, config["timeout"],
+            config["batch_pixels"])
+
+    def face_job_concurrency(self):
+        """Number of image jobs worth running at once to keep face detection busy."""
+        if self.inference_service.face_executor is not None:
+            return self.inference_service.face_executor.pool.processes
+        workers = self.inference_service.workers
+        if workers is not None:
+            return workers.processes * workers.concurrency
+        return 1
 
     def save_text_search_history(self, text: str, user_id: str, threshold=0.24):
 
-        text_features = self.model.get_text_features(text)
+        search_history_id, text_features = self.search_history.get_or_create(
+            user_id, text, self.text_embeddings.get)
 
-        search_history_id = self.inference_service.supabase_service.save_text_features_to_search_history(
-            text, user_id, text_features.squeeze(0).tolist())
+        result = self.search_images(
+            search_history_id, text_features, user_id, threshold)
+
+        return {
+            'search_history_id': search_history_id,
+            'result': result
+        }
+
+    def load_user_image_features(self, user_id: str):
+        """(ids, features) of the user's images, from the local store once it has synced."""
+        syncer = self.image_store_syncer
+        if syncer is not None and syncer.ready.is_set():
+            try:
+                # pick up the writes of the last sync interval first
+                syncer.sync()
+                return self.image_store.load_owner(user_id)
+            except Exception as e:
+                log_error(
+                    f"Embedding store read failed, loading from database: {e}\n{traceback.format_exc()}")
+        return self.inference_service.supabase_service.get_user_image_features(user_id)
+
+    def search_text_page(self, text: str, user_id: str, threshold=0.24, limit: int = 50, cursor: str = None):
+        """One page of results ordered by similarity + the cursor of the next page (None on the last one)."""
+        return next(self.iter_search_pages(text, user_id, threshold, limit, cursor))
+
+    def iter_search_pages(self, text: str, user_id: str, threshold=0.24, page_size: int = 50, cursor: str = None):
+        """
+        Yield the search results page by page, starting after `cursor`.
+
+        The history row is only looked up / written for the first page; the
+        next pages reuse its id from the cursor. Image rows are fetched per page, so
+        the first page is ready as soon as its rows are.
+
+        Every request ranks the whole library again (index search or the
+        RPC), so a page costs one full search plus the rows of that page.
+        The index pages by (similarity, id) keyset, the RPC fallback by
+        offset; a cursor of one is rejected by the other (ValueError
+        "Invalid cursor").
+        """
+        state = decode_cursor(cursor) if cursor else None
+
+        if state is None:
+            search_history_id, text_features = self.search_history.get_or_create(
+                user_id, text, self.text_embeddings.get)
+        else:
+            search_history_id = state["h"]
+            text_features = self.text_embeddings.get(text)
+
+        ranked = self.rank_images(
+            search_history_id, text_features, user_id, threshold)
+        while True:
+            result, state = self.page_images(ranked, state, page_size)
+            yield {
+                'search_history_id': search_history_id,
+                'total': len(ranked[1]),
+                'result': result,
+                'next_cursor': encode_cursor({**state, 'h': search_history_id}) if state else None,
+            }
+            if state is None:
+                return
+
+    def rank_images(self, search_history_id: str, text_features: torch.Tensor, user_id: str, threshold: float):
+        """("matches", ordered [(id, similarity)]) from the local index, else ("rows", rpc rows)."""
+        if self.image_index is not None:
+            try:
+                return "matches", order_matches(self.image_index.search(
+                    user_id, text_features.squeeze(0).numpy(), threshold))
+            except Exception as e:
+                log_error(
+                    f"Vector index search failed, falling back to rpc: {e}\n{traceback.format_exc()}")
+        return "rows", self.inference_service.supabase_service.query_image_by_search_history_id(
+            search_history_id, user_id, threshold)
+
+    def page_images(self, ranked, state: dict, limit: int):
+        kind, items = ranked
+        if kind == "rows":
+            return rows_page_after(items, state, limit)
+        page, next_state = page_after(items, state, limit)
+        return self.image_rows(page), next_state
+
+    def image_rows(self, matches: list):
+        """Image rows of [(id, similarity)] matches, same order, similarity added."""
+        rows = {row['id']: row for row in self.inference_service.supabase_service.get_images_by_ids(
+            [image_id for image_id, _ in matches])}
+        return [{**rows[image_id], 'similarity': similarity}
+                for image_id, similarity in matches if image_id in rows]
+
+    def save_text_search_history_batch(self, texts: list, user_id: str, threshold=0.24, limit: int = 20):
+        """Several queries with one text-tower pass, one history lookup / insert and one scoring matmul."""
+        search_history_ids, text_features = self.search_history.get_or_create_many(
+            user_id, texts, self.text_embeddings.get_many)
+
+        results = self.search_images_many(
+            search_history_ids, text_features, user_id, threshold, limit)
+
+        return [
+            {
+                'query': text,
+                'search_history_id': search_history_id,
+                'result': result
+            }
+            for text, search_history_id, result in zip(texts, search_history_ids, results)
+        ]
+
+    def search_images(self, search_history_id: str, text_features: torch.Tensor, user_id: str, threshold: float):
+        """Images of the user above threshold, most similar first (local index, else the RPC)."""
+        return self.search_images_many([search_history_id], text_features, user_id, threshold)[0]
+
+    def search_images_many(self, search_history_ids: list, text_features: torch.Tensor, user_id: str, threshold: float,
+                           limit: int = None):
+        """One result list per [Q, D] query row, at most `limit` images each."""
+        supabase_service = self.inference_service.supabase_service
+        if self.image_index is not None:
+            try:
+                matches = self.image_index.search_many(
+                    user_id, text_features.numpy(), threshold, limit)
+                # image rows shared between queries are fetched once
+                image_ids = list(dict.fromkeys(
+                    image_id for query_matches in matches for image_id, _ in query_matches))
+                rows = {row['id']: row for row in supabase_service.get_images_by_ids(image_ids)}
+                return [
+                    [{**rows[image_id], 'similarity': similarity}
+                     for image_id, similarity in query_matches if image_id in rows]
+                    for query_matches in matches
+                ]
+            except Exception as e:
+                log_error(
+                    f"Vector index search failed, falling back to rpc: {e}\n{traceback.format_exc()}")
 
         # run supabase rpc
         # example:
@@ -30,14 +274,11 @@ class AIService:
         #     '19b2701f-5a38-456b-ae63-5f5dd5225c2e'::UUID,
         #     0.24
         # );
-
-        result = self.inference_service.supabase_service.query_image_by_search_history_id(
-            search_history_id, user_id, threshold)
-
-        return {
-            'search_history_id': search_history_id,
-            'result': result
-        }
+        return [
+            supabase_service.query_image_by_search_history_id(
+                search_history_id, user_id, threshold)[:limit]
+            for search_history_id in search_history_ids
+        ]
 
     def classify_image(self, image_bucket_id: str, image_name: str, image_id: str):
         return self.inference_service.classify_image(image_bucket_id, image_name, image_id)
@@ -50,6 +291,140 @@ class AIService:
     def category_image_face(self, image_url: str):
         return self.inference_service.category_face(image_url)
 
+    def process_image_job(self, image_id: str, image_bucket_id: str, image_name: str, user_id: str = None,
+                          label: bool = True, detect_faces: bool = True):
+        """
+        Label + face-detect one image with a single download and decode, then
+        write both results (image labels/features, person rows + face flag).
+        Concurrent triggers for the same image share one run.
+
+        A face detection failure does not lose the labels: they are saved,
+        the face flag stays unset and the face part runs again on the next
+        trigger (result["face_error"]).
+        """
+        parts = set()
+        if label:
+            parts.add(LABEL_PART)
+        if detect_faces:
+            parts.add(FACE_PART)
+
+        supabase_service = self.inference_service.supabase_service
+
+        def run_job(missing_parts):
+            image_url = supabase_service.get_image_public_url(
+                image_bucket_id, image_name)
+            result = self.inference_service.analyze_image(
+                image_url, label=LABEL_PART in missing_parts, detect_faces=FACE_PART in missing_parts)
+
+            if LABEL_PART in missing_parts:
+                result["image_row"] = supabase_service.save_image_features_and_labels(
+                    image_bucket_id, image_name, result["labels"], result["image_features"].squeeze(0).tolist())
+
+            if FACE_PART in missing_parts and "face_error" in result:
+                log_error(
+                    f"Face detection failed for image {image_name}, labels saved: {result['face_error']}")
+                result[FAILED_PARTS] = {FACE_PART}
+            elif FACE_PART in missing_parts:
+                if "person_gate" in result:
+                    self.inference_service.person_gate.record(
+                        image_id, result["person_gate"])
+                uploader_id = user_id
+                if uploader_id is None:
+                    uploader_id = supabase_service.get_image_metadata(image_id)[
+                        0]['uploader_id']
+                supabase_service.update_person_table(
+                    result["face_encodings"], result["face_locations"], image_id, uploader_id, image_name)
+                supabase_service.mark_image_done_face_detection(
+                    image_id, result.get("person_gate"))
+                log_info(f"Face detection done for image: {image_name}")
+
+            return result
+
+        result, _ = self.image_jobs.run(image_id, parts, run_job)
+        return result
+
+    def process_face_batch(self, images: list):
+        """
+        Face detection of a batch of image rows (startup backlog): parallel
+        downloads, one batched detection, then the person rows and the face
+        flags of the whole batch in one transaction. Images that fail to
+        download or decode are left unmarked for the next run; images with
+        a face job in flight elsewhere are left to it (image_jobs).
+
+        :return: ids of the images marked done
+        """
+        images_by_id = {image['id']: image for image in images}
+
+        def run_batch(image_ids):
+            return self.detect_face_batch([images_by_id[image_id] for image_id in image_ids])
+
+        results = self.image_jobs.run_many(list(images_by_id), {FACE_PART}, run_batch)
+        image_ids = [image_id for image_id, result in results.items()
+                     if not isinstance(result, Exception)]
+        log_info(
+            f"Face detection done for {len(image_ids)} of {len(images)} images")
+        return image_ids
+
+    def detect_face_batch(self, images: list):
+        """process_face_batch of the claimed images -> {image_id: face result dict or exception}."""
+        supabase_service = self.inference_service.supabase_service
+
+        def download(image):
+            try:
+                return fetch_image_bytes(supabase_service.get_image_public_url(
+                    image['image_bucket_id'], image['image_name']))
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=min(len(images), 8), thread_name_prefix="face-batch-fetch") as executor:
+            downloads = list(executor.map(download, images))
+
+        outcomes, rows, image_datas, person_hints, person_gates = {}, [], [], [], {}
+        for image, image_data in zip(images, downloads):
+            if isinstance(image_data, Exception):
+                log_error(
+                    f"Error category image face {image['image_name']}: {image_data}")
+                outcomes[image['id']] = image_data
+                continue
+            rows.append(image)
+            image_datas.append(image_data)
+            decision = self.gate_image_row(image)
+            if decision is not None:
+                person_gates[image['id']] = decision
+            person_hints.append(False if decision and decision["skip"] else None)
+        results = self.inference_service.analyze_faces_batch(
+            image_datas, person_hints)
+
+        records, done = [], {}
+        for image, result in zip(rows, results):
+            if isinstance(result, Exception):
+                log_error(
+                    f"Error category image face {image['image_name']}: {result}")
+                outcomes[image['id']] = result
+                continue
+            face_locations, face_encodings = result
+            records.extend(person_records(
+                face_encodings, face_locations, image['id'], image['uploader_id']))
+            done[image['id']] = {"face_locations": face_locations, "face_encodings": face_encodings}
+
+        supabase_service.save_face_detections(
+            records, list(done), {image_id: person_gates[image_id] for image_id in done if image_id in person_gates})
+        log_info(f"{len(records)} faces saved for {len(done)} images")
+        return {**outcomes, **done}
+
+    def gate_image_row(self, image: dict):
+        """Person gate decision ({"score", "skip"}) on the stored image_features of an image row, None -> no gate."""
+        gate = self.inference_service.person_gate
+        image_features = image.get('image_features')
+        if gate is None or image_features is None:
+            return None
+        if isinstance(image_features, str):
+            image_features = json.loads(image_features)
+        decision = gate.decide(torch.tensor(
+            image_features, dtype=torch.float32))
+        gate.record(image['id'], decision)
+        return decision
+
 
 def get_ai_service(supabase_service: SupabaseService):
     return AIService(supabase_service)
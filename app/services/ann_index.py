@@ -0,0 +1,302 @@
+import math
+import os
+import threading
+import traceback
+import uuid
+
+import numpy as np
+
+from app.libs.logger.log import log_error, log_info
+from app.services.vector_index import top_matches
+
+
+def spherical_kmeans(features: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0):
+    """k-means on the unit sphere (cosine assignment) -> [nlist, D] normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = features[rng.choice(
+        len(features), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = assign(features, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, features)
+        counts = np.bincount(assignment, minlength=nlist)
+        # empty clusters restart from random points
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = features[rng.choice(
+                len(features), size=int(empty.sum()), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums,
+                                      axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+def assign(features: np.ndarray, centroids: np.ndarray, chunk: int = 8192):
+    """Index of the most similar centroid of every row."""
+    assignment = np.empty(len(features), dtype=np.int64)
+    for start in range(0, len(features), chunk):
+        assignment[start:start + chunk] = np.argmax(
+            features[start:start + chunk] @ centroids.T, axis=1)
+    return assignment
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate cosine search on NumPy.
+
+    A spherical k-means coarse quantizer splits the vectors into `nlist`
+    lists; a query is compared to the centroids and only the `nprobe`
+    closest lists are scanned exactly. `nprobe` trades recall for speed at
+    query time (nprobe == nlist is exact search). Until `min_train_size`
+    vectors are present the index is a single list, i.e. exact search, and
+    it trains itself on the first insert past that size. Inserts after
+    training are assigned to the existing centroids. Same upsert / remove /
+    search surface as VectorIndex.
+
+    :param nlist: number of lists, None -> 4 * sqrt(N) at training time
+    :param nprobe: lists scanned per query
+    """
+
+    def __init__(self, dim: int = 512, nlist: int = None, nprobe: int = 8, dtype=np.float32,
+                 min_train_size: int = 4096, train_iterations: int = 10, seed: int = 0):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.dtype = np.dtype(dtype)
+        self.min_train_size = min_train_size
+        self.train_iterations = train_iterations
+        self.seed = seed
+
+        self.centroids = None
+        self._lists = [self._empty_list()]
+        self._positions = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def train(self, features=None):
+        """(Re)build the coarse quantizer from `features`, default every stored vector."""
+        with self._lock:
+            _, stored = self._all_rows()
+            if features is None:
+                features = stored
+            features = normalize(features)
+            nlist = self.nlist or max(1, int(4 * math.sqrt(len(features))))
+            nlist = min(nlist, len(features))
+            # k-means on a sample is enough for the coarse split
+            sample_size = min(len(features), nlist * 64)
+            sample = features[np.random.default_rng(self.seed).choice(
+                len(features), size=sample_size, replace=False)]
+            self.set_centroids(spherical_kmeans(
+                sample, nlist, self.train_iterations, self.seed))
+            log_info(f"IVF index trained: {nlist} lists on {sample_size} vectors")
+
+    def set_centroids(self, centroids: np.ndarray):
+        """Use an existing quantizer (e.g. a persisted one) and redistribute the stored rows."""
+        with self._lock:
+            ids, features = self._all_rows()
+            self.centroids = normalize(centroids)
+            self._lists = [self._empty_list()
+                           for _ in range(len(self.centroids))]
+            self._positions = {}
+            if ids:
+                self._insert(ids, features)
+
+    def upsert(self, ids: list, features):
+        features = normalize(np.asarray(
+            features, dtype=np.float32).reshape(-1, self.dim))
+        if len(ids) != features.shape[0]:
+            raise ValueError(
+                f"Got {len(ids)} ids for {features.shape[0]} feature rows")
+        with self._lock:
+            self.remove([image_id for image_id in ids if image_id in self._positions])
+            self._insert(list(ids), features)
+            if not self.trained and len(self) >= self.min_train_size:
+                self.train()
+
+    def remove(self, ids: list):
+        with self._lock:
+            for image_id in ids:
+                position = self._positions.pop(image_id, None)
+                if position is None:
+                    continue
+                list_no, row = position
+                entry = self._lists[list_no]
+                last = len(entry["ids"]) - 1
+                if row != last:
+                    last_id = entry["ids"][last]
+                    entry["matrix"][row] = entry["matrix"][last]
+                    entry["ids"][row] = last_id
+                    self._positions[last_id] = (list_no, row)
+                entry["ids"].pop()
+
+    def search(self, query, threshold: float = None, limit: int = None, nprobe: int = None):
+        """
+        :param nprobe: override of self.nprobe for this query
+        :return: [(id, similarity)] sorted by similarity desc
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            if self.trained:
+                probe = min(nprobe or self.nprobe, len(self._lists))
+                list_scores = self.centroids @ query
+                lists = np.argpartition(-list_scores, probe - 1)[:probe]
+            else:
+                lists = [0]
+
+            ids, scores = [], []
+            for list_no in lists:
+                entry = self._lists[list_no]
+                size = len(entry["ids"])
+                if size == 0:
+                    continue
+                scores.append(entry["matrix"][:size].astype(
+                    np.float32, copy=False) @ query)
+                ids.extend(entry["ids"])
+
+        if not ids:
+            return []
+        return top_matches(np.concatenate(scores), ids, threshold, limit)
+
+    def search_many(self, queries, threshold: float = None, limit: int = None, nprobe: int = None):
+        # every query probes its own lists
+        return [self.search(query, threshold, limit, nprobe)
+                for query in np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)]
+
+    def save(self, path: str):
+        """Persist centroids + rows to one .npz file."""
+        with self._lock:
+            ids, features = self._all_rows()
+            np.savez(
+                path,
+                centroids=self.centroids if self.trained else np.empty(
+                    (0, self.dim), dtype=np.float32),
+                ids=np.asarray(ids),
+                features=features.astype(self.dtype),
+                params=np.asarray([self.nlist or 0, self.nprobe, self.min_train_size]),
+            )
+
+    @classmethod
+    def load(cls, path: str, dtype=None):
+        data = np.load(path)
+        nlist, nprobe, min_train_size = (int(value) for value in data["params"])
+        features = data["features"]
+        index = cls(features.shape[1] if features.ndim == 2 else data["centroids"].shape[1],
+                    nlist=nlist or None, nprobe=nprobe, dtype=dtype or features.dtype,
+                    min_train_size=min_train_size)
+        if len(data["centroids"]):
+            index.set_centroids(data["centroids"])
+        ids = data["ids"].tolist()
+        if ids:
+            with index._lock:
+                index._insert(ids, features.astype(np.float32))
+        return index
+
+    def get_stats(self):
+        with self._lock:
+            sizes = [len(entry["ids"]) for entry in self._lists]
+            return {
+                "size": len(self),
+                "trained": self.trained,
+                "nlist": len(self._lists),
+                "nprobe": self.nprobe,
+                "max_list_size": max(sizes) if sizes else 0,
+            }
+
+    def _empty_list(self):
+        return {"ids": [], "matrix": np.empty((0, self.dim), dtype=self.dtype)}
+
+    def _insert(self, ids: list, features: np.ndarray):
+        lists = assign(features, self.centroids) if self.trained else np.zeros(
+            len(ids), dtype=np.int64)
+        for list_no in np.unique(lists):
+            rows = np.flatnonzero(lists == list_no)
+            entry = self._lists[list_no]
+            size = len(entry["ids"])
+            if size + len(rows) > entry["matrix"].shape[0]:
+                matrix = np.empty(
+                    (max(size + len(rows), entry["matrix"].shape[0] * 2, 16), self.dim), dtype=self.dtype)
+                matrix[:size] = entry["matrix"][:size]
+                entry["matrix"] = matrix
+            entry["matrix"][size:size + len(rows)] = features[rows]
+            for offset, row in enumerate(rows):
+                entry["ids"].append(ids[row])
+                self._positions[ids[row]] = (int(list_no), size + offset)
+
+    def _all_rows(self):
+        ids, features = [], []
+        for entry in self._lists:
+            size = len(entry["ids"])
+            ids.extend(entry["ids"])
+            features.append(entry["matrix"][:size].astype(np.float32))
+        features = np.concatenate(features) if features else np.empty(
+            (0, self.dim), dtype=np.float32)
+        return ids, features
+
+
+def ivf_index_factory(dim: int = 512, dtype=np.float32, min_train_size: int = 20000, nprobe: int = 8,
+                      index_dir: str = None):
+    """
+    UserVectorIndexRegistry factory building IVF indexes.
+
+    Small libraries stay a single exact list; the index trains itself once a
+    user passes `min_train_size` images. With `index_dir` the trained
+    centroids are persisted per user and reused on the next build, so k-means
+    only runs again when no file exists. The lists are always rebuilt from
+    the rows the registry passes in, which are the source of truth.
+    """
+    def build(user_id, ids, features):
+        path = centroids_path(index_dir, user_id) if index_dir else None
+        index = IVFIndex(dim, nprobe=nprobe, dtype=dtype,
+                         min_train_size=min_train_size)
+        centroids = load_centroids(path, dim) if path else None
+        if centroids is not None:
+            index.set_centroids(centroids)
+        if len(ids):
+            index.upsert(ids, features)
+        if path and index.trained and centroids is None:
+            save_centroids(path, index.centroids)
+        return index
+    return build
+
+
+def centroids_path(index_dir: str, user_id):
+    """<index_dir>/<user id>.centroids.npy, None when the user id is not a UUID."""
+    try:
+        user_id = uuid.UUID(str(user_id))
+    except ValueError:
+        log_error(f"Not persisting the IVF centroids of user {user_id!r}: not a UUID")
+        return None
+    return os.path.join(index_dir, f"{user_id}.centroids.npy")
+
+
+def load_centroids(path: str, dim: int):
+    if not os.path.exists(path):
+        return None
+    try:
+        centroids = np.load(path)
+    except Exception as e:
+        log_error(
+            f"Error loading IVF centroids {path}: {e}\n{traceback.format_exc()}")
+        return None
+    if centroids.ndim != 2 or centroids.shape[1] != dim or not len(centroids):
+        log_error(f"Ignoring IVF centroids {path} of shape {centroids.shape}")
+        return None
+    return centroids
+
+
+def save_centroids(path: str, centroids: np.ndarray):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # written next to the target then renamed: a reader never sees half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, centroids.astype(np.float32))
+    os.replace(tmp_path, path)
+
+
+def normalize(features):
+    features = np.asarray(features, dtype=np.float32)
+    return features / np.maximum(np.linalg.norm(features, axis=-1, keepdims=True), 1e-12)
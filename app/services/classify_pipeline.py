@@ -0,0 +1,179 @@
+import asyncio
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from app.libs.logger.log import log_error, log_info
+from app.models.config import CONFIG
+from app.services.ai_services import AIService
+from app.services.redis_service import RedisService
+from app.services.supabase_service import SupabaseService
+from app.utils.image_utils import decode_image, fetch_image_bytes_async
+
+
+class ClassifyPipeline:
+    """
+    Staged pipeline behind /api/classify-images.
+
+    Every image goes through download -> decode/preprocess -> batched
+    inference -> persistence, with a result-cache lookup before decoding so
+    re-uploaded photos skip the model. Each stage has its own concurrency
+    limit and none of them blocks the event loop: downloads use the pooled
+    async image fetcher, Redis and database calls run on an I/O thread pool,
+    decoding on a CPU thread pool and inference is awaited on the shared
+    micro-batching image encoder. With inference workers enabled, inference
+    runs in a worker process instead, decoding too unless the shared image
+    ring is on (then the preprocess output goes through a shared memory
+    slot). While one image is being persisted the next ones are already
+    downloading or in the model. An image whose inference is not back
+    within `inference_timeout` seconds fails and its label job is marked
+    failed.
+    """
+
+    def __init__(self, ai_service: AIService, redis_service: RedisService,
+                 download_concurrency: int = 8, preprocess_workers: int = 4, persist_concurrency: int = 4,
+                 inference_timeout: float = None):
+        self.ai_service = ai_service
+        self.redis_service = redis_service
+        self.supabase_service: SupabaseService = ai_service.inference_service.supabase_service
+
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=download_concurrency + persist_concurrency, thread_name_prefix="classify-io")
+        self.preprocess_executor = ThreadPoolExecutor(
+            max_workers=preprocess_workers, thread_name_prefix="classify-preprocess")
+
+        self.download_concurrency = download_concurrency
+        self.persist_concurrency = persist_concurrency
+        self.inference_timeout = inference_timeout or CONFIG["workers"]["timeout"]
+
+    async def run(self, user_id: str, images: list):
+        """Label every image of the request, rows are returned in request order."""
+        download_slots = asyncio.Semaphore(self.download_concurrency)
+        persist_slots = asyncio.Semaphore(self.persist_concurrency)
+
+        tasks = [
+            asyncio.create_task(self.process_image(
+                image, user_id, download_slots, persist_slots))
+            for image in images
+        ]
+        try:
+            return await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def process_image(self, image, user_id: str, download_slots: asyncio.Semaphore, persist_slots: asyncio.Semaphore):
+        loop = asyncio.get_running_loop()
+        image_id = image.image_id
+        image_bucket_id = image.image_bucket_id
+        image_name = image.image_name
+
+        try:
+            # stage 1: download
+            async with download_slots:
+                image_url = await loop.run_in_executor(
+                    self.io_executor, self.start_job, image_id, image_bucket_id, image_name)
+                image_data = await fetch_image_bytes_async(image_url)
+
+            # stage 2: result cache lookup, else decode + preprocess
+            # prepared: image tensor, ring slot job (inference workers) or None (the worker decodes)
+            cache_key, cached, prepared = await loop.run_in_executor(
+                self.preprocess_executor, self.preprocess, image_data)
+
+            inference_service = self.ai_service.inference_service
+            if cached:
+                results, image_features = cached["labels"], cached["image_features"]
+            elif inference_service.workers is not None:
+                # stage 3 in an inference worker process, off this process' GIL
+                if prepared is not None:
+                    future = inference_service.submit_image_slot(prepared)
+                else:
+                    future = inference_service.workers.submit(
+                        "run_image_models", image_data, True, False)
+                computed = await self.wait_inference(future, image_id, image_name)
+                results, image_features = computed["labels"], computed["image_features"]
+            else:
+                # stage 3: batched inference with every other in-flight image
+                image_features = await self.wait_inference(
+                    self.ai_service.model.image_encoder.submit(prepared), image_id, image_name)
+                results = self.ai_service.inference_service.label_image_features(image_features)[
+                    0]
+
+            # stage 4: persist
+            async with persist_slots:
+                image_row = await loop.run_in_executor(
+                    self.io_executor, self.persist, image_id, image_bucket_id, image_name,
+                    results, image_features, user_id, None if cached else cache_key)
+
+            log_info(f"Classified image: {image_name}")
+            return image_row
+        except Exception as e:
+            log_error(
+                f"Error in classify pipeline for image {image_name}: {e}\n{traceback.format_exc()}")
+            raise
+
+    async def wait_inference(self, future, image_id: str, image_name: str):
+        try:
+            # on timeout the future is cancelled: a job still queued never runs
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.inference_timeout)
+        except asyncio.TimeoutError:
+            log_error(
+                f"Inference for image {image_name} took more than {self.inference_timeout} seconds")
+            await asyncio.get_running_loop().run_in_executor(
+                self.io_executor, self.fail_job, image_id)
+            raise
+
+    def start_job(self, image_id: str, image_bucket_id: str, image_name: str):
+        # update redis label job -> processing
+        self.redis_service.update_image_label_job(
+            image_id, image_bucket_id, image_name
+        )
+        return self.supabase_service.get_image_public_url(image_bucket_id, image_name)
+
+    def preprocess(self, image_data: bytes):
+        inference_service = self.ai_service.inference_service
+        cache_key = inference_service.cache_key(image_data)
+        cached = inference_service.lookup_cache(
+            cache_key, label=True, detect_faces=False)
+        if cached:
+            return cache_key, cached, None
+        if inference_service.workers is not None:
+            if inference_service.image_ring is None:
+                # the worker decodes the bytes
+                return cache_key, None, None
+            return cache_key, None, inference_service.write_image_slot(
+                image_data, label=True, detect_faces=False)
+
+        image, _ = decode_image(
+            image_data,
+            lambda width, height: inference_service.draft_size(width, height, label=True, detect_faces=False))
+        return cache_key, None, self.ai_service.model.preprocess(image)
+
+    def persist(self, image_id: str, image_bucket_id: str, image_name: str, results: dict, image_features, user_id: str,
+                cache_key: str = None):
+        self.ai_service.inference_service.store_cache(
+            cache_key, {"labels": results, "image_features": image_features}, label=True, detect_faces=False)
+
+        # update redis label job -> completed
+        self.redis_service.update_hash(
+            f"image_job:{image_id}",
+            {
+                "labels": json.dumps(results),
+                "label_status": "completed"
+            }
+        )
+
+        image_row = self.supabase_service.save_image_features_and_labels(
+            image_bucket_id, image_name, results, image_features.squeeze(0).tolist(), user_id=user_id)
+        image_row.pop('image_features')
+        return image_row
+
+    def fail_job(self, image_id: str):
+        # update redis label job -> failed
+        self.redis_service.update_hash(
+            f"image_job:{image_id}", {"label_status": "failed"})
+
+    def shutdown(self):
+        self.io_executor.shutdown(wait=False)
+        self.preprocess_executor.shutdown(wait=False)
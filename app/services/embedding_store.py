@@ -0,0 +1,422 @@
+import datetime
+import fcntl
+import json
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.libs.logger.log import log_error, log_info
+
+VECTORS_FILE = "vectors.{generation}.f16"
+IDS_FILE = "ids.{generation}.tsv"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+# third column of an ids line whose row deletes the id
+TOMBSTONE = "deleted"
+
+
+class EmbeddingStore:
+    """
+    Append-only on-disk store of fixed-width float16 vectors.
+
+    Layout of the store directory:
+        vectors.<generation>.f16  raw [count, dim] float16 rows, row i at offset i * dim * 2
+        ids.<generation>.tsv      one "id<TAB>owner" line per row, same order
+                                  ("id<TAB><TAB>deleted" for a tombstone)
+        meta.json                 dim, committed row count, sync watermark, generation
+
+    Rows are only ever appended; a later row for the same id replaces the
+    earlier one, a tombstone row (remove()) deletes it, and compact() writes
+    the live rows to the next generation.
+    meta.json is the commit point: it is replaced atomically after the data
+    files are flushed, so a crash leaves unreferenced bytes or files behind,
+    never a torn row.
+    Readers open the vectors with np.memmap -> opening is O(1) in the corpus
+    size and every worker process shares the same page cache. Writers
+    (possibly in several processes) serialize on an flock.
+
+    :param path: store directory, created if missing
+    :param dim: vector size (512 image features, 128 face encodings)
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._writer_depth = 0
+        self._generation = None
+        self._count = 0
+        # bytes of the ids file holding the first self._count lines
+        self._ids_offset = 0
+        self.watermark = None
+        self._vectors = np.empty((0, dim), dtype=np.float16)
+        self._ids = []
+        self._owners = []
+        self._rows = {}
+        self.refresh()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rows)
+
+    @property
+    def garbage_ratio(self):
+        """Share of stored rows replaced by a later row or deleted."""
+        with self._lock:
+            return 1 - len(self._rows) / self._count if self._count else 0.0
+
+    def refresh(self):
+        """
+        Pick up rows appended / compacted by another process.
+
+        Only the ids lines past the last committed row are parsed; the whole
+        file is read again after a compaction (new generation) or when the
+        file no longer matches what was read before.
+        """
+        meta = self._read_meta()
+        with self._lock:
+            self.watermark = meta["watermark"]
+            count, generation = meta["count"], meta["generation"]
+            if generation == self._generation and count == self._count:
+                # a sync without changed rows only moves the watermark
+                return
+            if generation != self._generation or count < self._count or not self._read_ids(count):
+                self._ids, self._owners, self._rows = [], [], {}
+                self._count, self._ids_offset = 0, 0
+                if count and not self._read_ids(count, generation):
+                    raise ValueError(
+                        f"Embedding store {self.path} ids file is shorter than its {count} rows")
+            if count:
+                self._vectors = np.memmap(self._file(VECTORS_FILE, generation), dtype=np.float16, mode="r",
+                                          shape=(count, self.dim))
+            else:
+                self._vectors = np.empty((0, self.dim), dtype=np.float16)
+            self._generation = generation
+
+    def _read_ids(self, count: int, generation=None):
+        """Parse the ids lines of rows self._count..count -> False when the file has fewer."""
+        generation = self._generation if generation is None else generation
+        path = self._file(IDS_FILE, generation)
+        if count == self._count:
+            return True
+        if not os.path.exists(path) or os.path.getsize(path) < self._ids_offset:
+            return False
+        ids, owners = [], []
+        with open(path, "rb") as f:
+            f.seek(self._ids_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return False
+                image_id, _, owner = line.decode("utf-8").rstrip("\n").partition("\t")
+                owner, _, flag = owner.partition("\t")
+                ids.append((image_id, flag == TOMBSTONE))
+                owners.append(owner or None)
+                if self._count + len(ids) == count:
+                    offset = f.tell()
+                    break
+            else:
+                return False
+        for image_id, deleted in ids:
+            if deleted:
+                self._rows.pop(image_id, None)
+            else:
+                self._rows[image_id] = len(self._ids)
+            self._ids.append(image_id)
+        self._owners.extend(owners)
+        self._count, self._ids_offset = count, offset
+        return True
+
+    def append(self, ids: list, features, owners: list = None, watermark: str = None):
+        """Append rows (the newest row of an id wins) and move the sync watermark."""
+        features = np.asarray(features, dtype=np.float16).reshape(-1, self.dim)
+        if len(ids) != features.shape[0]:
+            raise ValueError(
+                f"Got {len(ids)} ids for {features.shape[0]} feature rows")
+        self._append(ids, features, owners or [None] * len(ids), watermark)
+
+    def remove(self, ids: list, watermark: str = None):
+        """Delete ids with tombstone rows (absent ids are skipped)."""
+        with self.writer():
+            self.refresh()
+            with self._lock:
+                ids = [str(image_id) for image_id in ids if str(image_id) in self._rows]
+            if ids:
+                self._append(ids, np.zeros((len(ids), self.dim), dtype=np.float16), [None] * len(ids),
+                             watermark, deleted=True)
+        return len(ids)
+
+    def ids(self):
+        """Ids of the live rows."""
+        with self._lock:
+            return list(self._rows)
+
+    def get_owner(self, image_id):
+        """Owner of the id, None if absent."""
+        with self._lock:
+            row = self._rows.get(str(image_id))
+            return None if row is None else self._owners[row]
+
+    def _append(self, ids: list, features, owners: list, watermark, deleted: bool = False):
+        flag = f"\t{TOMBSTONE}" if deleted else ""
+        with self.writer():
+            self.refresh()
+            meta = self._read_meta()
+            count, generation = meta["count"], meta["generation"]
+            with self._lock:
+                ids_size = self._ids_offset
+            # drop bytes of an interrupted append before writing after them
+            self._truncate(self._file(VECTORS_FILE, generation), count * self.dim * 2)
+            self._truncate(self._file(IDS_FILE, generation), ids_size)
+            with open(self._file(VECTORS_FILE, generation), "ab") as f:
+                f.write(features.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._file(IDS_FILE, generation), "a", encoding="utf-8") as f:
+                for image_id, owner in zip(ids, owners):
+                    f.write(f"{image_id}\t{owner or ''}{flag}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._write_meta({**meta, "count": count + len(ids),
+                              "watermark": watermark or meta["watermark"]})
+        self.refresh()
+
+    def get(self, image_id):
+        """float32 vector of the id, None if absent."""
+        with self._lock:
+            row = self._rows.get(str(image_id))
+            return None if row is None else np.asarray(self._vectors[row], dtype=np.float32)
+
+    def get_many(self, ids: list):
+        """({id: float32 vector} of the ids present in the store)."""
+        with self._lock:
+            rows = {image_id: self._rows[str(image_id)]
+                    for image_id in ids if str(image_id) in self._rows}
+            if not rows:
+                return {}
+            vectors = np.asarray(
+                self._vectors[list(rows.values())], dtype=np.float32)
+        return dict(zip(rows, vectors))
+
+    def load_owner(self, owner: str):
+        """(ids, [N, dim] float32) of the live rows of one owner, e.g. a user's images."""
+        with self._lock:
+            rows = [row for image_id, row in self._rows.items()
+                    if self._owners[row] == owner]
+            ids = [self._ids[row] for row in rows]
+            vectors = np.asarray(self._vectors[rows], dtype=np.float32) if rows else np.empty(
+                (0, self.dim), dtype=np.float32)
+        return ids, vectors
+
+    def compact(self):
+        """Write the live rows to the next generation; open memmaps of readers stay valid."""
+        with self.writer():
+            self.refresh()
+            with self._lock:
+                rows = sorted(self._rows.values())
+                vectors = np.asarray(self._vectors[rows]) if rows else np.empty(
+                    (0, self.dim), dtype=np.float16)
+                lines = [f"{self._ids[row]}\t{self._owners[row] or ''}\n" for row in rows]
+            meta = self._read_meta()
+            generation = meta["generation"] + 1
+
+            with open(self._file(VECTORS_FILE, generation), "wb") as f:
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._file(IDS_FILE, generation), "w", encoding="utf-8") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self._write_meta({**meta, "count": len(rows), "generation": generation})
+            self.refresh()
+            for name in (VECTORS_FILE, IDS_FILE):
+                try:
+                    os.remove(self._file(name, meta["generation"]))
+                except FileNotFoundError:
+                    pass
+        log_info(f"Embedding store {self.path} compacted to {len(rows)} rows")
+
+    @contextmanager
+    def writer(self):
+        """Exclusive write access across threads and processes (re-entrant within a thread)."""
+        with self._write_lock:
+            if self._writer_depth:
+                self._writer_depth += 1
+                try:
+                    yield
+                finally:
+                    self._writer_depth -= 1
+                return
+            with open(self._file(LOCK_FILE), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._writer_depth = 1
+                try:
+                    yield
+                finally:
+                    self._writer_depth = 0
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _file(self, name, generation=None):
+        return os.path.join(self.path, name.format(generation=generation))
+
+    def _read_meta(self):
+        try:
+            with open(self._file(META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return {"dim": self.dim, "count": 0, "watermark": None, "generation": 0}
+        if meta["dim"] != self.dim:
+            raise ValueError(
+                f"Embedding store {self.path} holds {meta['dim']}-d vectors, expected {self.dim}")
+        return meta
+
+    def _write_meta(self, meta):
+        tmp = self._file(META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file(META_FILE))
+
+    def _truncate(self, path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+
+class EmbeddingStoreSyncer:
+    """
+    Keeps an EmbeddingStore in sync with a Supabase table in the background.
+
+    Every `interval` seconds the rows changed after the store watermark are
+    fetched page by page and appended; the store is compacted once more
+    than `compact_ratio` of its rows are stale. The watermark is the
+    (updated_at, id) of the last stored row, so pages never overlap even when
+    many rows share a timestamp.
+
+    Each sync starts `lag` seconds before the watermark, so a row whose
+    transaction committed after a later timestamp was read is still picked
+    up; rows already stored unchanged are skipped. Deleted rows and rows
+    whose vector was nulled never show up in a page: every
+    `reconcile_interval` seconds and before a compaction the store ids are
+    checked against `fetch_ids` and the missing ones removed.
+
+    :param fetch_page: function (watermark, page_size) -> [{"id", "owner", "vector", "updated_at"}]
+                       rows strictly after the (updated_at, id) watermark, in that order;
+                       a watermark id of None -> rows at or after updated_at
+    :param fetch_ids: function () -> ids of every row with a vector, None -> no reconciliation
+    """
+
+    def __init__(self, store: EmbeddingStore, fetch_page, interval: float = 60, page_size: int = 1000,
+                 compact_ratio: float = 0.3, fetch_ids=None, lag: float = 0, reconcile_interval: float = 3600):
+        self.store = store
+        self.fetch_page = fetch_page
+        self.fetch_ids = fetch_ids
+        self.interval = interval
+        self.page_size = page_size
+        self.compact_ratio = compact_ratio
+        self.lag = lag
+        self.reconcile_interval = reconcile_interval
+
+        # at least one full sync since start -> the store can replace database reads
+        self.ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reconciled_at = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name=f"embedding-sync-{os.path.basename(self.store.path)}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def sync(self):
+        """Append every row changed since the watermark (minus the lag) -> number of rows appended."""
+        appended = 0
+        with self.store.writer():
+            self.store.refresh()
+            watermark = self.store.watermark
+            page_watermark = self._lagged(watermark)
+            while True:
+                page = self.fetch_page(page_watermark, self.page_size)
+                if not page:
+                    break
+                page_watermark = [page[-1]["updated_at"], str(page[-1]["id"])]
+                if watermark is None or self._key(page_watermark) > self._key(watermark):
+                    watermark = page_watermark
+                rows = self._changed(page)
+                self.store.append([str(row["id"]) for row in rows], [row["vector"] for row in rows],
+                                  [row.get("owner") for row in rows], watermark=watermark)
+                appended += len(rows)
+                if len(page) < self.page_size:
+                    break
+        return appended
+
+    def reconcile(self):
+        """Remove the stored ids the table no longer has a vector for -> number of ids removed."""
+        if self.fetch_ids is None:
+            return 0
+        with self.store.writer():
+            self.store.refresh()
+            live = {str(image_id) for image_id in self.fetch_ids()}
+            removed = self.store.remove([image_id for image_id in self.store.ids() if image_id not in live])
+        self._reconciled_at = time.monotonic()
+        if removed:
+            log_info(f"Embedding store {self.store.path} removed {removed} deleted rows")
+        return removed
+
+    def _changed(self, rows):
+        """Rows not already stored with the same vector and owner."""
+        stored = self.store.get_many([str(row["id"]) for row in rows])
+        changed = []
+        for row in rows:
+            vector = stored.get(str(row["id"]))
+            if vector is None or row.get("owner") != self.store.get_owner(row["id"]) or not np.array_equal(
+                    np.asarray(row["vector"], dtype=np.float16).astype(np.float32), vector):
+                changed.append(row)
+        return changed
+
+    def _lagged(self, watermark):
+        if watermark is None or not self.lag:
+            return watermark
+        updated_at = _parse_timestamp(watermark[0]) - datetime.timedelta(seconds=self.lag)
+        return [updated_at.isoformat(), None]
+
+    def _key(self, watermark):
+        updated_at, image_id = watermark
+        return (_parse_timestamp(updated_at) if self.lag else updated_at), image_id or ""
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                start = time.time()
+                appended = self.sync()
+                if self._reconciled_at is None or time.monotonic() - self._reconciled_at > self.reconcile_interval:
+                    self.reconcile()
+                self.ready.set()
+                if appended:
+                    log_info(
+                        f"Embedding store {self.store.path} synced {appended} rows in {time.time() - start:.2f} seconds")
+                if self.store.garbage_ratio > self.compact_ratio:
+                    self.reconcile()
+                    self.store.compact()
+            except Exception as e:
+                log_error(
+                    f"Error syncing embedding store {self.store.path}: {e}\n{traceback.format_exc()}")
+            self._stop.wait(self.interval)
+
+
+def _parse_timestamp(value: str):
+    # PostgREST timestamps, with or without a UTC offset
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
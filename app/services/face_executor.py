@@ -0,0 +1,64 @@
+import os
+
+from app.libs.logger.log import log_info
+from app.models.model import split_by_detector_pixels
+from app.services.inference_workers import InferenceWorkerPool
+
+
+class FaceDetectionExecutor:
+    """
+    dlib face detection + encoding in a pool of processes forked from the
+    one that loaded FaceCategoryModel (the dlib models are shared
+    copy-on-write).
+
+    One image runs per process, so a burst of uploads uses every core
+    instead of one. Create it before starting threads that use the face
+    model, the processes are forked (see InferenceWorkerPool). At most `max_pending` images are queued or running:
+    submit() waits for room up to `timeout` seconds and then raises
+    PoolBusyError. An image still being detected after `timeout` seconds
+    gets its process killed and fails with TaskTimeoutError.
+
+    :param face_model: loaded FaceCategoryModel
+    :param processes: pool size, None -> one per core
+    :param batch_pixels: detector pixels per detect_batch task, so a batch
+        task runs about as long as one large image and fits the timeout
+    """
+
+    def __init__(self, face_model, processes: int = None, max_pending: int = None, timeout: float = 300,
+                 batch_pixels: int = 24_000_000):
+        processes = processes or os.cpu_count() or 1
+        self.timeout = timeout
+        self.batch_pixels = batch_pixels
+        self.pool = InferenceWorkerPool(
+            face_model, processes, concurrency=1,
+            max_pending=max_pending or 2 * processes, submit_timeout=timeout, task_timeout=timeout,
+            name="face")
+        log_info(
+            f"Face detection executor: {processes} processes, {self.pool.max_pending} pending images max")
+
+    def submit(self, image, plan, person_hint: bool = None):
+        """category_image_array(image, plan, person_hint) in the pool -> Future of (face_locations, face_encodings)."""
+        return self.pool.submit("category_image_array", image, plan, person_hint)
+
+    def detect(self, image, plan, person_hint: bool = None):
+        return self.submit(image, plan, person_hint).result()
+
+    def detect_batch(self, images, person_hints=None):
+        """
+        category_image_batch(images) in the pool -> list of (face_locations, face_encodings).
+
+        The images are split into tasks of at most `batch_pixels` detector
+        pixels (an image larger than that gets a task of its own), which run
+        in parallel and each within the per-image timeout.
+        """
+        person_hints = person_hints or [None] * len(images)
+        futures = [self.pool.submit("category_image_batch", [images[i] for i in chunk],
+                                    [person_hints[i] for i in chunk])
+                   for chunk in split_by_detector_pixels([plan for _, plan in images], self.batch_pixels)]
+        return [result for future in futures for result in future.result()]
+
+    def get_stats(self):
+        return self.pool.get_stats()
+
+    def close(self, timeout: float = 5):
+        self.pool.close(timeout)
@@ -0,0 +1,135 @@
+import threading
+import time
+from concurrent.futures import Future
+
+LABEL_PART = "labels"
+FACE_PART = "faces"
+# result key listing the parts a job could not compute, they run again on the next trigger
+FAILED_PARTS = "failed_parts"
+
+
+class ImageJobTracker:
+    """
+    De-duplicates per-image jobs triggered from several places (redis label
+    stream, db face listener, startup backlog).
+
+    The first trigger for an image runs the job for every part it asks for;
+    a later trigger within `ttl` seconds whose parts are already covered
+    waits for / reuses that result instead of downloading and running the
+    models again.
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def run(self, image_id: str, parts: set, job_fn):
+        """
+        :param parts: subset of {LABEL_PART, FACE_PART} the caller needs
+        :param job_fn: function(parts) -> result dict, called with the missing parts only.
+            Parts listed in result[FAILED_PARTS] are not marked done.
+        :return: (result dict, set of parts this call actually ran)
+        """
+        with self._lock:
+            self._expire()
+            missing, previous, future = self._claim(image_id, parts)
+
+        if not missing:
+            return future.result(), set()
+
+        try:
+            result = job_fn(missing)
+        except Exception as e:
+            self._fail(image_id, future, e)
+            raise
+        return self._finish(image_id, missing, previous, future, result)
+
+    def run_many(self, image_ids: list, parts: set, batch_fn):
+        """
+        run() for a batch of images sharing one job (startup backlog).
+
+        Images whose parts are already done or in flight in another job are
+        left out of the batch. An image the batch failed on is not marked
+        done, the next trigger retries it.
+
+        :param batch_fn: function(image ids) -> {image_id: result dict or the exception the image failed with},
+            called with the images missing one of `parts`
+        :return: {image_id: result dict or exception} of the images this call ran
+        """
+        claims = {}
+        with self._lock:
+            self._expire()
+            for image_id in dict.fromkeys(image_ids):
+                missing, previous, future = self._claim(image_id, parts)
+                if missing:
+                    claims[image_id] = missing, previous, future
+        if not claims:
+            return {}
+
+        try:
+            results = batch_fn(list(claims))
+        except Exception as e:
+            for image_id, (_, _, future) in claims.items():
+                self._fail(image_id, future, e)
+            raise
+
+        ran = {}
+        for image_id, (missing, previous, future) in claims.items():
+            result = results.get(image_id)
+            if result is None:
+                result = RuntimeError(f"Image {image_id} missing from the batch result")
+            if isinstance(result, Exception):
+                self._fail(image_id, future, result)
+                ran[image_id] = result
+            else:
+                ran[image_id] = self._finish(image_id, missing, previous, future, result)[0]
+        return ran
+
+    def _claim(self, image_id: str, parts: set):
+        """(missing parts, previous future, future of this job), with the lock held."""
+        entry = self._entries.get(image_id)
+        done_parts = entry["parts"] if entry else set()
+        missing = set(parts) - done_parts
+        previous = entry["future"] if entry else None
+        if not missing:
+            return missing, previous, previous
+        future = Future()
+        self._entries[image_id] = {
+            "parts": done_parts | missing,
+            "future": future,
+            "created_at": time.monotonic(),
+        }
+        return missing, previous, future
+
+    def _finish(self, image_id: str, missing: set, previous: Future, future: Future, result: dict):
+        failed = set(result.get(FAILED_PARTS, ())) & missing
+        if previous is not None:
+            # keep the parts computed by the earlier job
+            try:
+                result = {**previous.result(), **result}
+            except Exception:
+                pass
+        result.pop(FAILED_PARTS, None)
+        if failed:
+            result[FAILED_PARTS] = failed
+            with self._lock:
+                entry = self._entries.get(image_id)
+                if entry is not None and entry["future"] is future:
+                    entry["parts"] = entry["parts"] - failed
+        future.set_result(result)
+        return result, missing - failed
+
+    def _fail(self, image_id: str, future: Future, error: Exception):
+        future.set_exception(error)
+        with self._lock:
+            # let the next trigger retry
+            if self._entries.get(image_id, {}).get("future") is future:
+                self._entries.pop(image_id)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items()
+                   if entry["future"].done() and now - entry["created_at"] > self.ttl]
+        for key in expired:
+            self._entries.pop(key)
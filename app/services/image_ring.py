@@ -0,0 +1,127 @@
+import queue
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+from app.libs.logger.log import log_info
+
+
+class RingFullError(RuntimeError):
+    pass
+
+
+class SharedImageRing:
+    """
+    Preallocated image slots in one shared memory block, so decoded pixels
+    reach the inference workers without being pickled.
+
+    Every slot holds one CLIP preprocess output ([3, H, W] float32) and one
+    face detector input (up to `face_max_pixels` RGB uint8 pixels). The
+    producer acquires a slot, writes the decoded image into it and sends
+    only the slot index (+ the face image shape) to a worker, which reads
+    the pixels in place. Workers forked after the ring is created share
+    its mapping; other processes can attach by name.
+
+    Slots are handed out and released by the creating process only: the
+    producer releases a slot once the worker's result (or failure) is back.
+
+    :param slots: number of images in flight at once
+    :param clip_size: (height, width) of the CLIP preprocess output
+    :param face_max_pixels: capacity of the face image of a slot, in pixels
+    """
+
+    def __init__(self, slots: int, clip_size=(224, 224), face_max_pixels: int = 1200 * 1200,
+                 name: str = None, create: bool = True):
+        self.slots = max(1, int(slots))
+        self.clip_shape = (3, *clip_size)
+        self.face_max_pixels = int(face_max_pixels)
+
+        self.clip_bytes = int(np.prod(self.clip_shape)) * 4
+        # keep each slot 64-byte aligned
+        self.slot_bytes = -(-(self.clip_bytes + self.face_max_pixels * 3) // 64) * 64
+        size = self.slot_bytes * self.slots
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=create, size=size if create else 0)
+        self.owner = create
+
+        self._free = queue.Queue()
+        for index in range(self.slots):
+            self._free.put(index)
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "waits": 0, "oversize": 0}
+        if create:
+            log_info(
+                f"Shared image ring: {self.slots} slots, {size / 1024 / 1024:.1f} MB ({self.shm.name})")
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def acquire(self, timeout: float = None) -> int:
+        """Index of a free slot, waits up to `timeout` seconds -> RingFullError."""
+        try:
+            index = self._free.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self._stats["waits"] += 1
+            try:
+                index = self._free.get(timeout=timeout)
+            except queue.Empty:
+                raise RingFullError(
+                    f"No free image slot after {timeout} seconds")
+        with self._lock:
+            self._stats["acquired"] += 1
+        return index
+
+    def release(self, index: int):
+        self._free.put(index)
+
+    def fits_face(self, height: int, width: int):
+        fits = height * width <= self.face_max_pixels
+        if not fits:
+            with self._lock:
+                self._stats["oversize"] += 1
+        return fits
+
+    def clip_tensor(self, index: int) -> torch.Tensor:
+        """[3, H, W] float32 view of the slot's CLIP input (no copy)."""
+        return torch.from_numpy(np.ndarray(
+            self.clip_shape, dtype=np.float32, buffer=self.shm.buf, offset=self._offset(index)))
+
+    def face_array(self, index: int, height: int, width: int) -> np.ndarray:
+        """[height, width, 3] uint8 view of the slot's face detector input (no copy)."""
+        return np.ndarray((height, width, 3), dtype=np.uint8, buffer=self.shm.buf,
+                          offset=self._offset(index) + self.clip_bytes)
+
+    def write_clip(self, index: int, image_tensor: torch.Tensor):
+        self.clip_tensor(index).copy_(image_tensor.reshape(self.clip_shape))
+
+    def write_face(self, index: int, image: np.ndarray):
+        """Copy an RGB uint8 image into the slot -> (height, width) to send along with the index."""
+        height, width = image.shape[:2]
+        if not self.fits_face(height, width):
+            raise ValueError(
+                f"Face image {width}x{height} exceeds the slot capacity of {self.face_max_pixels} pixels")
+        self.face_array(index, height, width)[...] = image
+        return height, width
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "free": self._free.qsize(),
+                "slot_mb": round(self.slot_bytes / 1024 / 1024, 2),
+                **self._stats,
+            }
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def _offset(self, index: int):
+        if not 0 <= index < self.slots:
+            raise IndexError(f"Slot {index} out of range")
+        return index * self.slot_bytes
@@ -0,0 +1,337 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import wait
+
+from app.libs.logger.log import log_error, log_info
+
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkerCrashedError(RuntimeError):
+    pass
+
+
+class TaskTimeoutError(WorkerCrashedError):
+    pass
+
+
+class PoolBusyError(RuntimeError):
+    pass
+
+
+class InferenceWorkerPool:
+    """
+    Worker processes forked from a process that already loaded the models.
+
+    The workers inherit `target` (CLIP weights, label matrix, dlib models)
+    copy-on-write instead of loading their own copy, so N workers cost
+    about one model footprint. The API process calls submit(method, ...)
+    and gets a concurrent.futures.Future (asyncio.wrap_future for async
+    callers); the job runs as target.method(*args) in a worker process.
+    A worker runs up to `concurrency` jobs at once, so its own CLIP
+    micro-batcher can still form batches.
+
+    Every worker has its own job pipe and result pipe. The parent keeps
+    the queue and hands a job to the least busy worker with a free slot,
+    so it always knows which jobs a worker holds: there is no lock shared
+    between processes that a dying worker could leave held.
+
+    Fork before starting threads that use the models: a child only gets
+    the forking thread, a lock held by another thread stays locked in it.
+    A worker that dies fails every job handed to it with
+    WorkerCrashedError and is forked again. A job running longer than
+    `task_timeout` gets its worker killed (the only way to stop native code)
+    and fails with TaskTimeoutError.
+
+    :param target: object whose methods run in the workers
+    :param processes: number of worker processes
+    :param concurrency: jobs run at once per worker
+    :param initializer: function(target) run in every worker right after the fork
+    :param max_pending: bound of queued + running jobs, submit() waits up to
+        `submit_timeout` seconds for room -> PoolBusyError
+    :param task_timeout: seconds a job may run, None -> no limit
+    :param name: used in logs and thread names
+    """
+
+    def __init__(self, target, processes: int, concurrency: int = 4, initializer=None,
+                 max_pending: int = None, submit_timeout: float = None, task_timeout: float = None,
+                 name: str = "inference"):
+        self.target = target
+        self.name = name
+        self.processes = max(1, int(processes))
+        self.concurrency = max(1, int(concurrency))
+        self.initializer = initializer
+        self.max_pending = max_pending
+        self.submit_timeout = submit_timeout
+        self.task_timeout = task_timeout
+        self._room = threading.BoundedSemaphore(
+            max_pending) if max_pending else None
+        # jobs whose worker was killed for running too long
+        self._timed_out = set()
+
+        self._ctx = multiprocessing.get_context("fork")
+        self._ids = itertools.count()
+        # (job id, pickled job) not handed to a worker yet
+        self._queue = collections.deque()
+        # job id -> [future, pid of the worker running it, start time]
+        self._pending = {}
+        # worker pid -> ids of the jobs handed to it
+        self._assigned = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._stats = {"submitted": 0, "completed": 0,
+                       "failed": 0, "crashes": 0, "timeouts": 0, "rejected": 0}
+
+        # [(process, result pipe reader, job pipe writer, job pipe lock)]
+        self._workers = [self._spawn() for _ in range(self.processes)]
+        self._collector = threading.Thread(
+            target=self._collect, name=f"{name}-workers", daemon=True)
+        self._collector.start()
+        log_info(
+            f"Started {self.processes} {name} worker processes: {[worker[0].pid for worker in self._workers]}")
+
+    def submit(self, method: str, *args, **kwargs) -> Future:
+        if self._closed.is_set():
+            raise RuntimeError(f"{self.name} worker pool is closed")
+        job_id = next(self._ids)
+        # pickled here so an unpicklable argument fails in the caller
+        payload = pickle.dumps((job_id, method, args, kwargs),
+                               protocol=pickle.HIGHEST_PROTOCOL)
+        if self._room is not None and not self._room.acquire(timeout=self.submit_timeout):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise PoolBusyError(
+                f"{self.max_pending} jobs already queued or running")
+        future = Future()
+        with self._lock:
+            self._pending[job_id] = [future, None, None]
+            self._queue.append((job_id, payload))
+            self._stats["submitted"] += 1
+        self._dispatch()
+        return future
+
+    def close(self, timeout: float = 5):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        for _, _, jobs, send_lock in self._workers:
+            try:
+                with send_lock:
+                    jobs.send_bytes(pickle.dumps(None))
+            except (OSError, ValueError):
+                pass
+        deadline = time.monotonic() + timeout
+        self._collector.join(timeout)
+        for worker, reader, jobs, _ in self._workers:
+            worker.join(max(0, deadline - time.monotonic()))
+            if worker.is_alive():
+                worker.terminate()
+            reader.close()
+            jobs.close()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._queue.clear()
+            self._assigned.clear()
+        for future, _, _ in pending.values():
+            self._release_room()
+            if future.set_running_or_notify_cancel() or future.running():
+                future.set_exception(RuntimeError(
+                    f"{self.name} worker pool is closed"))
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "alive": sum(worker[0].is_alive() for worker in self._workers),
+                "concurrency": self.concurrency,
+                "max_pending": self.max_pending,
+                "pending": len(self._pending),
+                "queued": len(self._queue),
+                **self._stats,
+            }
+
+    def _spawn(self):
+        reader, writer = self._ctx.Pipe(duplex=False)
+        job_reader, jobs = self._ctx.Pipe(duplex=False)
+        worker = self._ctx.Process(
+            target=_worker_main,
+            args=(self.target, job_reader, writer,
+                  self.concurrency, self.initializer),
+            daemon=True,
+        )
+        worker.start()
+        writer.close()
+        job_reader.close()
+        return worker, reader, jobs, threading.Lock()
+
+    def _dispatch(self):
+        """Hands queued jobs to the least busy workers with a free slot."""
+        while True:
+            with self._lock:
+                if not self._queue or self._closed.is_set():
+                    return
+                # a dead worker is reaped (is_alive() False) before
+                # _replace_worker fails its jobs, so none is handed to it after
+                free = [worker for worker in self._workers if worker[0].is_alive()
+                        and len(self._assigned.get(worker[0].pid, ())) < self.concurrency]
+                if not free:
+                    return
+                worker, _, jobs, send_lock = min(
+                    free, key=lambda worker: len(self._assigned.get(worker[0].pid, ())))
+                job_id, payload = self._queue.popleft()
+                entry = self._pending[job_id]
+                # running from here on, a caller that gave up cancelled it while queued
+                cancelled = not entry[0].set_running_or_notify_cancel()
+                if cancelled:
+                    del self._pending[job_id]
+                else:
+                    entry[1] = worker.pid
+                    entry[2] = time.monotonic()
+                    self._assigned.setdefault(worker.pid, set()).add(job_id)
+            if cancelled:
+                self._release_room()
+                continue
+            try:
+                with send_lock:
+                    jobs.send_bytes(payload)
+            except (OSError, ValueError):
+                # the worker died meanwhile, _replace_worker fails the job
+                pass
+
+    def _collect(self):
+        while not self._closed.is_set():
+            readers = {worker[1]: i for i, worker in enumerate(self._workers)}
+            sentinels = {worker[0].sentinel: i for i,
+                         worker in enumerate(self._workers)}
+            for ready in wait(list(readers) + list(sentinels), timeout=0.5):
+                if ready in readers:
+                    try:
+                        self._resolve(*ready.recv())
+                    except (EOFError, OSError):
+                        # the sentinel reports the exit
+                        pass
+                elif not self._closed.is_set():
+                    self._replace_worker(sentinels[ready])
+            if self.task_timeout is not None:
+                self._kill_timed_out()
+
+    def _kill_timed_out(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = {job_id: pid for job_id, (_, pid, started) in self._pending.items()
+                       if started is not None and now - started > self.task_timeout
+                       and job_id not in self._timed_out}
+            self._timed_out.update(expired)
+        for pid in set(expired.values()):
+            for worker, _, _, _ in self._workers:
+                if worker.pid == pid and worker.is_alive():
+                    log_error(
+                        f"{self.name} worker {pid} ran a job for more than {self.task_timeout} seconds, killing it")
+                    worker.kill()
+
+    def _resolve(self, job_id: int, status: str, value):
+        with self._lock:
+            entry = self._pending.pop(job_id, None)
+            if entry is None:
+                return
+            self._assigned.get(entry[1], set()).discard(job_id)
+            self._timed_out.discard(job_id)
+            self._stats["completed" if status == DONE else "failed"] += 1
+        self._release_room()
+        future = entry[0]
+        if status == DONE:
+            try:
+                future.set_result(pickle.loads(value))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future.set_exception(RuntimeError(value))
+        self._dispatch()
+
+    def _replace_worker(self, i: int):
+        worker, reader, jobs, send_lock = self._workers[i]
+        # results sent before the exit are still in the pipe
+        while reader.poll():
+            try:
+                self._resolve(*reader.recv())
+            except (EOFError, OSError):
+                break
+        reader.close()
+        worker.join()
+        log_error(
+            f"{self.name} worker {worker.pid} exited with code {worker.exitcode}, forking a new one")
+        with self._lock:
+            self._stats["crashes"] += 1
+            # every job handed to the worker, running or still in its pipe
+            lost = self._assigned.pop(worker.pid, set())
+            failures = []
+            for job_id in lost:
+                future = self._pending.pop(job_id)[0]
+                if job_id in self._timed_out:
+                    self._timed_out.discard(job_id)
+                    self._stats["timeouts"] += 1
+                    failures.append((future, TaskTimeoutError(
+                        f"Job ran for more than {self.task_timeout} seconds")))
+                else:
+                    failures.append((future, WorkerCrashedError(
+                        f"{self.name} worker {worker.pid} exited with code {worker.exitcode}")))
+            self._stats["failed"] += len(failures)
+        for future, error in failures:
+            self._release_room()
+            future.set_exception(error)
+        self._workers[i] = self._spawn()
+        with send_lock:
+            jobs.close()
+        self._dispatch()
+
+    def _release_room(self):
+        if self._room is not None:
+            self._room.release()
+
+
+def _worker_main(target, jobs, results, concurrency: int, initializer):
+    if initializer is not None:
+        initializer(target)
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            results.send(message)
+
+    # the parent hands out at most `concurrency` jobs at once
+    executor = ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="inference-job")
+
+    def run(job_id, method, args, kwargs):
+        try:
+            value = getattr(target, method)(*args, **kwargs)
+            # pickled here, an unpicklable result fails the job instead of the pipe
+            send((job_id, DONE, pickle.dumps(
+                value, protocol=pickle.HIGHEST_PROTOCOL)))
+        except Exception as e:
+            send((job_id, FAILED,
+                 f"{type(e).__name__}: {e}\n{traceback.format_exc()}"))
+
+    parent = os.getppid()
+    while True:
+        if not jobs.poll(1):
+            # the API process was killed -> do not linger as an orphan
+            if os.getppid() != parent:
+                break
+            continue
+        try:
+            job = pickle.loads(jobs.recv_bytes())
+        except EOFError:
+            break
+        if job is None:
+            break
+        executor.submit(run, *job)
+    executor.shutdown(wait=True)
@@ -0,0 +1,109 @@
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from app.libs.logger.log import log_error, log_info
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelLoader:
+    """
+    Loads the heavy models once, in a background thread, so the server
+    accepts requests (health checks, /ready) while they load.
+
+    Steps run in registration order, a later step can use the objects of
+    the earlier ones through get(). The first failing step stops the
+    loader, the steps after it stay pending. Each step reports its state,
+    load time and warm up latency for /ready.
+    """
+
+    def __init__(self):
+        self._steps = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.done = threading.Event()
+
+    def register(self, name: str, load_fn, warm_up_fn=None):
+        """
+        :param load_fn: function() -> loaded object
+        :param warm_up_fn: optional function(loaded object), timed as warm up latency
+        """
+        self._steps[name] = {
+            "load_fn": load_fn,
+            "warm_up_fn": warm_up_fn,
+            "value": None,
+            "state": PENDING,
+            "load_seconds": None,
+            "warm_up_ms": None,
+            "error": None,
+        }
+        return self
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.run, name="model-loader", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        start = time.time()
+        try:
+            for name, step in self._steps.items():
+                if not self._run_step(name, step):
+                    return
+            log_info(f"All models loaded in {time.time() - start:.2f} seconds")
+        finally:
+            self.done.set()
+
+    def wait(self, timeout: float = None):
+        return self.done.wait(timeout)
+
+    def get(self, name: str):
+        """Loaded object of a step, None until it is ready."""
+        step = self._steps[name]
+        return step["value"] if step["state"] == READY else None
+
+    def is_ready(self, name: str = None):
+        names = [name] if name else list(self._steps)
+        return all(self._steps[step]["state"] == READY for step in names)
+
+    def status(self):
+        with self._lock:
+            models = {name: {key: step[key] for key in ("state", "load_seconds", "warm_up_ms", "error")}
+                      for name, step in self._steps.items()}
+        return {"ready": all(model["state"] == READY for model in models.values()), "models": models}
+
+    def _run_step(self, name: str, step: dict):
+        self._update(step, state=LOADING)
+        start = time.time()
+        try:
+            value = step["load_fn"]()
+            load_seconds = round(time.time() - start, 3)
+
+            warm_up_ms = None
+            if step["warm_up_fn"] is not None:
+                warm_up_start = time.perf_counter()
+                step["warm_up_fn"](value)
+                warm_up_ms = round(
+                    (time.perf_counter() - warm_up_start) * 1000, 1)
+        except Exception as e:
+            log_error(
+                f"Error loading {name}: {e}\n{traceback.format_exc()}")
+            self._update(step, state=FAILED, error=str(e),
+                         load_seconds=round(time.time() - start, 3))
+            return False
+
+        self._update(step, value=value, state=READY,
+                     load_seconds=load_seconds, warm_up_ms=warm_up_ms)
+        log_info(
+            f"{name} loaded in {load_seconds} seconds" + (f", warm up {warm_up_ms} ms" if warm_up_ms is not None else ""))
+        return True
+
+    def _update(self, step: dict, **values):
+        with self._lock:
+            step.update(values)
@@ -9,6 +9,11 @@ class RedisService:
             port=settings.redis_port,
             decode_responses=True
         )
+        # raw bytes values, e.g. float32 embeddings
+        self.binary_client = redis.StrictRedis(
+            host=settings.redis_host,
+            port=settings.redis_port,
+        )
 
     def push_to_stream(self, stream_name: str, data: dict):
         self.client.xadd(stream_name, data)
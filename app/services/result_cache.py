@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from app.libs.logger.log import log_error, log_info
+
+IMAGE_FEATURES = "image_features"
+LABELS = "labels"
+FACES = "faces"
+
+
+def content_key(image_data: bytes) -> str:
+    return hashlib.sha256(image_data).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of model outputs, keyed by the sha256 of the
+    downloaded image bytes, so re-uploads of the same photo skip inference.
+
+    Entries live in a SQLite file (survives restarts, safe to share between
+    worker processes) and are evicted least-recently-used once the stored
+    payload exceeds `max_bytes`.
+
+    Every entry is stored under (key, kind, version): `version` identifies
+    the model / settings that produced it so a model change never serves
+    stale results.
+
+    The payload total is a one-row counter kept by triggers, so a write
+    never sums the table; eviction deletes the oldest entries in batches.
+    Reads only SELECT: their last access times are buffered and written
+    in one transaction once `touch_batch` entries were read or after
+    `touch_interval` seconds (and before an eviction).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024, touch_batch: int = 64,
+                 touch_interval: float = 5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        # (key, kind, version) -> last access not written yet
+        self._touched = {}
+        self._touched_at = time.monotonic()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    key TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (key, kind, version)
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS result_cache_last_access ON result_cache (last_access)")
+            # payload total, caches created before the counter start from the current sum
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+            self._conn.execute(
+                "INSERT OR IGNORE INTO result_cache_size SELECT 0, COALESCE(SUM(size), 0) FROM result_cache")
+            self._conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS result_cache_size_insert AFTER INSERT ON result_cache BEGIN
+                    UPDATE result_cache_size SET total = total + new.size;
+                END
+            """)
+            self._conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS result_cache_size_update AFTER UPDATE OF size ON result_cache BEGIN
+                    UPDATE result_cache_size SET total = total + new.size - old.size;
+                END
+            """)
+            self._conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS result_cache_size_delete AFTER DELETE ON result_cache BEGIN
+                    UPDATE result_cache_size SET total = total - old.size;
+                END
+            """)
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, kind: str, version: str):
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value FROM result_cache WHERE key = ? AND kind = ? AND version = ?",
+                    (key, kind, version)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                self.hits += 1
+                self._touched[(key, kind, version)] = time.time()
+                if len(self._touched) >= self.touch_batch or \
+                        time.monotonic() - self._touched_at > self.touch_interval:
+                    self._flush_touched()
+            return decode_value(kind, row[0])
+        except sqlite3.Error as e:
+            log_error(f"Error reading result cache: {e}")
+            return None
+
+    def get_many(self, key: str, kinds: dict):
+        """:param kinds: {kind: version} -> {kind: value} of the entries found"""
+        found = {}
+        for kind, version in kinds.items():
+            value = self.get(key, kind, version)
+            if value is not None:
+                found[kind] = value
+        return found
+
+    def set(self, key: str, kind: str, version: str, value):
+        try:
+            blob = encode_value(kind, value)
+            with self._lock, self._transaction():
+                self._conn.execute(
+                    "INSERT INTO result_cache (key, kind, version, value, size, last_access) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (key, kind, version) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                    "last_access = excluded.last_access",
+                    (key, kind, version, blob, len(blob), time.time()))
+                if self._total() > self.max_bytes:
+                    self._evict()
+        except sqlite3.Error as e:
+            log_error(f"Error writing result cache: {e}")
+
+    def total_bytes(self):
+        with self._lock:
+            return self._total()
+
+    def get_stats(self):
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM result_cache").fetchone()[0]
+            size = self._total()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            try:
+                self._flush_touched()
+            except sqlite3.Error as e:
+                log_error(f"Error writing result cache: {e}")
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _total(self):
+        return self._conn.execute("SELECT total FROM result_cache_size").fetchone()[0]
+
+    def _flush_touched(self):
+        touched, self._touched = self._touched, {}
+        self._touched_at = time.monotonic()
+        if not touched:
+            return
+        in_transaction = self._conn.in_transaction
+        if not in_transaction:
+            self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "UPDATE result_cache SET last_access = max(last_access, ?) WHERE key = ? AND kind = ? AND version = ?",
+                [(last_access, *entry) for entry, last_access in touched.items()])
+        except BaseException:
+            if not in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+        if not in_transaction:
+            self._conn.execute("COMMIT")
+
+    def _evict(self, batch_size: int = 256):
+        # LRU order includes the buffered reads
+        self._flush_touched()
+        # drop least recently used entries down to 90% of the budget
+        target = self.max_bytes * 0.9
+        total = self._total()
+        evicted = 0
+        while total > target:
+            rows = self._conn.execute(
+                "SELECT rowid, size FROM result_cache ORDER BY last_access ASC LIMIT ?", (batch_size,)).fetchall()
+            if not rows:
+                break
+            doomed = []
+            for rowid, size in rows:
+                if total <= target:
+                    break
+                doomed.append((rowid,))
+                total -= size
+            self._conn.executemany("DELETE FROM result_cache WHERE rowid = ?", doomed)
+            evicted += len(doomed)
+        log_info(f"Result cache evicted {evicted} entries")
+
+
+def encode_value(kind: str, value) -> bytes:
+    if kind == IMAGE_FEATURES:
+        return np.asarray(value, dtype=np.float32).tobytes()
+    if kind == FACES:
+        face_locations, face_encodings = value
+        value = {
+            "face_locations": [list(location) for location in face_locations],
+            "face_encodings": [np.asarray(encoding).tolist() for encoding in face_encodings],
+        }
+    return json.dumps(value).encode("utf-8")
+
+
+def decode_value(kind: str, blob: bytes):
+    if kind == IMAGE_FEATURES:
+        return np.frombuffer(blob, dtype=np.float32).copy()
+    value = json.loads(blob.decode("utf-8"))
+    if kind == FACES:
+        return (
+            [tuple(location) for location in value["face_locations"]],
+            [np.array(encoding) for encoding in value["face_encodings"]],
+        )
+    return value
@@ -0,0 +1,144 @@
+import datetime
+import json
+import threading
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from app.libs.logger.log import log_error, log_info
+from app.services.supabase_service import SupabaseService
+from app.services.text_embedding_cache import normalize_query
+
+
+class SearchHistoryStore:
+    """
+    One search_history row per (user_id, normalized query).
+
+    A repeated query reuses the id and the stored text features of the
+    existing row instead of inserting a new one; only genuinely new queries
+    are inserted. Known rows are kept in an in-process LRU, everything else
+    is looked up with one query per search (exact match on the raw and the
+    normalized text). Reuses are counted in memory and a background thread
+    adds them to hit_count / last_used_at in bulk every `flush_interval`
+    seconds; only the increments are sent, so several server processes
+    never overwrite each other's counts.
+
+    :param supabase_service: SupabaseService
+    :param max_entries: size of the in-process LRU
+    """
+
+    def __init__(self, supabase_service: SupabaseService, flush_interval: float = 30, max_entries: int = 4096):
+        self.supabase_service = supabase_service
+        self.flush_interval = flush_interval
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_or_create(self, user_id: str, text: str, encode_fn):
+        """(search_history_id, [1, D] text features); encode_fn(text) only runs for new queries."""
+        ids, features = self.get_or_create_many(
+            user_id, [text], lambda texts: encode_fn(texts[0]))
+        return ids[0], features
+
+    def get_or_create_many(self, user_id: str, texts: list, encode_fn):
+        """([search_history_id], [Q, D] text features), new queries inserted with one encode + one insert."""
+        keys = [normalize_query(text) for text in texts]
+        entries = {key: self._get_local(user_id, key) for key in dict.fromkeys(keys)}
+
+        missing = [key for key, entry in entries.items() if entry is None]
+        if missing:
+            raw = {key: text for key, text in zip(keys, texts)}
+            for row in self.supabase_service.find_search_history(
+                    user_id, list(dict.fromkeys(missing + [raw[key] for key in missing]))):
+                key = normalize_query(row['content'])
+                if key in entries and entries[key] is None:
+                    entries[key] = self._set_local(user_id, key, row)
+
+        new_keys = [key for key, entry in entries.items() if entry is None]
+        if new_keys:
+            new_texts = [texts[keys.index(key)] for key in new_keys]
+            new_features = encode_fn(new_texts).float()
+            new_ids = self.supabase_service.save_text_features_to_search_history_many(
+                new_texts, user_id, new_features.tolist())
+            for key, search_history_id, features in zip(new_keys, new_ids, new_features):
+                entries[key] = self._set_local(user_id, key, {
+                    'id': search_history_id, 'text_features': features.numpy()})
+
+        reused = {key for key in entries if key not in new_keys}
+        for key in reused:
+            self._record_hit(entries[key])
+        return [entries[key]['id'] for key in keys], torch.from_numpy(
+            np.stack([entries[key]['features'] for key in keys]))
+
+    def flush(self):
+        """Add the pending hits / last used timestamps to the rows -> number of rows updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self.supabase_service.touch_search_history(
+                pending, datetime.datetime.now(datetime.timezone.utc).isoformat())
+        except Exception:
+            # keep the hits for the next flush
+            with self._lock:
+                for search_history_id, hits in pending.items():
+                    self._pending[search_history_id] = self._pending.get(
+                        search_history_id, 0) + hits
+            raise
+        return len(pending)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="search-history-flush", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                updated = self.flush()
+                if updated:
+                    log_info(f"Search history usage flushed for {updated} rows")
+            except Exception as e:
+                log_error(
+                    f"Error flushing search history usage: {e}\n{traceback.format_exc()}")
+
+    def _get_local(self, user_id: str, key: str):
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is not None:
+                self._entries.move_to_end((user_id, key))
+            return entry
+
+    def _set_local(self, user_id: str, key: str, row: dict):
+        features = row['text_features']
+        # pgvector columns come back as "[0.1,0.2,...]" strings
+        if isinstance(features, str):
+            features = json.loads(features)
+        entry = {
+            'id': row['id'],
+            'features': np.asarray(features, dtype=np.float32),
+        }
+        with self._lock:
+            self._entries[(user_id, key)] = entry
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _record_hit(self, entry: dict):
+        with self._lock:
+            self._pending[entry['id']] = self._pending.get(entry['id'], 0) + 1
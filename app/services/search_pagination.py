@@ -0,0 +1,61 @@
+import base64
+import bisect
+import json
+
+
+def encode_cursor(state: dict) -> str:
+    """Opaque URL-safe cursor of a search page."""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if not isinstance(state, dict) or "h" not in state:
+        raise ValueError("Invalid cursor.")
+    return state
+
+
+def order_matches(matches: list):
+    """(id, similarity) pairs in page order: similarity desc, id asc on ties -> stable across requests."""
+    return sorted(matches, key=lambda match: (-match[1], str(match[0])))
+
+
+def page_after(matches: list, state: dict, limit: int):
+    """
+    One page of ordered (id, similarity) matches after the cursor position.
+
+    The cursor keeps the (similarity, id) of the last returned image, not an
+    offset, so images added between two page requests never shift or repeat
+    results.
+
+    :param matches: output of order_matches
+    :param state: decoded cursor, None for the first page
+    :return: (page, state of the next page or None when this is the last one)
+    """
+    if state is not None and "s" not in state:
+        # an offset cursor of the database fallback, its position means nothing here
+        raise ValueError("Invalid cursor: the search changed backend, start again without a cursor.")
+    start = 0
+    if state is not None:
+        keys = [(-similarity, str(image_id)) for image_id, similarity in matches]
+        start = bisect.bisect_right(keys, (-state["s"], str(state["id"])))
+    page = matches[start:start + limit]
+    if start + limit >= len(matches) or not page:
+        return page, None
+    image_id, similarity = page[-1]
+    return page, {"s": similarity, "id": image_id}
+
+
+def rows_page_after(rows: list, state: dict, limit: int):
+    """Offset paging of already ordered rows (database search fallback)."""
+    if state is not None and "o" not in state:
+        # a keyset cursor of the vector index
+        raise ValueError("Invalid cursor: the search changed backend, start again without a cursor.")
+    start = state["o"] if state is not None else 0
+    page = rows[start:start + limit]
+    if start + limit >= len(rows):
+        return page, None
+    return page, {"o": start + limit}
@@ -1,3 +1,4 @@
+from collections import Counter
 import datetime
 import json
 import time
@@ -8,11 +9,23 @@ import torch
 from app.core.config import settings
 from app.libs.logger.log import log_error, log_info
 
+# image columns returned to the client (everything but image_features)
+IMAGE_ROW_COLUMNS = 'id, image_bucket_id, image_name, labels, uploader_id, is_face_detection, created_at, updated_at'
+
 
 class SupabaseService:
     def __init__(self):
         self.client: Client = create_client(
             settings.supabase_url, settings.supabase_key)
+        # called with (image_row, image_features) after every features write
+        self.image_features_listeners = []
+
+    def add_image_features_listener(self, listener):
+        self.image_features_listeners.append(listener)
+
+    def notify_image_features_saved(self, image_row: dict, image_features):
+        for listener in self.image_features_listeners:
+            listener(image_row, image_features)
 
     def query_image_by_search_history_id(self, search_history_id: str, user_id: str, threshold=0.24):
 
@@ -44,6 +57,43 @@ class SupabaseService:
                 f"Error save text_features to search history: {e}\n{traceback.format_exc()}")
             raise e
 
+    def save_text_features_to_search_history_many(self, texts: list, user_id: str, text_features: list):
+        # one insert for a batch of queries -> ids in the same order
+        try:
+            response = self.client.table('search_history').insert([{
+                'content': text,
+                'text_features': features,
+                'user_id': user_id,
+            } for text, features in zip(texts, text_features)]).execute()
+            return [row['id'] for row in response.data]
+        except Exception as e:
+            log_error(
+                f"Error save text_features batch to search history: {e}\n{traceback.format_exc()}")
+            raise e
+
+    def find_search_history(self, user_id: str, contents: list):
+        # existing searches of the user with one of the given contents, newest first
+        # (no usage columns -> works before the search_history_usage migration)
+        response = self.client.table('search_history').select('id, content, text_features').eq(
+            'user_id', user_id).in_('content', contents).order('created_at', desc=True).execute()
+        return response.data
+
+    def touch_search_history(self, hits: dict, last_used_at: str):
+        # hits: {search_history_id: new hits}, added in the database -> one statement per flush
+        # needs supabase/migrations/*_search_history_usage.sql and *_increment_search_history_hits.sql
+        self.client.rpc('increment_search_history_hits', {
+            'hits': hits,
+            'used_at': last_used_at,
+        }).execute()
+
+    def get_frequent_search_queries(self, limit: int = 500, scan: int = 5000):
+        # most frequent search contents among the latest `scan` searches
+        response = self.client.table('search_history').select(
+            'content').order('created_at', desc=True).limit(scan).execute()
+        counts = Counter(
+            row['content'] for row in response.data if row.get('content'))
+        return [content for content, _ in counts.most_common(limit)]
+
     def get_all_images(self):
         # get first 100 images from the database sort by created_at desc
         start = time.time()
@@ -81,7 +131,6 @@ class SupabaseService:
                 'labels': labels,
                 'image_features': image_features,
             }).eq('image_bucket_id', image_bucket_id).eq('image_name', image_name).execute()
-            return response.data[0]
         else:
             response = self.client.table('image').update({
                 "updated_at": datetime.datetime.now().isoformat(),
@@ -89,11 +138,76 @@ class SupabaseService:
                 'image_features': image_features,
                 'uploader_id': user_id,
             }).eq('image_bucket_id', image_bucket_id).eq('image_name', image_name).execute()
-            return response.data[0]
-
-    def mark_image_done_face_detection(self, image_id: str):
+        image_row = response.data[0]
+        self.notify_image_features_saved(image_row, image_features)
+        return image_row
+
+    def get_user_image_features(self, user_id: str, page_size: int = 1000):
+        # all labeled images of the user -> (ids, [N, D] float32 features)
+        ids, features = [], []
+        start = 0
+        while True:
+            response = self.client.table('image').select('id, image_features').eq(
+                'uploader_id', user_id).not_.is_('image_features', 'null').order('id').range(start, start + page_size - 1).execute()
+            for row in response.data:
+                vector = row['image_features']
+                # pgvector columns come back as "[0.1,0.2,...]" strings
+                if isinstance(vector, str):
+                    vector = json.loads(vector)
+                ids.append(row['id'])
+                features.append(vector)
+            if len(response.data) < page_size:
+                break
+            start += page_size
+        return ids, np.asarray(features, dtype=np.float32)
+
+    def get_image_features_page(self, watermark: list = None, page_size: int = 1000):
+        # labeled images changed after the (updated_at, id) watermark, oldest first
+        # (watermark id None -> from updated_at on, see EmbeddingStoreSyncer lag)
+        query = self.client.table('image').select('id, uploader_id, image_features, updated_at').not_.is_(
+            'image_features', 'null')
+        if watermark is not None:
+            updated_at, image_id = watermark
+            if image_id is None:
+                query = query.gte('updated_at', updated_at)
+            else:
+                query = query.or_(
+                    f'updated_at.gt."{updated_at}",and(updated_at.eq."{updated_at}",id.gt."{image_id}")')
+        response = query.order('updated_at').order(
+            'id').limit(page_size).execute()
+        return [{
+            'id': row['id'],
+            'owner': row['uploader_id'],
+            'vector': json.loads(row['image_features']) if isinstance(row['image_features'], str) else row['image_features'],
+            'updated_at': row['updated_at'],
+        } for row in response.data]
+
+    def get_image_feature_ids(self, page_size: int = 10000):
+        # ids of every labeled image, for EmbeddingStoreSyncer.reconcile
+        ids = []
+        while True:
+            query = self.client.table('image').select('id').not_.is_('image_features', 'null')
+            if ids:
+                query = query.gt('id', ids[-1])
+            response = query.order('id').limit(page_size).execute()
+            ids.extend(row['id'] for row in response.data)
+            if len(response.data) < page_size:
+                return ids
+
+    def get_images_by_ids(self, image_ids: list, chunk_size: int = 200):
+        # image rows without the feature vectors, in no particular order
+        rows = []
+        for i in range(0, len(image_ids), chunk_size):
+            response = self.client.table('image').select(IMAGE_ROW_COLUMNS).in_(
+                'id', image_ids[i:i + chunk_size]).execute()
+            rows.extend(response.data)
+        return rows
+
+    def mark_image_done_face_detection(self, image_id: str, person_gate: dict = None):
+        # person_gate: the gate decision the detection ran with, kept for audits / re-runs
         return self.client.table('image').update({
-            "is_face_detection": True
+            "is_face_detection": True,
+            **person_gate_columns(person_gate),
         }).eq('id', image_id).execute()
 
     def update_person_table(self, face_encodings, face_locations, image_id, user_id, image_name):
@@ -103,14 +217,8 @@ class SupabaseService:
 
         log_info(
             f"Found {len(face_locations)} faces in image: {image_name}")
-        records = []
-        for encoding, location in zip(face_encodings, face_locations):
-            records.append({
-                'embedding': np.array(encoding).tolist(),
-                'coordinate': location,
-                'image_id': image_id,
-                'user_id': user_id,
-            })
+        records = person_records(
+            face_encodings, face_locations, image_id, user_id)
         try:
             self.client.table('person').insert(records).execute()
             return
@@ -118,6 +226,17 @@ class SupabaseService:
             log_error(
                 f"Error update person table: {e}\n{traceback.format_exc()}")
 
+    def save_face_detections(self, records: list, image_ids: list, person_gates: dict = None):
+        # person rows of a batch of images + their face flag (and person gate decision) in one
+        # transaction, faces already stored are skipped (supabase/migrations/*_save_face_detections.sql,
+        # *_image_person_gate.sql); raises -> nothing written
+        if image_ids:
+            self.client.rpc('save_face_detections', {
+                'records': records,
+                'image_ids': image_ids,
+                'gates': person_gates or {},
+            }).execute()
+
     def get_all_user_person(self, user_id):
         try:
             response = self.client.table('person').select(
@@ -237,5 +356,24 @@ class SupabaseService:
             raise e
 
 
+def person_gate_columns(person_gate: dict = None):
+    # image columns of a person gate decision (supabase/migrations/*_image_person_gate.sql)
+    if person_gate is None:
+        return {}
+    return {
+        'person_gate_score': person_gate['score'],
+        'person_gate_skipped': person_gate['skip'],
+    }
+
+
+def person_records(face_encodings, face_locations, image_id, user_id):
+    return [{
+        'embedding': np.array(encoding).tolist(),
+        'coordinate': location,
+        'image_id': image_id,
+        'user_id': user_id,
+    } for encoding, location in zip(face_encodings, face_locations)]
+
+
 def get_supabase_service():
     return SupabaseService()
@@ -0,0 +1,159 @@
+import hashlib
+import re
+import threading
+import traceback
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from app.libs.logger.log import log_error, log_info
+
+
+def normalize_query(text: str) -> str:
+    """Cache key form of a search query: NFKC, lower case, single spaces."""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class TextEmbeddingCache:
+    """
+    Normalized query -> CLIP text embedding.
+
+    Two tiers: an in-process LRU, then an optional Redis tier shared by every
+    worker. Only a miss in both runs the text encoder, and its result fills
+    both tiers. Redis errors are logged and treated as misses.
+
+    :param encode_fn: function mapping a list of queries to [N, D] normalized features
+    :param version: identifies the text encoder, part of every Redis key
+    :param max_entries: size of the in-process tier
+    :param redis_client: redis client returning raw bytes, None -> in-process only
+    :param redis_ttl: seconds a Redis entry lives after its last write
+    """
+
+    def __init__(self, encode_fn, version: str, max_entries: int = 4096, redis_client=None,
+                 redis_ttl: int = 7 * 24 * 3600, key_prefix: str = "text_embedding"):
+        self.encode_fn = encode_fn
+        self.version = version
+        self.max_entries = max_entries
+        self.redis_client = redis_client
+        self.redis_ttl = redis_ttl
+        self.key_prefix = key_prefix
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "redis_hits": 0, "misses": 0}
+
+    def get(self, text: str) -> torch.Tensor:
+        """Return the [1, D] float32 embedding of the query."""
+        return self.get_many([text])
+
+    def get_many(self, texts: list) -> torch.Tensor:
+        """Return the [Q, D] embeddings of the queries, every miss encoded in one forward pass."""
+        queries = [normalize_query(text) for text in texts]
+        features = {}
+        missing = []
+        for query in dict.fromkeys(queries):
+            cached = self._get_local(query)
+            if cached is not None:
+                self._count("hits")
+            else:
+                cached = self._get_redis(query)
+                if cached is not None:
+                    self._count("redis_hits")
+                    self._set_local(query, cached)
+            if cached is None:
+                missing.append(query)
+            else:
+                features[query] = cached
+
+        if missing:
+            with self._lock:
+                self._stats["misses"] += len(missing)
+            encoded = self.encode_fn(missing).float().cpu().numpy()
+            for query, row in zip(missing, encoded):
+                features[query] = row
+                self._set_local(query, row)
+                self._set_redis(query, row)
+        return torch.from_numpy(np.stack([features[query] for query in queries]))
+
+    def prewarm(self, texts: list, batch_size: int = 32):
+        """Fill the cache with the given queries, one encoder call per batch. Returns the number encoded."""
+        queries = []
+        for query in dict.fromkeys(normalize_query(text) for text in texts):
+            if not query or self._get_local(query) is not None:
+                continue
+            features = self._get_redis(query)
+            if features is not None:
+                self._set_local(query, features)
+            else:
+                queries.append(query)
+
+        for i in range(0, len(queries), batch_size):
+            batch = queries[i:i + batch_size]
+            features = self.encode_fn(batch).float().cpu().numpy()
+            for query, row in zip(batch, features):
+                self._set_local(query, row)
+                self._set_redis(query, row)
+        return len(queries)
+
+    def get_stats(self):
+        with self._lock:
+            return {**self._stats, "size": len(self._entries), "max_entries": self.max_entries,
+                    "redis": self.redis_client is not None}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _get_local(self, query: str):
+        with self._lock:
+            features = self._entries.get(query)
+            if features is not None:
+                self._entries.move_to_end(query)
+            return features
+
+    def _set_local(self, query: str, features: np.ndarray):
+        with self._lock:
+            self._entries[query] = features
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _redis_key(self, query: str):
+        digest = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        return f"{self.key_prefix}:{self.version}:{digest}"
+
+    def _get_redis(self, query: str):
+        if self.redis_client is None:
+            return None
+        try:
+            value = self.redis_client.get(self._redis_key(query))
+        except Exception as e:
+            log_error(f"Text embedding cache redis get failed: {e}")
+            return None
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=np.float32).copy()
+
+    def _set_redis(self, query: str, features: np.ndarray):
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.set(self._redis_key(query), np.asarray(
+                features, dtype=np.float32).tobytes(), ex=self.redis_ttl)
+        except Exception as e:
+            log_error(f"Text embedding cache redis set failed: {e}")
+
+
+def prewarm_text_embedding_cache(cache: TextEmbeddingCache, supabase_service, limit: int):
+    """Encode the most frequent search_history queries ahead of the first search."""
+    try:
+        queries = supabase_service.get_frequent_search_queries(limit)
+        encoded = cache.prewarm(queries)
+        log_info(
+            f"Text embedding cache prewarmed: {len(queries)} queries, {encoded} encoded")
+    except Exception as e:
+        log_error(
+            f"Error prewarming text embedding cache: {e}\n{traceback.format_exc()}")
@@ -0,0 +1,245 @@
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+
+from app.libs.logger.log import log_error, log_info
+
+
+class VectorIndex:
+    """
+    Exact cosine search over a contiguous matrix of normalized features.
+
+    Rows are kept in a growable [capacity, D] array (float16 halves the
+    memory, scores are always accumulated in float32) next to an id list, so
+    a query is one matmul plus a partial top-k.
+
+    :param dim: feature size (512 for convnext_base)
+    :param dtype: storage dtype, np.float32 or np.float16
+    """
+
+    SCORE_CHUNK = 16384
+
+    def __init__(self, dim: int = 512, dtype=np.float32):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.ids = []
+        self._positions = {}
+        self._matrix = np.empty((0, dim), dtype=self.dtype)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, ids: list, features):
+        """Insert or replace rows; features is [N, D] and gets L2 normalized."""
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) != features.shape[0]:
+            raise ValueError(
+                f"Got {len(ids)} ids for {features.shape[0]} feature rows")
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        features = features / np.maximum(norms, 1e-12)
+
+        with self._lock:
+            self._reserve(len(self.ids) + len(ids))
+            for image_id, row in zip(ids, features):
+                position = self._positions.get(image_id)
+                if position is None:
+                    position = len(self.ids)
+                    self.ids.append(image_id)
+                    self._positions[image_id] = position
+                self._matrix[position] = row
+
+    def remove(self, ids: list):
+        with self._lock:
+            for image_id in ids:
+                position = self._positions.pop(image_id, None)
+                if position is None:
+                    continue
+                # move the last row into the hole -> rows stay contiguous
+                last = len(self.ids) - 1
+                if position != last:
+                    last_id = self.ids[last]
+                    self._matrix[position] = self._matrix[last]
+                    self.ids[position] = last_id
+                    self._positions[last_id] = position
+                self.ids.pop()
+
+    def search(self, query, threshold: float = None, limit: int = None):
+        """
+        :param query: [D] or [1, D] normalized query features
+        :param threshold: min cosine similarity, None keeps every row
+        :param limit: max results, None returns everything above threshold
+        :return: [(id, similarity)] sorted by similarity desc
+        """
+        return self.search_many(np.asarray(query, dtype=np.float32).reshape(1, self.dim), threshold, limit)[0]
+
+    def search_many(self, queries, threshold: float = None, limit: int = None):
+        """Search [Q, D] queries with one [N, D] x [D, Q] matmul -> one result list per query."""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            size = len(self.ids)
+            if size == 0:
+                return [[] for _ in queries]
+            scores = self._scores(queries, size)
+            ids = list(self.ids)
+        return [top_matches(scores[:, i], ids, threshold, limit) for i in range(len(queries))]
+
+    def _scores(self, queries, size):
+        if self.dtype == np.float32:
+            return self._matrix[:size] @ queries.T
+        # numpy has no fast float16 matmul -> upcast one chunk at a time
+        scores = np.empty((size, len(queries)), dtype=np.float32)
+        for start in range(0, size, self.SCORE_CHUNK):
+            end = min(start + self.SCORE_CHUNK, size)
+            scores[start:end] = self._matrix[start:end].astype(
+                np.float32) @ queries.T
+        return scores
+
+    def _reserve(self, size):
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        matrix = np.empty((max(size, capacity * 2, 64), self.dim), dtype=self.dtype)
+        matrix[:len(self.ids)] = self._matrix[:len(self.ids)]
+        self._matrix = matrix
+
+
+class UserVectorIndexRegistry:
+    """
+    One VectorIndex per user, built on first search and kept in an LRU.
+
+    Writes that happen while a user's index is loading are buffered and
+    replayed on top of the loaded rows, so an image saved mid-build is never
+    lost. add() only sees the writes of this process: an index older than
+    `ttl` seconds is built again from the loader, which picks up the writes
+    of other processes / replicas and drops deleted images.
+
+    :param loader: function user_id -> (ids, [N, D] features)
+    :param max_users: number of user indexes kept in memory
+    :param index_factory: function (user_id, ids, features) -> populated index, default exact VectorIndex
+    :param ttl: seconds an index is used before it is rebuilt, None -> until evicted
+    """
+
+    def __init__(self, loader, dim: int = 512, dtype=np.float32, max_users: int = 256, index_factory=None,
+                 ttl: float = None):
+        self.loader = loader
+        self.dim = dim
+        self.dtype = dtype
+        self.max_users = max_users
+        self.index_factory = index_factory or flat_index_factory(dim, dtype)
+        self.ttl = ttl
+
+        # user id -> (index, monotonic build time)
+        self._indexes = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> VectorIndex:
+        while True:
+            with self._lock:
+                index, built_at = self._indexes.get(user_id, (None, None))
+                if index is not None:
+                    if self.ttl is None or time.monotonic() - built_at < self.ttl:
+                        self._indexes.move_to_end(user_id)
+                        return index
+                    # expired: built again below, writes meanwhile are buffered
+                    del self._indexes[user_id]
+                loading = self._loading.get(user_id)
+                if loading is None:
+                    loading = self._loading[user_id] = {
+                        "done": threading.Event(), "pending": []}
+                    break
+            # another request is building this user's index
+            loading["done"].wait()
+            if loading.get("error") is not None:
+                raise loading["error"]
+
+        try:
+            start = time.time()
+            built_at = time.monotonic()
+            ids, features = self.loader(user_id)
+            index = self.index_factory(user_id, ids, features)
+            with self._lock:
+                for pending_ids, pending_features in loading["pending"]:
+                    index.upsert(pending_ids, pending_features)
+                self._indexes[user_id] = (index, built_at)
+                while len(self._indexes) > self.max_users:
+                    self._indexes.popitem(last=False)
+                del self._loading[user_id]
+            log_info(
+                f"Vector index built for user {user_id}: {len(index)} images in {time.time() - start:.2f} seconds")
+            return index
+        except Exception as e:
+            loading["error"] = e
+            with self._lock:
+                self._loading.pop(user_id, None)
+            raise
+        finally:
+            loading["done"].set()
+
+    def add(self, user_id: str, image_id: str, features):
+        """New / updated features of one image; unloaded users pick them up on their first search."""
+        if not user_id:
+            return
+        with self._lock:
+            index, _ = self._indexes.get(user_id, (None, None))
+            if index is None:
+                loading = self._loading.get(user_id)
+                if loading is not None:
+                    loading["pending"].append(([image_id], features))
+                return
+        index.upsert([image_id], features)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def search(self, user_id: str, query, threshold: float = None, limit: int = None):
+        return self.get(user_id).search(query, threshold, limit)
+
+    def search_many(self, user_id: str, queries, threshold: float = None, limit: int = None):
+        return self.get(user_id).search_many(queries, threshold, limit)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "users": len(self._indexes),
+                "images": sum(len(index) for index, _ in self._indexes.values()),
+                "max_users": self.max_users,
+                "ttl": self.ttl,
+            }
+
+
+def top_matches(scores: np.ndarray, ids: list, threshold: float = None, limit: int = None):
+    """[(id, score)] above threshold, best `limit` first, from the scores of one query."""
+    candidates = np.arange(len(ids)) if threshold is None else np.flatnonzero(
+        scores >= threshold)
+    if limit is not None and len(candidates) > limit:
+        top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+        candidates = candidates[top]
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return [(ids[i], float(scores[i])) for i in candidates]
+
+
+def flat_index_factory(dim: int = 512, dtype=np.float32):
+    def build(user_id, ids, features):
+        index = VectorIndex(dim, dtype)
+        if len(ids):
+            index.upsert(ids, features)
+        return index
+    return build
+
+
+def on_image_features_saved(registry: UserVectorIndexRegistry):
+    """SupabaseService listener keeping loaded indexes in sync with saved image features."""
+    def listener(image_row: dict, image_features):
+        try:
+            registry.add(image_row.get('uploader_id'),
+                         image_row['id'], image_features)
+        except Exception as e:
+            log_error(
+                f"Error updating vector index: {e}\n{traceback.format_exc()}")
+    return listener
@@ -2,13 +2,14 @@ import asyncio
 import json
 import threading
 import gc
+from concurrent.futures import ThreadPoolExecutor
 from app.libs.logger.log import log_error, log_info
 from app.services.ai_services import AIService
 from app.services.redis_service import RedisService
 from app.services.supabase_service import SupabaseService
 import traceback
+from app.models.config import CONFIG
 
-from app.utils.process_image_concurrently import process_image_concurrently
 
 # Global thread variable for the coordinator
 coordinator_thread = None
@@ -25,27 +26,45 @@ def process_person_images(ai_service: AIService, supabase_service: SupabaseServi
         log_info(
             f"Found {len(uncategory_face_images)} uncategory face images !")
 
-        for image in uncategory_face_images:
-            image_id = image['id']
-            image_bucket_id = image['image_bucket_id']
-            image_name = image['image_name']
-            user_id = image['uploader_id']
-
-            image_url = supabase_service.get_image_public_url(
-                image_bucket_id, image_name)
+        # images still missing labels need the combined job
+        single = [image for image in uncategory_face_images
+                  if image.get('labels') is None]
+        batched = [image for image in uncategory_face_images
+                   if image.get('labels') is not None]
+        batch_size = CONFIG["face"]["batch_size"]
+        if batch_size <= 0:
+            single, batched = uncategory_face_images, []
+
+        # several images / batches in flight -> every face detection process stays busy
+        with ThreadPoolExecutor(max_workers=ai_service.face_job_concurrency(),
+                                thread_name_prefix="face-backlog") as executor:
+            for image in single:
+                executor.submit(process_person_image, ai_service, image)
+            for i in range(0, len(batched), batch_size):
+                executor.submit(process_person_batch, ai_service,
+                                batched[i:i + batch_size])
+    except Exception as e:
+        log_error(
+            f"Error category images face: {e}\n{traceback.format_exc()}")
 
-            face_locations, face_encodings = ai_service.category_image_face(
-                image_url)
 
-            supabase_service.update_person_table(
-                face_encodings, face_locations, image_id, user_id, image_name)
+def process_person_image(ai_service: AIService, image: dict):
+    try:
+        # labels + faces share one download / decode
+        ai_service.process_image_job(
+            image['id'], image['image_bucket_id'], image['image_name'], user_id=image['uploader_id'],
+            label=image.get('labels') is None)
+    except Exception as e:
+        log_error(
+            f"Error category image face {image['image_name']}: {e}\n{traceback.format_exc()}")
 
-            supabase_service.mark_image_done_face_detection(image_id)
 
-            log_info(f"Face detection done for image: {image_name}")
+def process_person_batch(ai_service: AIService, images: list):
+    try:
+        ai_service.process_face_batch(images)
     except Exception as e:
         log_error(
-            f"Error category images face: {e}\n{traceback.format_exc()}")
+            f"Error category face batch of {len(images)} images: {e}\n{traceback.format_exc()}")
 
 
 def process_unlabeled_images(ai_service: AIService, supabase_service: SupabaseService, redis_service: RedisService):
@@ -67,8 +86,11 @@ def process_unlabeled_images(ai_service: AIService, supabase_service: SupabaseSe
                 image_id, image_bucket_id, image_name
             )
 
-            image_labels, image_features = process_image_concurrently(
-                ai_service, image_bucket_id, image_name)
+            # faces of the image are detected in the same job
+            job_result = ai_service.process_image_job(
+                image_id, image_bucket_id, image_name, user_id=image['uploader_id'],
+                detect_faces=not image.get('is_face_detection'))
+            image_labels = job_result["labels"]
 
             # update redis label job -> completed
             redis_service.update_hash(
@@ -79,9 +101,7 @@ def process_unlabeled_images(ai_service: AIService, supabase_service: SupabaseSe
                 }
             )
 
-            supabase_service: SupabaseService = ai_service.inference_service.supabase_service
-            image_row = supabase_service.save_image_features_and_labels(
-                image_bucket_id, image_name, image_labels, image_features.squeeze(0).tolist())
+            image_row = job_result.get("image_row")
 
             if image_row:
                 log_info(f"Labels for image {image_name} updated successfully")
@@ -3,6 +3,7 @@ import threading
 import traceback
 import psycopg2
 import select
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 from app.core.config import settings
 from app.libs.logger.log import log_error, log_info
@@ -21,12 +22,16 @@ conn_params = {
 
 listener_thread = None
 stop_event = None
+# image jobs of the notifications, several at once -> a burst of uploads uses every face detection process
+job_executor = None
 
 
 def start_listener(ai_service: AIService, supabase_service: SupabaseService):
-    global listener_thread, stop_event
+    global listener_thread, stop_event, job_executor
     if listener_thread is None:
         stop_event = threading.Event()
+        job_executor = ThreadPoolExecutor(
+            max_workers=ai_service.face_job_concurrency(), thread_name_prefix="face-job")
         listener_thread = Thread(
             target=listen_to_notifications, args=(ai_service, supabase_service))
         listener_thread.daemon = True
@@ -34,11 +39,24 @@ def start_listener(ai_service: AIService, supabase_service: SupabaseService):
 
 
 def stop_listener():
-    global listener_thread, stop_event
+    global listener_thread, stop_event, job_executor
     if listener_thread:
         stop_event.set()
         listener_thread.join()
         listener_thread = None
+        job_executor.shutdown(wait=False)
+        job_executor = None
+
+
+def run_image_job(ai_service: AIService, payload: dict):
+    try:
+        # label in the same job (one download / decode) when not labeled yet
+        ai_service.process_image_job(
+            payload["id"], payload["image_bucket_id"], payload["image_name"], user_id=payload["uploader_id"],
+            label=payload.get("labels") is None)
+    except Exception as e:
+        log_error(
+            f"Error categorize image: {e}\n{traceback.format_exc()}")
 
 
 # listen
@@ -61,24 +79,8 @@ def listen_to_notifications(ai_service: AIService, supabase_service: SupabaseSer
                 notify = conn.notifies.pop(0)
                 try:
                     payload = json.loads(notify.payload)
-                    image_id = payload["id"]
-                    image_bucket_id = payload["image_bucket_id"]
-                    image_name = payload["image_name"]
-                    user_id = payload["uploader_id"]
-
-                    image_url = supabase_service.get_image_public_url(
-                        image_bucket_id, image_name)
-
-                    face_locations, face_encodings = ai_service.category_image_face(
-                        image_url)
-
-                    supabase_service.update_person_table(
-                        face_encodings, face_locations, image_id, user_id, image_name)
-
-                    supabase_service.mark_image_done_face_detection(image_id)
-                    log_info(f"Face detection done for image: {image_name}")
-
-                except RuntimeError as e:
+                    job_executor.submit(run_image_job, ai_service, payload)
+                except (ValueError, RuntimeError) as e:
                     log_error(
                         f"Error categorize image: {e}\n{traceback.format_exc()}")
 
@@ -7,7 +7,6 @@ from app.services.redis_service import RedisService
 import threading
 
 from app.services.supabase_service import SupabaseService
-from app.utils.process_image_concurrently import process_image_concurrently
 
 
 old_stream_thread = None
@@ -28,13 +27,18 @@ def process_message(ai_service: AIService, redis_service: RedisService, entry_id
             image_id, image_bucket_id, image_name
         )
 
-        image_labels, image_features = process_image_concurrently(
-            ai_service, image_bucket_id, image_name)
-
-        # Save labels, feature to Supabase
+        # one download / decode for labels + faces, skip faces already detected
         supabase_service: SupabaseService = ai_service.inference_service.supabase_service
-        image_row = supabase_service.save_image_features_and_labels(
-            image_bucket_id, image_name, image_labels, image_features.squeeze(0).tolist())
+        image_metadata = supabase_service.get_image_metadata(image_id)
+        detect_faces = bool(image_metadata) and not image_metadata[0].get(
+            'is_face_detection')
+        user_id = image_metadata[0]['uploader_id'] if image_metadata else None
+
+        # Save labels, feature (+ person rows) to Supabase
+        job_result = ai_service.process_image_job(
+            image_id, image_bucket_id, image_name, user_id=user_id, detect_faces=detect_faces)
+        image_labels = job_result["labels"]
+        image_row = job_result.get("image_row")
 
         if image_row:
             log_info(f"Labels for image {image_name} updated successfully")
@@ -0,0 +1,109 @@
+"""
+Recall@k vs latency of the IVF index against exact search.
+
+Runs every (nlist, nprobe) operating point on a synthetic clustered feature
+set and, with --features, on real image features (a .npy [N, 512] export of
+image.image_features). Queries are held-out rows with a little noise, like a
+text query landing near a group of photos.
+
+Usage:
+    python -m app.test.benchmark.bench_ann [--size 100000] [--clusters 100] [--features image_features.npy]
+        [--nlist 256 1024] [--nprobe 1 4 8 16 32] [--k 10] [--queries 200] [--output ann.json]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.ann_index import IVFIndex, normalize
+from app.services.vector_index import VectorIndex
+
+
+def synthetic_features(size: int, dim: int = 512, clusters: int = 500, seed: int = 0):
+    # photo libraries are clumpy (events, places) -> gaussian blobs on the sphere
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.normal(size=(clusters, dim)))
+    assignment = rng.integers(0, clusters, size=size)
+    return normalize(centers[assignment] + 0.05 * rng.normal(size=(size, dim)).astype(np.float32))
+
+
+def make_queries(features: np.ndarray, count: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    rows = features[rng.choice(len(features), size=count, replace=False)]
+    return normalize(rows + 0.02 * rng.normal(size=rows.shape).astype(np.float32))
+
+
+def timed_search(index, queries, k, **kwargs):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append([image_id for image_id, _ in index.search(
+            query, limit=k, **kwargs)])
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall(results, truth):
+    hits = sum(len(set(found) & set(expected))
+               for found, expected in zip(results, truth))
+    return hits / sum(len(expected) for expected in truth)
+
+
+def run(name, features, args):
+    ids = list(range(len(features)))
+    queries = make_queries(features, args.queries)
+
+    exact = VectorIndex(features.shape[1])
+    exact.upsert(ids, features)
+    truth, exact_ms = timed_search(exact, queries, args.k)
+    report = {"dataset": name, "size": len(features), "k": args.k,
+              "exact_ms": exact_ms, "points": []}
+
+    for nlist in args.nlist:
+        index = IVFIndex(features.shape[1], nlist=nlist,
+                         min_train_size=len(features) + 1)
+        index.upsert(ids, features)
+        start = time.perf_counter()
+        index.train()
+        train_seconds = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            if nprobe > nlist:
+                continue
+            results, ms = timed_search(index, queries, args.k, nprobe=nprobe)
+            report["points"].append({
+                "nlist": nlist,
+                "nprobe": nprobe,
+                f"recall@{args.k}": recall(results, truth),
+                "ms": ms,
+                "speedup": exact_ms / ms if ms else None,
+                "train_seconds": train_seconds,
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--clusters", type=int, default=100,
+                        help="synthetic blobs, fewer -> each blob spans several lists")
+    parser.add_argument("--features", help=".npy file of real [N, D] image features")
+    parser.add_argument("--nlist", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    reports = [run("synthetic", synthetic_features(args.size, clusters=args.clusters), args)]
+    if args.features:
+        reports.append(run("real", normalize(np.load(args.features)), args))
+
+    output = json.dumps(reports, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Full-resolution vs JPEG draft-mode decoding on the app/test images.
+
+Reports decode + resize time, decoded pixel buffer size and peak memory
+per consumer (CLIP input, face-detection input) and, when the models are
+available, label agreement and face-count agreement between the two paths.
+
+Peak memory is the growth of the max RSS (getrusage ru_maxrss) of a
+process forked for one decode, so it includes PIL's native buffers and
+every intermediate copy, not only the final image (Linux / macOS).
+
+Usage:
+    python -m app.test.benchmark.bench_decode [--repeat 3] [--skip-labels] [--skip-faces]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from app.models.model import plan_face_detection, resize_for_face_detection
+from app.utils.image_utils import decode_image
+
+TEST_DIR = Path(__file__).parent.parent.absolute()
+IMAGE_SUFFIXES = ['.jpg', '.jpeg', '.png', '.jfif']
+CLIP_SIZE = (224, 224)
+
+
+def find_test_images():
+    image_dirs = [
+        TEST_DIR / "face_image" / "images",
+        TEST_DIR / "open_clip" / "image" / "relate",
+        TEST_DIR / "open_clip" / "image" / "unrelate",
+    ]
+    images = []
+    for image_dir in image_dirs:
+        if image_dir.exists():
+            images.extend(sorted(path for path in image_dir.glob("*.*")
+                                 if path.suffix.lower() in IMAGE_SUFFIXES))
+    return images
+
+
+def buffer_bytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+def decode_for_clip(image_data, draft):
+    image, _ = decode_image(image_data, CLIP_SIZE if draft else None)
+    decoded = buffer_bytes(image)
+    image = image.convert("RGB")
+    return image, decoded
+
+
+def decode_for_faces(image_data, draft):
+    def target(width, height):
+        return plan_face_detection(width, height)["size"]
+
+    image, original_size = decode_image(image_data, target if draft else None)
+    decoded = buffer_bytes(image)
+    face_image, plan = resize_for_face_detection(
+        image, original_size=original_size)
+    return face_image, plan, decoded
+
+
+def max_rss_bytes():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _measure_peak(fn, image_data, draft, results):
+    before = max_rss_bytes()
+    fn(image_data, draft)
+    results.put(max_rss_bytes() - before)
+
+
+def peak_memory(fn, image_data, draft):
+    """Max RSS growth of one decode in a forked process (the parent's allocations do not count)."""
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    process = ctx.Process(target=_measure_peak, args=(fn, image_data, draft, results))
+    process.start()
+    peak = results.get(timeout=120)
+    process.join()
+    return peak
+
+
+def time_decode(fn, image_data, draft, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(image_data, draft)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmark(repeat=3, check_labels=True, check_faces=True):
+    images = find_test_images()
+    if not images:
+        print(f"No test images found under {TEST_DIR}")
+        return None
+
+    label_service = None
+    if check_labels:
+        try:
+            from app.models.inference import AILabelTestService
+            from app.models.model import AIModel
+            model = AIModel()
+            label_service = AILabelTestService(model)
+        except Exception as e:
+            print(f"Skipping label agreement: {e}")
+
+    face_model = None
+    if check_faces:
+        try:
+            from app.models.model import FaceCategoryModel
+            face_model = FaceCategoryModel()
+        except Exception as e:
+            print(f"Skipping face-count agreement: {e}")
+
+    rows = []
+    for path in images:
+        image_data = path.read_bytes()
+        original_size = Image.open(BytesIO(image_data)).size
+        row = {"name": path.name, "size": list(original_size)}
+
+        for consumer, fn in [("clip", decode_for_clip), ("face", decode_for_faces)]:
+            full_time, full_result = time_decode(fn, image_data, False, repeat)
+            draft_time, draft_result = time_decode(fn, image_data, True, repeat)
+            row[consumer] = {
+                "full_ms": full_time * 1000,
+                "draft_ms": draft_time * 1000,
+                "full_decoded_bytes": full_result[-1],
+                "draft_decoded_bytes": draft_result[-1],
+                "full_peak_bytes": peak_memory(fn, image_data, False),
+                "draft_peak_bytes": peak_memory(fn, image_data, True),
+            }
+
+            if consumer == "clip" and label_service is not None:
+                labels = []
+                for image in [full_result[0], draft_result[0]]:
+                    name, is_relate, image_features = label_service.return_relate_status_with_name(
+                        image)
+                    top = label_service.return_all_labels(image_features)
+                    labels.append(
+                        (name, is_relate, [list(item)[0] for item in top["location_labels"]]))
+                row[consumer]["labels_agree"] = labels[0] == labels[1]
+
+            if consumer == "face" and face_model is not None:
+                counts = []
+                for face_image, plan, _ in [full_result, draft_result]:
+                    face_locations, _ = face_model.category_image_array(
+                        face_image, plan)
+                    counts.append(len(face_locations))
+                row[consumer]["face_counts"] = counts
+                row[consumer]["faces_agree"] = counts[0] == counts[1]
+
+        rows.append(row)
+        print(f"{path.name} {original_size[0]}x{original_size[1]}: "
+              f"clip {row['clip']['full_ms']:.1f} -> {row['clip']['draft_ms']:.1f} ms, "
+              f"face {row['face']['full_ms']:.1f} -> {row['face']['draft_ms']:.1f} ms")
+
+    summary = summarize(rows)
+    print(json.dumps(summary, indent=2))
+    return {"summary": summary, "images": rows}
+
+
+def summarize(rows):
+    summary = {"images": len(rows)}
+    for consumer in ["clip", "face"]:
+        full = sum(row[consumer]["full_ms"] for row in rows)
+        draft = sum(row[consumer]["draft_ms"] for row in rows)
+        summary[consumer] = {
+            "total_full_ms": full,
+            "total_draft_ms": draft,
+            "speedup": full / draft if draft else None,
+            "max_full_decoded_bytes": max(row[consumer]["full_decoded_bytes"] for row in rows),
+            "max_draft_decoded_bytes": max(row[consumer]["draft_decoded_bytes"] for row in rows),
+            "max_full_peak_bytes": max(row[consumer]["full_peak_bytes"] for row in rows),
+            "max_draft_peak_bytes": max(row[consumer]["draft_peak_bytes"] for row in rows),
+        }
+        agree_key = "labels_agree" if consumer == "clip" else "faces_agree"
+        checked = [row[consumer][agree_key]
+                   for row in rows if agree_key in row[consumer]]
+        if checked:
+            summary[consumer]["agreement"] = sum(checked) / len(checked)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-labels", action="store_true")
+    parser.add_argument("--skip-faces", action="store_true")
+    parser.add_argument("--output", help="write the full report as JSON")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.repeat, not args.skip_labels,
+                           not args.skip_faces)
+    if report and args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
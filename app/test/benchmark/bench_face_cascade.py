@@ -0,0 +1,82 @@
+"""
+Face detection recall and speed of the cnn / hog / cascade policies.
+
+Runs FaceCategoryModel with each detection policy over the images of
+app/test/face_image/image_list.json and compares the number of faces found
+per image with the expected count. Recall counts at most the expected
+number of faces per image, extra detections are reported separately.
+
+Usage:
+    python -m app.test.benchmark.bench_face_cascade [--policies cnn hog cascade] [--images-dir DIR] [--landmarks large] [--jitters 1] [--output faces.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from app.models.model import FaceCategoryModel, load_image_file
+
+FACE_IMAGE_DIR = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "face_image")
+
+
+def bench_policy(policy: str, images, config: dict):
+    face_model = FaceCategoryModel({**config, "policy": policy})
+    found, seconds = [], 0.0
+    for path, _ in images:
+        # decode outside the timing, the policies only differ in detection
+        image, plan = load_image_file(path)
+        start = time.perf_counter()
+        face_locations, _ = face_model.category_image_array(image, plan)
+        seconds += time.perf_counter() - start
+        found.append(len(face_locations))
+
+    expected = [faces for _, faces in images]
+    total_expected = sum(expected)
+    return {
+        "cache_version": face_model.cache_version,
+        "recall": round(sum(min(f, e) for f, e in zip(found, expected)) / total_expected, 3) if total_expected else None,
+        "extra_faces": sum(max(0, f - e) for f, e in zip(found, expected)),
+        "exact_images": sum(f == e for f, e in zip(found, expected)),
+        "seconds_per_image": round(seconds / len(images), 3),
+        "found": found,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--policies", nargs="+", default=["cnn", "hog", "cascade"])
+    parser.add_argument("--images-dir", default=os.path.join(FACE_IMAGE_DIR, "images"))
+    parser.add_argument("--image-list", default=os.path.join(FACE_IMAGE_DIR, "image_list.json"))
+    parser.add_argument("--upsample", type=int, default=2)
+    parser.add_argument("--small-face-px", type=int, default=60)
+    parser.add_argument("--landmarks", choices=["large", "small"], default="large")
+    parser.add_argument("--jitters", type=int, default=1)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    with open(args.image_list) as f:
+        image_list = json.load(f)
+    images = [(os.path.join(args.images_dir, item["name"]), item.get("faces", 0))
+              for item in image_list]
+    missing = [path for path, _ in images if not os.path.exists(path)]
+    if missing:
+        sys.exit(f"{len(missing)} of {len(images)} images missing from {args.images_dir}, e.g. {missing[0]}")
+
+    config = {"upsample": args.upsample, "small_face_px": args.small_face_px,
+              "landmarks": args.landmarks, "jitters": args.jitters}
+    report = {
+        "images": len(images),
+        "expected_faces": sum(faces for _, faces in images),
+        "policies": {policy: bench_policy(policy, images, config) for policy in args.policies},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Face detector cost and recall of the legacy size bands vs the pixel-budget planner.
+
+Every image of app/test/face_image/image_list.json is rescaled to each of
+--long-sides (a corpus of mixed resolutions with known face counts) and
+planned both ways. The report gives the detector working area and the
+smallest detectable face per resolution, and, unless --plan-only, the
+measured seconds/image and recall of the CNN detector.
+
+Without the face images only the planned cost is reported, for photos of
+the common camera resolutions.
+
+Usage:
+    python -m app.test.benchmark.bench_face_plan [--long-sides 640 1280 2048 4032] [--budget 4000000] [--min-face 40] [--plan-only] [--output plan.json]
+"""
+import argparse
+import json
+import os
+import time
+
+from PIL import Image
+
+from app.models.config import CONFIG
+from app.models.model import DETECTOR_MIN_FACE_PX, detector_pixels, plan_face_detection
+
+FACE_IMAGE_DIR = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "face_image")
+# width, height of common phone / camera photos
+CAMERA_SIZES = [(640, 480), (1280, 960), (1440, 1080), (2048, 1536),
+                (3024, 4032), (4000, 3000), (6000, 4000)]
+
+
+def plan_summary(plan):
+    return {
+        "size": list(plan["size"]),
+        "upsample": plan["upsample"],
+        "detector_mpx": round(detector_pixels(plan) / 1e6, 2),
+        # in original image pixels
+        "min_face_px": round(DETECTOR_MIN_FACE_PX * max(plan["scale"]) / 2 ** plan["upsample"]),
+    }
+
+
+def plan_only(configs):
+    return [{"original": [width, height],
+             **{name: plan_summary(plan_face_detection(width, height, config)) for name, config in configs.items()}}
+            for width, height in CAMERA_SIZES]
+
+
+def load_corpus(images_dir, image_list_path, long_sides):
+    with open(image_list_path) as f:
+        image_list = json.load(f)
+    corpus = []
+    for item in image_list:
+        path = os.path.join(images_dir, item["name"])
+        if not os.path.exists(path):
+            continue
+        with Image.open(path) as im:
+            im = im.convert("RGB")
+            for long_side in long_sides:
+                scale = long_side / max(im.size)
+                size = (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+                corpus.append((long_side, im.resize(size, Image.Resampling.LANCZOS), item.get("faces", 0)))
+    return corpus
+
+
+def bench_detection(face_model, corpus, config):
+    import numpy as np
+
+    by_side = {}
+    for long_side, im, expected in corpus:
+        plan = plan_face_detection(*im.size, config)
+        working = im if im.size == plan["size"] else im.resize(plan["size"], Image.Resampling.LANCZOS)
+        image = np.array(working)
+        start = time.perf_counter()
+        found = len(face_model.detect_face_locations(image, upsample=plan["upsample"])[0])
+        seconds = time.perf_counter() - start
+        stats = by_side.setdefault(long_side, {"images": 0, "seconds": 0.0, "expected": 0, "matched": 0,
+                                               "detector_mpx": 0.0})
+        stats["images"] += 1
+        stats["seconds"] += seconds
+        stats["expected"] += expected
+        stats["matched"] += min(found, expected)
+        stats["detector_mpx"] += detector_pixels(plan) / 1e6
+
+    return {long_side: {
+        "seconds_per_image": round(stats["seconds"] / stats["images"], 3),
+        "recall": round(stats["matched"] / stats["expected"], 3) if stats["expected"] else None,
+        "detector_mpx": round(stats["detector_mpx"] / stats["images"], 2),
+    } for long_side, stats in sorted(by_side.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--long-sides", type=int, nargs="+", default=[640, 1280, 2048, 4032])
+    parser.add_argument("--budget", type=int, default=4_000_000)
+    parser.add_argument("--min-face", type=int, default=40)
+    parser.add_argument("--images-dir", default=os.path.join(FACE_IMAGE_DIR, "images"))
+    parser.add_argument("--image-list", default=os.path.join(FACE_IMAGE_DIR, "image_list.json"))
+    parser.add_argument("--plan-only", action="store_true", help="report the planned cost only")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    configs = {
+        "bands": {**CONFIG["face"], "pixel_budget": 0},
+        "budget": {**CONFIG["face"], "pixel_budget": args.budget, "min_face_px": args.min_face},
+    }
+    report = {"budget": args.budget, "min_face_px": args.min_face, "plans": plan_only(configs)}
+
+    corpus = [] if args.plan_only else load_corpus(args.images_dir, args.image_list, args.long_sides)
+    if corpus:
+        from app.models.model import FaceCategoryModel
+
+        face_model = FaceCategoryModel({"policy": "cnn"})
+        report["detection"] = {name: bench_detection(face_model, corpus, config)
+                               for name, config in configs.items()}
+    elif not args.plan_only:
+        report["detection"] = f"no face images in {args.images_dir}, planned cost only"
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Pickled transfer vs shared image ring handoff of decoded images to a forked consumer.
+
+A producer hands N images (a CLIP preprocess tensor and a face detector
+RGB array each) to a consumer process that sums the pixels, once by
+putting the arrays on a multiprocessing queue (pickled) and once by
+writing them into a SharedImageRing slot and sending the slot index.
+
+Usage:
+    python -m app.test.benchmark.bench_image_ring [--images 200] [--face-size 1200 900] [--slots 8] [--output ring.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+
+from app.services.image_ring import SharedImageRing
+
+CLIP_SIZE = (224, 224)
+
+
+def consume_pickled(jobs, done):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        image_tensor, face_image = job
+        done.put(float(image_tensor[0, 0, 0]) + int(face_image[0, 0, 0]))
+
+
+def consume_ring(ring, jobs, done):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        index, face_shape = job
+        done.put((index, float(ring.clip_tensor(index)[0, 0, 0]) +
+                  int(ring.face_array(index, *face_shape)[0, 0, 0])))
+
+
+def make_images(face_size, count: int = 8):
+    generator = torch.Generator().manual_seed(0)
+    width, height = face_size
+    return [(torch.rand(3, *CLIP_SIZE, generator=generator),
+             np.random.default_rng(i).integers(0, 255, size=(height, width, 3), dtype=np.uint8))
+            for i in range(count)]
+
+
+def bench_pickled(images, total: int):
+    ctx = multiprocessing.get_context("fork")
+    jobs, done = ctx.Queue(maxsize=8), ctx.Queue()
+    consumer = ctx.Process(target=consume_pickled, args=(jobs, done))
+    consumer.start()
+
+    start = time.perf_counter()
+    for i in range(total):
+        jobs.put(images[i % len(images)])
+    for _ in range(total):
+        done.get()
+    elapsed = time.perf_counter() - start
+
+    jobs.put(None)
+    consumer.join()
+    return elapsed
+
+
+def bench_ring(images, total: int, slots: int, face_size):
+    ctx = multiprocessing.get_context("fork")
+    ring = SharedImageRing(slots, CLIP_SIZE, face_size[0] * face_size[1])
+    jobs, done = ctx.Queue(), ctx.Queue()
+    consumer = ctx.Process(target=consume_ring, args=(ring, jobs, done))
+    consumer.start()
+
+    def release():
+        # the producer frees a slot once the consumer's result is back
+        for _ in range(total):
+            index, _ = done.get()
+            ring.release(index)
+
+    releaser = threading.Thread(target=release)
+    releaser.start()
+    start = time.perf_counter()
+    for i in range(total):
+        image_tensor, face_image = images[i % len(images)]
+        index = ring.acquire(timeout=30)
+        ring.write_clip(index, image_tensor)
+        jobs.put((index, ring.write_face(index, face_image)))
+    releaser.join()
+    elapsed = time.perf_counter() - start
+
+    jobs.put(None)
+    consumer.join()
+    stats = ring.get_stats()
+    ring.close()
+    return elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--face-size", type=int, nargs=2, default=[1200, 900],
+                        metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--slots", type=int, default=8)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    images = make_images(args.face_size)
+    image_mb = (images[0][0].numel() * 4 + images[0][1].nbytes) / 1024 / 1024
+
+    pickled = bench_pickled(images, args.images)
+    ring, ring_stats = bench_ring(
+        images, args.images, args.slots, args.face_size)
+
+    report = {
+        "images": args.images,
+        "image_mb": round(image_mb, 2),
+        "pickled": {"seconds": round(pickled, 3), "images_per_second": round(args.images / pickled, 1),
+                    "us_per_image": round(pickled / args.images * 1e6, 1)},
+        "ring": {"seconds": round(ring, 3), "images_per_second": round(args.images / ring, 1),
+                 "us_per_image": round(ring / args.images * 1e6, 1), **ring_stats},
+        "speedup": round(pickled / ring, 2),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+fp32 vs int8 (dynamic) CLIP inference on the app/test/open_clip image sets.
+
+Reports label agreement (location filter + top label of every head),
+image / text embedding cosine similarity, text-to-image search top-k
+overlap and images/sec of both models.
+
+Usage:
+    python -m app.test.benchmark.eval_quantization [--batch-size 8] [--top-k 5]
+"""
+import argparse
+import copy
+import json
+import time
+from pathlib import Path
+
+import torch
+from PIL import Image
+
+from app.models.inference import AILabelTestService
+from app.models.model import AIModel, quantize_clip_model
+
+TEST_DIR = Path(__file__).parent.parent.absolute()
+IMAGE_SUFFIXES = ['.jpg', '.jpeg', '.png', '.jfif']
+DEFAULT_QUERIES = [
+    "beach", "birthday party", "mountain hiking", "a group of friends",
+    "food on a table", "wedding", "city at night", "a dog",
+]
+
+
+def find_images():
+    images = []
+    for folder in ["relate", "unrelate"]:
+        image_dir = TEST_DIR / "open_clip" / "image" / folder
+        if image_dir.exists():
+            images.extend(sorted(path for path in image_dir.glob("*.*")
+                                 if path.suffix.lower() in IMAGE_SUFFIXES))
+    return images
+
+
+def encode_images(clip_model, images, batch_size):
+    features = []
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for i in range(0, len(images), batch_size):
+            batch = clip_model.encode_image(images[i:i + batch_size])
+            features.append(batch / batch.norm(dim=-1, keepdim=True))
+    elapsed = time.perf_counter() - start
+    return torch.cat(features).float(), len(images) / elapsed
+
+
+def encode_texts(clip_model, tokenizer, queries):
+    with torch.inference_mode():
+        features = clip_model.encode_text(tokenizer(queries))
+        return (features / features.norm(dim=-1, keepdim=True)).float()
+
+
+def label_signature(label):
+    labels = label["labels"]
+    return (
+        label["relate"]["name"],
+        tuple(list(items[0])[0] if items else None for items in labels.values()),
+    )
+
+
+def run_evaluation(batch_size=8, top_k=5, queries=None):
+    queries = queries or DEFAULT_QUERIES
+    paths = find_images()
+    if not paths:
+        print(f"No images found under {TEST_DIR / 'open_clip' / 'image'}")
+        return None
+
+    model = AIModel(quantization="none")
+    label_heads = AILabelTestService(model).label_heads
+    fp32_model = model.model
+    int8_model = quantize_clip_model(copy.deepcopy(fp32_model), "dynamic")
+
+    images = torch.stack([model.preprocess(Image.open(path))
+                         for path in paths])
+
+    # warm up both models once
+    encode_images(fp32_model, images[:1], 1)
+    encode_images(int8_model, images[:1], 1)
+
+    fp32_features, fp32_speed = encode_images(fp32_model, images, batch_size)
+    int8_features, int8_speed = encode_images(int8_model, images, batch_size)
+
+    fp32_labels = label_heads.classify(fp32_features)
+    int8_labels = label_heads.classify(int8_features)
+    relate_agree = [a["relate"] == b["relate"]
+                    for a, b in zip(fp32_labels, int8_labels)]
+    labels_agree = [label_signature(a) == label_signature(b)
+                    for a, b in zip(fp32_labels, int8_labels)]
+    image_cosine = (fp32_features * int8_features).sum(dim=-1)
+
+    fp32_text = encode_texts(fp32_model, model.tokenizer, queries)
+    int8_text = encode_texts(int8_model, model.tokenizer, queries)
+    text_cosine = (fp32_text * int8_text).sum(dim=-1)
+
+    # search: fp32 query/image embeddings are the reference ranking
+    k = min(top_k, len(paths))
+    fp32_top = (fp32_text @ fp32_features.T).topk(k, dim=-1).indices.tolist()
+    int8_top = (int8_text @ int8_features.T).topk(k, dim=-1).indices.tolist()
+    search_overlap = [len(set(a) & set(b)) / k
+                      for a, b in zip(fp32_top, int8_top)]
+
+    report = {
+        "images": len(paths),
+        "queries": len(queries),
+        "relate_agreement": sum(relate_agree) / len(relate_agree),
+        "label_agreement": sum(labels_agree) / len(labels_agree),
+        "image_embedding_cosine": {
+            "mean": image_cosine.mean().item(),
+            "min": image_cosine.min().item(),
+        },
+        "text_embedding_cosine": {
+            "mean": text_cosine.mean().item(),
+            "min": text_cosine.min().item(),
+        },
+        f"search_top{k}_overlap": sum(search_overlap) / len(search_overlap),
+        "fp32_images_per_sec": fp32_speed,
+        "int8_images_per_sec": int8_speed,
+        "speedup": int8_speed / fp32_speed,
+        "disagreements": [
+            {"name": path.name, "fp32": label_signature(a), "int8": label_signature(b)}
+            for path, a, b, agree in zip(paths, fp32_labels, int8_labels, labels_agree) if not agree
+        ],
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--query", action="append",
+                        help="search query to compare (repeatable)")
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    report = run_evaluation(args.batch_size, args.top_k, args.query)
+    if report and args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -86,3 +86,7 @@ def process_face_images():
     log_info(f"Face detection complete. Results saved to {results_file}")
     log_info(
         f"Detected {total_faces_detected} faces out of {total_faces_expected} expected")
+
+
+if __name__ == "__main__":
+    process_face_images()
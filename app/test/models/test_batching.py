@@ -0,0 +1,95 @@
+import threading
+import pytest
+import torch
+
+from app.models.batching import ImageBatchEncoder
+
+
+def fake_encode(images):
+    # each image -> feature row [sum, 1.0], normalized like the real encoder
+    features = torch.stack(
+        [images.flatten(1).sum(dim=1), torch.ones(images.shape[0])], dim=1)
+    return features / features.norm(dim=-1, keepdim=True)
+
+
+@pytest.fixture
+def encoder():
+    encoder = ImageBatchEncoder(fake_encode, max_batch_size=4, max_wait_ms=50)
+    yield encoder
+    encoder.stop()
+
+
+def test_encode_single_image_returns_row(encoder):
+    image = torch.ones(3, 2, 2)
+    features = encoder.encode(image, timeout=5)
+
+    assert features.shape == (1, 2)
+    assert torch.allclose(features, fake_encode(image.unsqueeze(0)))
+
+
+def test_concurrent_submits_are_batched(encoder):
+    images = [torch.full((1, 3, 2, 2), float(i)) for i in range(4)]
+
+    futures = [encoder.submit(image) for image in images]
+    results = [future.result(timeout=5) for future in futures]
+
+    # every caller gets its own row back
+    for image, result in zip(images, results):
+        assert torch.allclose(result, fake_encode(image))
+
+    stats = encoder.get_stats()
+    assert stats["images"] == 4
+    assert stats["batches"] < 4
+    assert stats["avg_batch_size"] > 1
+
+
+def test_batch_size_is_capped(encoder):
+    futures = [encoder.submit(torch.ones(3, 2, 2)) for _ in range(10)]
+    for future in futures:
+        future.result(timeout=5)
+
+    histogram = encoder.get_stats()["batch_size_histogram"]
+    assert max(histogram) <= 4
+    assert sum(size * count for size, count in histogram.items()) == 10
+
+
+def test_encode_error_is_propagated_to_every_caller():
+    def failing_encode(images):
+        raise RuntimeError("boom")
+
+    encoder = ImageBatchEncoder(failing_encode, max_batch_size=2, max_wait_ms=50)
+    try:
+        futures = [encoder.submit(torch.ones(3, 2, 2)) for _ in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=5)
+        assert encoder.get_stats()["errors"] >= 1
+    finally:
+        encoder.stop()
+
+
+def test_submit_from_many_threads(encoder):
+    results = {}
+
+    def worker(i):
+        results[i] = encoder.encode(torch.full((3, 2, 2), float(i)), timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 8
+    for i, result in results.items():
+        assert torch.allclose(result, fake_encode(
+            torch.full((1, 3, 2, 2), float(i))))
+
+
+def test_reset_stats(encoder):
+    encoder.encode(torch.ones(3, 2, 2), timeout=5)
+    encoder.reset_stats()
+
+    stats = encoder.get_stats()
+    assert stats["batches"] == 0
+    assert stats["images"] == 0
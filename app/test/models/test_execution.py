@@ -0,0 +1,112 @@
+import pytest
+import torch
+
+from app.models.execution import ExecutionPolicy, candidate_policies, default_policy, select_execution_policy
+
+
+class TinyClip(torch.nn.Module):
+    # same encode_image / encode_text / visual surface as the open_clip model
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.visual = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 8, 3), torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten())
+        self.text = torch.nn.Embedding(10, 8)
+
+    def encode_image(self, images):
+        return self.visual(images)
+
+    def encode_text(self, tokens):
+        return self.text(tokens).mean(dim=1)
+
+
+def config(**overrides):
+    return {"precision": "auto", "channels_last": "auto", "compile": False, **overrides}
+
+
+def test_policy_runs_in_inference_mode_and_returns_float32():
+    model = TinyClip()
+    policy = ExecutionPolicy("cpu", precision="bf16")
+
+    features = policy.encode_image(model, torch.randn(2, 3, 8, 8))
+
+    assert features.dtype == torch.float32
+    assert features.shape == (2, 8)
+    assert not features.requires_grad
+    assert policy.encode_text(model, torch.tensor([[1, 2]])).dtype == torch.float32
+
+
+def test_channels_last_policy_converts_weights_and_back():
+    model = TinyClip()
+
+    ExecutionPolicy("cpu", channels_last=True).apply(model)
+    assert model.visual[0].weight.is_contiguous(
+        memory_format=torch.channels_last)
+
+    ExecutionPolicy("cpu").apply(model)
+    assert model.visual[0].weight.is_contiguous()
+
+
+def test_unknown_precision_raises():
+    with pytest.raises(ValueError):
+        ExecutionPolicy("cpu", precision="int4")
+
+
+def test_candidates_start_with_fp32_baseline():
+    candidates = candidate_policies("cpu", config())
+
+    assert candidates[0].name == "cpu/fp32"
+    assert {c.channels_last for c in candidates} == {False, True}
+
+
+def test_quantized_model_only_gets_fp32_candidates():
+    candidates = candidate_policies(
+        "cpu", config(precision="bf16", compile=True), quantized=True)
+
+    assert {c.precision for c in candidates} == {"fp32"}
+    assert not any(c.compile for c in candidates)
+
+
+def test_default_policy_keeps_explicit_settings():
+    policy = default_policy("cpu", config(precision="bf16", channels_last="1"))
+
+    assert policy.name == "cpu/bf16/channels_last"
+    assert default_policy("cpu", config()).name == "cpu/fp32"
+
+
+def test_select_rejects_candidates_outside_tolerance():
+    model = TinyClip()
+    images = torch.randn(4, 3, 8, 8)
+    candidates = [ExecutionPolicy("cpu"), ExecutionPolicy(
+        "cpu", precision="bf16")]
+
+    # nothing reduced precision matches fp32 exactly -> fp32 is kept
+    policy, report = select_execution_policy(
+        model, images, candidates, tolerance=1.0 + 1e-6, repeat=1)
+
+    assert policy.precision == "fp32"
+    assert set(report) == {"cpu/fp32", "cpu/bf16"}
+    assert not report["cpu/bf16"]["accepted"]
+
+
+def test_select_rejects_candidates_whose_text_features_drift():
+    class DriftingText(TinyClip):
+        def encode_text(self, tokens):
+            features = super().encode_text(tokens)
+            # only reduced precision text features move away from fp32
+            if torch.is_autocast_enabled("cpu"):
+                features = features + torch.randn_like(features)
+            return features
+
+    model = DriftingText()
+    candidates = [ExecutionPolicy("cpu"), ExecutionPolicy(
+        "cpu", precision="bf16")]
+
+    policy, report = select_execution_policy(
+        model, torch.randn(4, 3, 8, 8), candidates, tolerance=0.9, repeat=1,
+        tokens=torch.tensor([[1, 2], [3, 4]]))
+
+    assert policy.precision == "fp32"
+    assert report["cpu/bf16"]["min_cosine"] >= 0.9
+    assert report["cpu/bf16"]["min_text_cosine"] < 0.9
+    assert not report["cpu/bf16"]["accepted"]
@@ -0,0 +1,176 @@
+import types
+
+import numpy as np
+import pytest
+
+from app.models.config import CONFIG
+from app.models.model import (FaceCategoryModel, detector_pixels, face_cache_version, plan_face_detection,
+                              raw_face_landmarks, scale_face_locations)
+
+
+class FakeDetector:
+    """face_recognition surface used by FaceCategoryModel, returning canned faces per detector."""
+
+    def __init__(self, hog, cnn):
+        self.faces = {"hog": hog, "cnn": cnn}
+        self.calls = []
+
+    def face_locations(self, image, number_of_times_to_upsample=1, model="hog"):
+        self.calls.append((model, number_of_times_to_upsample))
+        return self.faces[model]
+
+    def face_encodings(self, image, face_locations, num_jitters=1, model="small"):
+        return [(num_jitters, model)] * len(face_locations)
+
+    def batch_face_locations(self, images, number_of_times_to_upsample=1, batch_size=128):
+        assert len({image.shape for image in images}) == 1
+        self.calls.append(("cnn-batch", len(images)))
+        return [self.faces["cnn"] for _ in images]
+
+
+class FakeApi:
+    """face_recognition.api internals used for batch encodings."""
+
+    def __init__(self):
+        self.face_encoder = self
+        self.descriptor_calls = 0
+
+    def _raw_face_landmarks(self, image, face_locations, model="large"):
+        return list(face_locations)
+
+    def compute_face_descriptor(self, images, batch_shapes, num_jitters):
+        self.descriptor_calls += 1
+        return [[[float(image[0, 0, 0])] * 2 for _ in shapes] for image, shapes in zip(images, batch_shapes)]
+
+
+def face_model(policy, hog, cnn, **config):
+    # skips __init__, which loads dlib
+    model = FaceCategoryModel.__new__(FaceCategoryModel)
+    model.config = {**CONFIG["face"], "policy": policy, **config}
+    model.model = FakeDetector(hog, cnn)
+    model.model.api = FakeApi()
+    model.dlib = types.SimpleNamespace(full_object_detections=list)
+    return model
+
+
+def plan(scale, upsample=2):
+    return {"size": None, "upsample": upsample, "scale": (scale, scale)}
+
+
+BIG = (0, 200, 200, 0)
+SMALL = (0, 30, 30, 0)
+
+
+def test_cascade_keeps_confident_hog_faces():
+    model = face_model("cascade", hog=[BIG], cnn=[BIG, SMALL])
+
+    assert model.detect_face_locations(None) == ([BIG], "hog")
+    assert [call[0] for call in model.model.calls] == ["hog"]
+
+
+@pytest.mark.parametrize("hog", [[], [BIG, SMALL]])
+def test_cascade_escalates_empty_or_small_faces_to_cnn(hog):
+    model = face_model("cascade", hog=hog, cnn=[BIG, SMALL, SMALL], upsample=2)
+
+    faces, detector = model.detect_face_locations(None)
+    assert len(faces) == 3 and detector.startswith("cnn")
+    assert model.model.calls[-1] == ("cnn", 2)
+
+
+def test_cascade_trusts_hog_on_images_without_people():
+    model = face_model("cascade", hog=[], cnn=[BIG])
+    assert model.detect_face_locations(None, person_hint=False) == ([], "hog")
+
+    model = face_model("cascade", hog=[SMALL], cnn=[BIG, SMALL])
+    assert model.detect_face_locations(None, person_hint=False) == ([SMALL], "hog")
+
+
+def test_encoding_uses_configured_landmarks_and_jitters():
+    model = face_model("cnn", hog=[], cnn=[BIG], landmarks="small", jitters=3)
+
+    locations, encodings = model.category_image_array(None, plan(2))
+    assert locations == [(0, 400, 400, 0)]
+    assert encodings == [(3, "small")]
+
+
+def test_legacy_settings_keep_the_cache_version():
+    defaults = {"policy": "cnn", "upsample": 2, "hog_upsample": 1,
+                "small_face_px": 60, "landmarks": "large", "jitters": 1}
+
+    assert face_cache_version(defaults) == "cnn-upsample2-large"
+    assert face_cache_version({**defaults, "policy": "cascade"}) != face_cache_version(defaults)
+
+
+def test_batch_groups_images_by_shape():
+    model = face_model("cnn", hog=[], cnn=[BIG], batch_size=2)
+    images = [(np.full((h, 40, 3), i, dtype=np.uint8), plan(1))
+              for i, h in enumerate([40, 50, 40, 40])]
+
+    results = model.category_image_batch(images)
+    assert sorted(call for call in model.model.calls) == [
+        ("cnn-batch", 1), ("cnn-batch", 1), ("cnn-batch", 2)]
+    assert model.model.api.descriptor_calls == 1
+    assert [[encoding.tolist() for encoding in encodings] for _, encodings in results] == [
+        [[i, i]] for i in range(4)]
+    assert all(locations == [BIG] for locations, _ in results)
+
+
+def test_batch_cascade_only_escalates_to_the_cnn_when_needed():
+    model = face_model("cascade", hog=[], cnn=[BIG])
+    images = [(np.zeros((40, 40, 3), dtype=np.uint8), plan(2, upsample=1))] * 2
+
+    results = model.category_image_batch(images, person_hints=[False, None])
+    assert ("cnn-batch", 1) in model.model.calls
+    assert results[0] == ([], []) and results[1][0] == [(0, 400, 400, 0)]
+
+
+def test_landmarks_without_the_private_face_recognition_helper():
+    api = types.SimpleNamespace(
+        pose_predictor_68_point=lambda image, rect: ("68", rect),
+        pose_predictor_5_point=lambda image, rect: ("5", rect))
+    dlib = types.SimpleNamespace(rectangle=lambda left, top, right, bottom: (left, top, right, bottom))
+
+    assert raw_face_landmarks(api, dlib, None, [(1, 4, 3, 2)]) == [("68", (2, 1, 4, 3))]
+    assert raw_face_landmarks(api, dlib, None, [(1, 4, 3, 2)], "small") == [("5", (2, 1, 4, 3))]
+    assert raw_face_landmarks(FakeApi(), dlib, None, [BIG]) == [BIG]
+
+
+BUDGET = {**CONFIG["face"], "pixel_budget": 4_000_000, "min_face_px": 40, "upsample": 2}
+
+
+def test_plan_upsamples_small_images_up_to_the_min_face_size():
+    result = plan_face_detection(640, 480, BUDGET)
+
+    # 40px faces need a 2x detector scale -> one upsampling, no resize
+    assert result == {"size": (640, 480), "upsample": 1, "scale": (1.0, 1.0)}
+
+
+def test_plan_keeps_large_images_within_the_budget():
+    for width, height in [(1400, 1000), (4000, 3000), (9000, 1200), (1500, 1500)]:
+        result = plan_face_detection(width, height, BUDGET)
+        assert detector_pixels(result) <= BUDGET["pixel_budget"] * 1.01
+        assert result["size"][0] <= width and result["size"][1] <= height
+
+
+def test_plan_maps_boxes_back_exactly():
+    result = plan_face_detection(4001, 2999, BUDGET)
+    width, height = result["size"]
+
+    assert scale_face_locations([(0, width, height, 0)], result) == [(0, 4001, 2999, 0)]
+
+
+def test_plan_without_budget_uses_the_legacy_bands():
+    legacy = {**BUDGET, "pixel_budget": 0}
+
+    assert plan_face_detection(1400, 1000, legacy)["size"] == (700, 500)
+    assert plan_face_detection(1400, 1000, legacy)["upsample"] == 2
+
+
+def test_no_people_hint_skips_the_cnn():
+    model = face_model("cnn", hog=[], cnn=[BIG])
+
+    assert model.detect_face_locations(None, person_hint=False) == ([], "skipped (no people)")
+    results = model.category_image_batch(
+        [(np.zeros((40, 40, 3), dtype=np.uint8), plan(1))] * 2, person_hints=[False, None])
+    assert model.model.calls == [("cnn-batch", 1)]
+    assert results[0] == ([], []) and results[1][0] == [BIG]
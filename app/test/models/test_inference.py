@@ -0,0 +1,141 @@
+from io import BytesIO
+from unittest.mock import MagicMock
+
+import pytest
+import torch
+from PIL import Image
+
+from app.models.inference import AIInferenceService
+from app.services.ai_services import AIService
+from app.services.image_job import FACE_PART, FAILED_PARTS, ImageJobTracker
+
+
+def image_bytes():
+    buffer = BytesIO()
+    Image.new("RGB", (64, 48), (120, 80, 40)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def inference_service(face_error=None):
+    # skips __init__, which loads the models
+    service = AIInferenceService.__new__(AIInferenceService)
+    service.model = MagicMock(image_size=(32, 32))
+    service.model.image_encoder.encode.return_value = torch.ones(1, 4)
+    service.label_heads = MagicMock()
+    service.label_heads.classify.return_value = [{"labels": {"category": "cat"}}]
+    service.face_model = MagicMock()
+    service.face_model.category_image_array.side_effect = face_error
+    service.face_model.category_image_array.return_value = ([], [])
+    service.face_executor = None
+    service.person_gate = None
+    service.workers = None
+    service.result_cache = None
+    return service
+
+
+def test_face_failure_keeps_the_labels():
+    service = inference_service(face_error=RuntimeError("dlib out of memory"))
+
+    result = service.analyze_image_bytes(image_bytes())
+
+    assert result["labels"] == {"category": "cat"}
+    assert result["face_error"] == "RuntimeError: dlib out of memory"
+    assert "face_locations" not in result
+
+
+def test_face_only_failure_raises():
+    service = inference_service(face_error=RuntimeError("dlib out of memory"))
+
+    with pytest.raises(RuntimeError):
+        service.run_image_models(image_bytes(), label=False, detect_faces=True)
+
+
+def test_worker_failure_retries_the_labels_alone():
+    service = inference_service()
+    calls = []
+
+    def run_models(image_data, label, detect_faces, person_hint=None):
+        calls.append((label, detect_faces))
+        if detect_faces:
+            raise TimeoutError("worker timed out")
+        return {"labels": {"category": "cat"}, "image_features": torch.ones(1, 4)}
+
+    service.run_models = run_models
+    result = service.analyze_image_bytes(b"image")
+
+    assert calls == [(True, True), (True, False)]
+    assert result["labels"] == {"category": "cat"}
+    assert result["face_error"] == "TimeoutError: worker timed out"
+
+
+def ai_service(analyze_result):
+    # skips __init__, which loads the models and starts the workers
+    service = AIService.__new__(AIService)
+    service.image_jobs = ImageJobTracker()
+    service.inference_service = MagicMock()
+    service.inference_service.analyze_image.return_value = analyze_result
+    return service
+
+
+def test_job_saves_labels_and_retries_failed_faces():
+    service = ai_service({"labels": {"category": "cat"}, "image_features": torch.ones(1, 4),
+                          "face_error": "RuntimeError: dlib out of memory"})
+    supabase_service = service.inference_service.supabase_service
+
+    result = service.process_image_job("image-1", "bucket", "a.jpg", user_id="user-1")
+
+    supabase_service.save_image_features_and_labels.assert_called_once_with(
+        "bucket", "a.jpg", {"category": "cat"}, [1.0, 1.0, 1.0, 1.0])
+    supabase_service.update_person_table.assert_not_called()
+    supabase_service.mark_image_done_face_detection.assert_not_called()
+    assert result[FAILED_PARTS] == {FACE_PART}
+
+    # the next trigger runs the faces again, not the labels
+    service.inference_service.analyze_image.return_value = {
+        "face_locations": [], "face_encodings": []}
+    service.process_image_job("image-1", "bucket", "a.jpg", user_id="user-1")
+
+    _, kwargs = service.inference_service.analyze_image.call_args
+    assert kwargs == {"label": False, "detect_faces": True}
+    supabase_service.save_image_features_and_labels.assert_called_once()
+    supabase_service.mark_image_done_face_detection.assert_called_once_with("image-1", None)
+
+
+def test_face_batch_saves_rows_and_flags_together(monkeypatch):
+    monkeypatch.setattr("app.services.ai_services.fetch_image_bytes",
+                        lambda url: pytest.fail("in flight elsewhere") if url == "url-busy" else b"image")
+    service = ai_service({})
+    service.inference_service.person_gate = None
+    service.inference_service.supabase_service.get_image_public_url.side_effect = \
+        lambda bucket, name: f"url-{name}"
+    service.inference_service.analyze_faces_batch.return_value = [
+        ([(0, 10, 10, 0)], [[0.5]]), RuntimeError("decode failed")]
+    # a face job of this image is already running / done
+    service.image_jobs.run("busy", {FACE_PART}, lambda parts: {"face_locations": []})
+    images = [{"id": image_id, "image_bucket_id": "bucket", "image_name": image_id, "uploader_id": "user-1"}
+              for image_id in ["a", "busy", "b"]]
+
+    assert service.process_face_batch(images) == ["a"]
+    service.inference_service.supabase_service.save_face_detections.assert_called_once_with(
+        [{"embedding": [0.5], "coordinate": (0, 10, 10, 0), "image_id": "a", "user_id": "user-1"}], ["a"], {})
+
+
+def test_gate_decisions_are_saved_with_the_images(monkeypatch):
+    monkeypatch.setattr("app.services.ai_services.fetch_image_bytes", lambda url: b"image")
+    service = ai_service({"face_locations": [], "face_encodings": [],
+                          "person_gate": {"score": 0.03, "skip": True}})
+    supabase_service = service.inference_service.supabase_service
+    gate = service.inference_service.person_gate
+    gate.decide.return_value = {"score": 0.02, "skip": True}
+    service.inference_service.analyze_faces_batch.return_value = [([], [])]
+
+    service.process_image_job("image-1", "bucket", "a.jpg", user_id="user-1", label=False)
+    service.process_face_batch([{"id": "image-2", "image_bucket_id": "bucket", "image_name": "b.jpg",
+                                 "uploader_id": "user-1", "image_features": "[0.1, 0.2]"}])
+
+    supabase_service.mark_image_done_face_detection.assert_called_once_with(
+        "image-1", {"score": 0.03, "skip": True})
+    service.inference_service.analyze_faces_batch.assert_called_once_with([b"image"], [False])
+    supabase_service.save_face_detections.assert_called_once_with(
+        [], ["image-2"], {"image-2": {"score": 0.02, "skip": True}})
+    assert [call.args[0] for call in gate.record.call_args_list] == ["image-1", "image-2"]
@@ -0,0 +1,71 @@
+import copy
+import shutil
+
+import pytest
+import torch
+
+from app.models.config import CONFIG
+from app.models.label_artifact import StaleArtifactError, build_label_artifact, load_label_artifact
+from app.models.label_heads import FusedLabelHeads
+from app.models.preprocess import load_features_parallel, load_filter_items, load_labels_parallel
+
+
+@pytest.fixture(scope="module")
+def artifact_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("labels")
+    build_label_artifact(str(path))
+    return str(path)
+
+
+def legacy_heads():
+    location_filter, location, action, event = load_features_parallel(CONFIG)
+    location_labels, action_labels, event_labels = load_labels_parallel(CONFIG)
+    return FusedLabelHeads(
+        {"location_filter": location_filter, "location": location,
+         "action": action, "event": event},
+        {"location_filter": load_filter_items(CONFIG["labels"]["location_filter"]),
+         "location": location_labels, "action": action_labels, "event": event_labels},
+    )
+
+
+def test_artifact_heads_match_legacy_heads(artifact_dir):
+    heads = FusedLabelHeads.from_artifact(load_label_artifact(artifact_dir))
+    legacy = legacy_heads()
+
+    assert heads.version == legacy.version
+    assert heads.offsets == legacy.offsets
+    assert torch.allclose(heads.weight, legacy.weight, atol=1e-6)
+
+    generator = torch.Generator().manual_seed(0)
+    image_features = torch.randn(4, heads.weight.shape[1], generator=generator)
+    image_features /= image_features.norm(dim=-1, keepdim=True)
+    assert heads.classify(image_features) == legacy.classify(image_features)
+
+
+def test_head_features_are_views_of_the_matrix(artifact_dir):
+    artifact = load_label_artifact(artifact_dir)
+    start, end = artifact.offsets["action"]
+
+    features = artifact.head_features("action")
+
+    assert features.shape[0] == len(artifact.labels["action"]) == end - start
+    assert torch.allclose(features.norm(dim=-1), torch.ones(end - start), atol=1e-5)
+
+
+def test_changed_source_file_is_stale(artifact_dir, tmp_path):
+    config = copy.deepcopy(CONFIG)
+    path = tmp_path / "action.txt"
+    shutil.copy(CONFIG["labels"]["action_label"], path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n")
+    config["labels"]["action_label"] = str(path)
+
+    with pytest.raises(StaleArtifactError):
+        load_label_artifact(artifact_dir, config)
+    # accepted when verification is disabled
+    assert load_label_artifact(artifact_dir, config, verify=False).checksum
+
+
+def test_missing_artifact_raises(tmp_path):
+    with pytest.raises(StaleArtifactError):
+        load_label_artifact(str(tmp_path))
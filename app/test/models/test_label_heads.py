@@ -0,0 +1,112 @@
+import pytest
+import torch
+
+from app.models.config import CONFIG
+from app.models.label_heads import FusedLabelHeads
+from app.models.preprocess import load_features_parallel, load_filter_items, load_labels_parallel
+
+
+def reference_top_labels(labels, text_features, image_features):
+    # per-head implementation the fused heads replace
+    probs = (100.0 * image_features @ text_features.T).softmax(dim=-1)
+    labels_probs, labels_indices = torch.topk(probs[0], 2)
+    return [{labels[labels_indices[i].item()]: labels_probs[i].item()} for i in range(2)]
+
+
+def reference_classify(features, labels, image_features):
+    relate_probs = (100.0 * image_features @
+                    features["location_filter"].T).softmax(dim=-1)
+    _, top_index = torch.topk(relate_probs[0], 1)
+    relate = labels["location_filter"][top_index.item()]
+    if not relate["is_relate"]:
+        return relate, {"location_labels": [], "action_labels": [], "event_labels": []}
+    return relate, {
+        "location_labels": reference_top_labels(labels["location"], features["location"], image_features),
+        "action_labels": reference_top_labels(labels["action"], features["action"], image_features),
+        "event_labels": reference_top_labels(labels["event"], features["event"], image_features),
+    }
+
+
+@pytest.fixture(scope="module")
+def real_heads():
+    location_filter, location, action, event = load_features_parallel(CONFIG)
+    location_labels, action_labels, event_labels = load_labels_parallel(CONFIG)
+    features = {
+        "location_filter": location_filter,
+        "location": location,
+        "action": action,
+        "event": event,
+    }
+    labels = {
+        "location_filter": load_filter_items(CONFIG["labels"]["location_filter"]),
+        "location": location_labels,
+        "action": action_labels,
+        "event": event_labels,
+    }
+    return features, labels, FusedLabelHeads(features, labels)
+
+
+def random_image_features(n, dim=512, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    features = torch.randn(n, dim, generator=generator)
+    return features / features.norm(dim=-1, keepdim=True)
+
+
+def test_offsets_cover_all_heads(real_heads):
+    features, _, heads = real_heads
+    total = sum(tensor.shape[0] for tensor in features.values())
+
+    assert heads.weight.shape == (total, 512)
+    assert heads.offsets["location_filter"][0] == 0
+    assert heads.offsets["event"][1] == total
+
+
+def test_segmented_softmax_sums_to_one_per_head(real_heads):
+    _, _, heads = real_heads
+    probs = heads.scores(random_image_features(3))
+
+    for start, end in heads.offsets.values():
+        assert torch.allclose(probs[:, start:end].sum(dim=-1),
+                              torch.ones(3), atol=1e-5)
+
+
+def test_batch_matches_per_head_reference(real_heads):
+    features, labels, heads = real_heads
+    image_features = random_image_features(6, seed=1)
+    # push some rows towards a "related" filter label so both branches are covered
+    image_features[:3] += features["location_filter"][0]
+    image_features /= image_features.norm(dim=-1, keepdim=True)
+
+    results = heads.classify(image_features)
+
+    assert len(results) == 6
+    for i, result in enumerate(results):
+        relate, expected = reference_classify(
+            features, labels, image_features[i:i + 1])
+        assert result["relate"] == relate
+        assert result["labels"].keys() == expected.keys()
+        for key, expected_labels in expected.items():
+            assert [list(item) for item in result["labels"][key]] == [
+                list(item) for item in expected_labels]
+            for got, want in zip(result["labels"][key], expected_labels):
+                assert list(got.values())[0] == pytest.approx(
+                    list(want.values())[0], abs=1e-5)
+
+
+def test_single_feature_vector_is_accepted(real_heads):
+    _, _, heads = real_heads
+    results = heads.classify(random_image_features(1)[0])
+    assert len(results) == 1
+
+
+def test_mismatched_labels_raise():
+    features = {name: torch.eye(3) for name in [
+        "location_filter", "location", "action", "event"]}
+    labels = {
+        "location_filter": [{"name": "a", "is_relate": True}] * 3,
+        "location": ["a", "b"],
+        "action": ["a", "b", "c"],
+        "event": ["a", "b", "c"],
+    }
+    with pytest.raises(ValueError):
+        FusedLabelHeads(features, labels)
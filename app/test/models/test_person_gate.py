@@ -0,0 +1,51 @@
+import torch
+
+from app.models.person_gate import PersonGate, create_person_gate
+
+
+def unit(*values):
+    features = torch.tensor([values], dtype=torch.float32)
+    return features / features.norm(dim=-1, keepdim=True)
+
+
+def make_gate(threshold=0.1):
+    # people prompts along the first axis, the other prompts along the second / third
+    return PersonGate(unit(1, 0, 0), torch.cat([unit(0, 1, 0), unit(0, 0, 1)]), threshold)
+
+
+def test_scores_are_the_people_prompt_mass():
+    gate = make_gate()
+
+    person, scenery = gate.scores(torch.cat([unit(1, 0.1, 0), unit(0.1, 1, 0)]))
+    assert person > 0.99 and scenery < 0.01
+
+
+def test_decision_skips_confidently_low_scores_only():
+    gate = make_gate(threshold=0.1)
+
+    assert gate.decide(unit(0.1, 1, 0))["skip"]
+    assert not gate.decide(unit(1, 1, 0))["skip"]
+
+
+def test_decisions_are_recorded_for_audit():
+    gate = make_gate()
+    gate.record("a", gate.decide(unit(0.1, 1, 0)))
+    gate.record("b", gate.decide(unit(1, 0, 0)))
+
+    stats = gate.get_stats()
+    assert stats["checked"] == 2 and stats["skipped"] == 1
+    assert [(entry["image_id"], entry["skip"]) for entry in stats["recent"]] == [("a", True), ("b", False)]
+
+
+def test_prompts_are_encoded_with_the_text_encoder():
+    prompts = {"person": unit(1, 0, 0), "scene": unit(0, 1, 0)}
+
+    class Model:
+        def get_text_features(self, text):
+            return prompts[text]
+
+    config = {"enabled": True, "threshold": 0.2,
+              "person_prompts": ["person"], "other_prompts": ["scene"]}
+    gate = create_person_gate(Model(), config)
+    assert gate.person_count == 1 and gate.threshold == 0.2
+    assert create_person_gate(Model(), {**config, "enabled": False}) is None
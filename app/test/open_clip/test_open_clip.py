@@ -241,3 +241,7 @@ def process_test_open_clip():
         print("==== COMPLETED IMAGE LABELING TEST ====\n")
     except Exception as e:
         print(f"ERROR in process_test_open_clip: {str(e)}")
+
+
+if __name__ == "__main__":
+    process_test_open_clip()
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from app.services.ann_index import IVFIndex, ivf_index_factory, normalize, spherical_kmeans
+
+
+def clustered_features(n=600, dim=16, clusters=6, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.normal(size=(clusters, dim)))
+    return normalize(centers[rng.integers(0, clusters, size=n)] + 0.1 * rng.normal(size=(n, dim)))
+
+
+def exact_top_k(features, query, k):
+    return list(np.argsort(-(features @ query))[:k])
+
+
+def test_spherical_kmeans_returns_unit_centroids():
+    centroids = spherical_kmeans(clustered_features(), nlist=6)
+
+    assert centroids.shape == (6, 16)
+    assert np.allclose(np.linalg.norm(centroids, axis=1), 1.0, atol=1e-5)
+
+
+def test_untrained_index_is_exact():
+    features = clustered_features(n=50)
+    index = IVFIndex(dim=16, min_train_size=1000)
+    index.upsert(list(range(50)), features)
+
+    results = index.search(features[3], limit=5)
+
+    assert not index.trained
+    assert [image_id for image_id, _ in results] == exact_top_k(features, features[3], 5)
+
+
+def test_trains_itself_past_min_size_and_keeps_recall():
+    features = clustered_features()
+    index = IVFIndex(dim=16, nlist=12, nprobe=4, min_train_size=500)
+    index.upsert(list(range(400)), features[:400])
+    assert not index.trained
+
+    index.upsert(list(range(400, 600)), features[400:])
+
+    assert index.trained
+    assert len(index) == 600
+    hits = 0
+    for query in features[:20]:
+        found = {image_id for image_id, _ in index.search(query, limit=10)}
+        hits += len(found & set(exact_top_k(features, query, 10)))
+    assert hits / 200 >= 0.9
+
+
+def test_full_probe_equals_exact_search():
+    features = clustered_features()
+    index = IVFIndex(dim=16, nlist=8, min_train_size=1)
+    index.upsert(list(range(600)), features)
+
+    results = index.search(features[7], limit=10, nprobe=8)
+
+    assert [image_id for image_id, _ in results] == exact_top_k(features, features[7], 10)
+
+
+def test_upsert_moves_and_remove_deletes():
+    features = clustered_features()
+    index = IVFIndex(dim=16, nlist=6, nprobe=6, min_train_size=1)
+    index.upsert(list(range(600)), features)
+
+    index.upsert([0], features[1:2])
+    index.remove([1])
+
+    results = dict(index.search(features[1], threshold=0.999))
+    assert 0 in results and 1 not in results
+    assert len(index) == 599
+
+
+def test_save_and_load_round_trip(tmp_path):
+    features = clustered_features()
+    index = IVFIndex(dim=16, nlist=6, nprobe=2, min_train_size=1)
+    index.upsert([f"id-{i}" for i in range(600)], features)
+    path = str(tmp_path / "index.npz")
+
+    index.save(path)
+    loaded = IVFIndex.load(path)
+
+    assert loaded.trained and len(loaded) == 600
+    assert np.allclose(loaded.centroids, index.centroids)
+    assert loaded.search(features[5], limit=3) == pytest.approx(
+        index.search(features[5], limit=3))
+
+
+def test_factory_persists_and_reuses_trained_centroids(tmp_path):
+    features = clustered_features()
+    ids = list(range(600))
+    user_id = "0b6e5d3c-8f5a-4c43-9a52-1f0e2d7a4b11"
+    build = ivf_index_factory(dim=16, min_train_size=100, index_dir=str(tmp_path))
+
+    first = build(user_id, ids, features)
+    assert (tmp_path / f"{user_id}.centroids.npy").exists()
+
+    # image 0 deleted since the centroids were written
+    second = build(user_id, ids[1:], features[1:])
+    assert np.allclose(second.centroids, first.centroids)
+    assert len(second) == 599
+    assert 0 not in [image_id for image_id, _ in second.search(features[0], limit=5)]
+
+
+def test_factory_does_not_build_paths_from_other_user_ids(tmp_path):
+    build = ivf_index_factory(dim=16, min_train_size=100, index_dir=str(tmp_path / "index"))
+
+    index = build("../escape", list(range(600)), clustered_features())
+
+    assert index.trained and len(index) == 600
+    assert not any(tmp_path.rglob("*.npy"))
+
+
+def test_search_many_returns_one_list_per_query():
+    features = clustered_features()
+    index = IVFIndex(dim=16, nlist=8, nprobe=3, min_train_size=1)
+    index.upsert(list(range(600)), features)
+
+    results = index.search_many(features[:4], limit=3)
+
+    assert [found[0][0] for found in results] == [0, 1, 2, 3]
@@ -0,0 +1,178 @@
+import numpy as np
+import pytest
+
+from app.services.embedding_store import EmbeddingStore, EmbeddingStoreSyncer
+
+
+def vectors(n, dim=4, start=0):
+    return np.arange(start, start + n * dim, dtype=np.float32).reshape(n, dim) / 100
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EmbeddingStore(str(tmp_path / "store"), dim=4)
+
+
+def test_append_and_reopen(store, tmp_path):
+    store.append(["a", "b"], vectors(2), owners=["u1", "u2"], watermark="t1")
+
+    reopened = EmbeddingStore(str(tmp_path / "store"), dim=4)
+
+    assert len(reopened) == 2
+    assert reopened.watermark == "t1"
+    assert isinstance(reopened._vectors, np.memmap)
+    assert np.allclose(reopened.get("b"), vectors(2)[1], atol=1e-3)
+    assert reopened.get("missing") is None
+
+
+def test_latest_row_wins_and_compaction_drops_stale_rows(store):
+    store.append(["a", "b"], vectors(2), owners=["u1", "u1"])
+    store.append(["a"], vectors(1, start=50), owners=["u1"])
+
+    assert len(store) == 2
+    assert store.garbage_ratio == pytest.approx(1 / 3)
+
+    store.compact()
+
+    assert store.garbage_ratio == 0
+    assert np.allclose(store.get("a"), vectors(1, start=50)[0], atol=1e-3)
+    assert np.allclose(store.get("b"), vectors(2)[1], atol=1e-3)
+
+
+def test_load_owner_and_get_many(store):
+    store.append(["a", "b", "c"], vectors(3), owners=["u1", "u2", "u1"])
+
+    ids, features = store.load_owner("u1")
+
+    assert ids == ["a", "c"]
+    assert features.dtype == np.float32 and features.shape == (2, 4)
+    assert set(store.get_many(["b", "c", "missing"])) == {"b", "c"}
+
+
+def test_other_instance_sees_appends_after_refresh(store, tmp_path):
+    reader = EmbeddingStore(str(tmp_path / "store"), dim=4)
+    store.append(["a"], vectors(1))
+
+    assert len(reader) == 0
+    reader.refresh()
+    assert len(reader) == 1
+
+
+def test_refresh_only_parses_new_lines_until_the_generation_changes(store, tmp_path):
+    reader = EmbeddingStore(str(tmp_path / "store"), dim=4)
+    store.append(["a"], vectors(1))
+    reader.refresh()
+    # rewritten in place: a refresh that parsed the whole file again would see it
+    ids_file = tmp_path / "store" / "ids.0.tsv"
+    ids_file.write_text(ids_file.read_text().replace("a\t", "z\t"))
+
+    store.append(["b", "a"], vectors(2, start=8))
+    store.remove(["b"])
+    reader.refresh()
+    assert reader.ids() == ["a"]
+    assert np.allclose(reader.get("a"), vectors(2, start=8)[1], atol=1e-3)
+
+    store.compact()
+    reader.refresh()
+    assert reader.ids() == ["a"] and reader.garbage_ratio == 0
+
+
+def test_uncommitted_bytes_are_ignored(store, tmp_path):
+    store.append(["a"], vectors(1))
+    # interrupted append: data written, meta.json not updated
+    with open(tmp_path / "store" / "vectors.0.f16", "ab") as f:
+        f.write(vectors(1).astype(np.float16).tobytes())
+    with open(tmp_path / "store" / "ids.0.tsv", "a") as f:
+        f.write("torn\t\n")
+
+    reopened = EmbeddingStore(str(tmp_path / "store"), dim=4)
+    assert len(reopened) == 1 and reopened.get("torn") is None
+
+    reopened.append(["b"], vectors(1, start=8))
+    assert len(EmbeddingStore(str(tmp_path / "store"), dim=4)) == 2
+
+
+def test_dimension_mismatch_raises(store, tmp_path):
+    store.append(["a"], vectors(1))
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path / "store"), dim=8)
+
+
+def test_syncer_pages_by_watermark_without_duplicates(store):
+    rows = [{"id": f"img{i}", "owner": "u1", "vector": vectors(1, start=i)[0], "updated_at": f"t{i // 2}"}
+            for i in range(5)]
+
+    def fetch_page(watermark, page_size):
+        # (updated_at, id) keyset pagination like the PostgREST query
+        matching = sorted((row for row in rows if watermark is None
+                           or (row["updated_at"], row["id"]) > tuple(watermark)),
+                          key=lambda row: (row["updated_at"], row["id"]))
+        return matching[:page_size]
+
+    syncer = EmbeddingStoreSyncer(store, fetch_page, page_size=2)
+
+    assert syncer.sync() == 5
+    assert store.watermark == ["t2", "img4"]
+    assert syncer.sync() == 0
+    assert store.garbage_ratio == 0
+
+    rows.append({"id": "img0", "owner": "u1", "vector": vectors(1, start=40)[0], "updated_at": "t3"})
+    assert syncer.sync() == 1
+    assert np.allclose(store.get("img0"), vectors(1, start=40)[0], atol=1e-2)
+
+
+def test_removed_ids_stay_removed_after_reopen_and_compaction(store, tmp_path):
+    store.append(["a", "b", "c"], vectors(3), owners=["u1", "u1", "u2"])
+
+    assert store.remove(["a", "missing"]) == 1
+    assert store.get("a") is None and sorted(store.ids()) == ["b", "c"]
+    assert store.load_owner("u1")[0] == ["b"]
+
+    reopened = EmbeddingStore(str(tmp_path / "store"), dim=4)
+    assert sorted(reopened.ids()) == ["b", "c"]
+    assert reopened.garbage_ratio == 0.5
+
+    reopened.append(["a"], vectors(1, start=20), owners=["u1"])
+    reopened.compact()
+    assert sorted(reopened.ids()) == ["a", "b", "c"]
+    assert np.allclose(reopened.get("a"), vectors(1, start=20)[0], atol=1e-2)
+
+
+def test_syncer_reconciles_deleted_rows(store):
+    rows = [{"id": f"img{i}", "owner": "u1", "vector": vectors(1, start=i)[0], "updated_at": f"t{i}"}
+            for i in range(3)]
+    live = ["img0", "img2"]
+    syncer = EmbeddingStoreSyncer(store, lambda watermark, page_size: rows if watermark is None else [],
+                                  fetch_ids=lambda: live)
+
+    syncer.sync()
+    assert syncer.reconcile() == 1
+    assert sorted(store.ids()) == ["img0", "img2"]
+
+
+def test_syncer_rereads_the_lag_window(store):
+    rows = [{"id": "img0", "owner": "u1", "vector": vectors(1)[0], "updated_at": "2026-10-17T10:00:00+00:00"},
+            {"id": "img1", "owner": "u1", "vector": vectors(1, start=4)[0], "updated_at": "2026-10-17T10:05:00+00:00"}]
+    requested = []
+
+    def fetch_page(watermark, page_size):
+        requested.append(watermark)
+        # same timestamp format everywhere -> strings compare like the timestamps
+        if watermark is not None and watermark[1] is None:
+            matching = [row for row in rows if row["updated_at"] >= watermark[0]]
+        else:
+            matching = [row for row in rows if watermark is None
+                        or (row["updated_at"], row["id"]) > tuple(watermark)]
+        return sorted(matching, key=lambda row: (row["updated_at"], row["id"]))[:page_size]
+
+    syncer = EmbeddingStoreSyncer(store, fetch_page, lag=600)
+    assert syncer.sync() == 2
+
+    # committed late with a timestamp before the watermark
+    rows.insert(1, {"id": "late", "owner": "u2", "vector": vectors(1, start=8)[0],
+                    "updated_at": "2026-10-17T10:01:00+00:00"})
+    assert syncer.sync() == 1
+    assert requested[-1] == ["2026-10-17T09:55:00+00:00", None]
+    assert store.get("late") is not None
+    assert store.watermark == ["2026-10-17T10:05:00+00:00", "img1"]
+    assert store.garbage_ratio == 0
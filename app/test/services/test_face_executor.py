@@ -0,0 +1,67 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from app.models.model import split_by_detector_pixels
+from app.services.face_executor import FaceDetectionExecutor
+from app.services.inference_workers import TaskTimeoutError
+
+
+class FakeFaceModel:
+    # same surface as FaceCategoryModel.category_image_array
+    def category_image_array(self, image, ratio, person_hint=None):
+        if image.shape[0] == 0:
+            # stands in for a detector stuck in native code
+            time.sleep(60)
+        locations = [(0, image.shape[1], image.shape[0], 0)]
+        return [tuple(int(v / ratio) for v in location) for location in locations], [os.getpid()]
+
+    def category_image_batch(self, images, person_hints=None):
+        return [([len(images)], [os.getpid()]) for _ in images]
+
+
+@pytest.fixture
+def executor():
+    executor = FaceDetectionExecutor(
+        FakeFaceModel(), processes=2, timeout=1)
+    yield executor
+    executor.close()
+
+
+def test_images_are_detected_in_pool_processes(executor):
+    futures = [executor.submit(np.zeros((10 * i, 20, 3), dtype=np.uint8), 0.5)
+               for i in range(1, 5)]
+
+    results = [future.result(10) for future in futures]
+    assert [locations for locations, _ in results] == [
+        [(0, 40, 20 * i, 0)] for i in range(1, 5)]
+    assert all(pid != os.getpid() for _, (pid,) in results)
+    assert executor.get_stats()["max_pending"] == 4
+
+
+def test_stuck_detection_times_out(executor):
+    with pytest.raises(TaskTimeoutError):
+        executor.detect(np.zeros((0, 20, 3), dtype=np.uint8), 1)
+
+    assert executor.detect(np.zeros((4, 4, 3), dtype=np.uint8), 1)[0] == [(0, 4, 4, 0)]
+
+
+def plan(width, height, upsample=0):
+    return {"size": (width, height), "upsample": upsample, "scale": (1.0, 1.0)}
+
+
+def test_batch_is_split_by_detector_pixels():
+    executor = FaceDetectionExecutor(
+        FakeFaceModel(), processes=2, timeout=5, batch_pixels=100 * 100)
+    try:
+        image = np.zeros((1, 1, 3), dtype=np.uint8)
+        # 5000, 5000, 5000, 40000 (upsampled, alone), 2500 detector pixels
+        images = [(image, plan(50, 100))] * 3 + [(image, plan(50, 50, 1)), (image, plan(50, 50))]
+
+        assert split_by_detector_pixels([plan for _, plan in images], 100 * 100) == [[0, 1], [2], [3], [4]]
+        results = executor.detect_batch(images, [None] * 5)
+        assert [locations for locations, _ in results] == [[2], [2], [1], [1], [1]]
+    finally:
+        executor.close()
@@ -0,0 +1,141 @@
+import threading
+import pytest
+from unittest.mock import MagicMock
+
+from app.services.image_job import FACE_PART, FAILED_PARTS, LABEL_PART, ImageJobTracker
+
+
+def test_run_calls_job_with_requested_parts():
+    tracker = ImageJobTracker()
+    job = MagicMock(return_value={"labels": {}})
+
+    result, ran = tracker.run("image-1", {LABEL_PART, FACE_PART}, job)
+
+    job.assert_called_once_with({LABEL_PART, FACE_PART})
+    assert result == {"labels": {}}
+    assert ran == {LABEL_PART, FACE_PART}
+
+
+def test_covered_parts_are_not_run_again():
+    tracker = ImageJobTracker()
+    job = MagicMock(return_value={"labels": {"a": 1}, "face_locations": []})
+
+    tracker.run("image-1", {LABEL_PART, FACE_PART}, job)
+    result, ran = tracker.run("image-1", {FACE_PART}, job)
+
+    assert job.call_count == 1
+    assert ran == set()
+    assert result["labels"] == {"a": 1}
+
+
+def test_missing_part_runs_and_keeps_previous_result():
+    tracker = ImageJobTracker()
+
+    tracker.run("image-1", {LABEL_PART}, lambda parts: {"labels": {"a": 1}})
+    job = MagicMock(return_value={"face_locations": [(1, 2, 3, 4)]})
+    result, ran = tracker.run("image-1", {LABEL_PART, FACE_PART}, job)
+
+    job.assert_called_once_with({FACE_PART})
+    assert ran == {FACE_PART}
+    assert result == {"labels": {"a": 1}, "face_locations": [(1, 2, 3, 4)]}
+
+
+def test_concurrent_triggers_share_one_run():
+    tracker = ImageJobTracker()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_job(parts):
+        calls.append(parts)
+        started.set()
+        release.wait(5)
+        return {"labels": {"a": 1}}
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(
+        tracker.run("image-1", {LABEL_PART}, slow_job)))
+    first.start()
+    started.wait(5)
+
+    second = threading.Thread(target=lambda: results.append(
+        tracker.run("image-1", {LABEL_PART}, slow_job)))
+    second.start()
+    release.set()
+    first.join()
+    second.join()
+
+    assert len(calls) == 1
+    assert [result for result, _ in results] == [
+        {"labels": {"a": 1}}, {"labels": {"a": 1}}]
+
+
+def test_failed_job_can_be_retried():
+    tracker = ImageJobTracker()
+
+    def failing_job(parts):
+        raise RuntimeError("download failed")
+
+    with pytest.raises(RuntimeError):
+        tracker.run("image-1", {LABEL_PART}, failing_job)
+
+    result, ran = tracker.run(
+        "image-1", {LABEL_PART}, lambda parts: {"labels": {}})
+    assert ran == {LABEL_PART}
+
+
+def test_entries_expire_after_ttl():
+    tracker = ImageJobTracker(ttl=0)
+    job = MagicMock(return_value={})
+
+    tracker.run("image-1", {LABEL_PART}, job)
+    tracker.run("image-1", {LABEL_PART}, job)
+
+    assert job.call_count == 2
+
+
+def test_failed_parts_run_again():
+    tracker = ImageJobTracker()
+
+    result, ran = tracker.run("image-1", {LABEL_PART, FACE_PART},
+                              lambda parts: {"labels": {"a": 1}, FAILED_PARTS: {FACE_PART}})
+    assert ran == {LABEL_PART}
+    assert result[FAILED_PARTS] == {FACE_PART}
+
+    job = MagicMock(return_value={"face_locations": []})
+    result, ran = tracker.run("image-1", {LABEL_PART, FACE_PART}, job)
+
+    job.assert_called_once_with({FACE_PART})
+    assert ran == {FACE_PART}
+    assert result == {"labels": {"a": 1}, "face_locations": []}
+
+
+def test_batch_skips_images_covered_elsewhere_and_retries_failures():
+    tracker = ImageJobTracker()
+    tracker.run("image-1", {FACE_PART}, lambda parts: {"face_locations": []})
+    batch = MagicMock(return_value={
+        "image-2": {"face_locations": [(1, 2, 3, 4)]}, "image-3": RuntimeError("decode failed")})
+
+    results = tracker.run_many(["image-1", "image-2", "image-3"], {FACE_PART}, batch)
+
+    batch.assert_called_once_with(["image-2", "image-3"])
+    assert results["image-2"] == {"face_locations": [(1, 2, 3, 4)]}
+    assert isinstance(results["image-3"], RuntimeError)
+
+    # a single-image trigger reuses the batch result, the failed image runs again
+    job = MagicMock(return_value={"face_locations": []})
+    assert tracker.run("image-2", {FACE_PART}, job) == ({"face_locations": [(1, 2, 3, 4)]}, set())
+    assert tracker.run("image-3", {FACE_PART}, job)[1] == {FACE_PART}
+    job.assert_called_once_with({FACE_PART})
+
+
+def test_failed_batch_can_be_retried():
+    tracker = ImageJobTracker()
+
+    def failing_batch(image_ids):
+        raise ConnectionError("db down")
+
+    with pytest.raises(ConnectionError):
+        tracker.run_many(["image-1"], {FACE_PART}, failing_batch)
+
+    assert tracker.run_many(["image-1"], {FACE_PART}, lambda image_ids: {"image-1": {}}) == {"image-1": {}}
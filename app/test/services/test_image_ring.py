@@ -0,0 +1,77 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+import torch
+
+from app.services.image_ring import RingFullError, SharedImageRing
+
+
+@pytest.fixture
+def ring():
+    ring = SharedImageRing(2, clip_size=(8, 8), face_max_pixels=16 * 16)
+    yield ring
+    ring.close()
+
+
+def test_clip_and_face_round_trip(ring):
+    index = ring.acquire()
+    image_tensor = torch.rand(3, 8, 8)
+    face_image = np.random.default_rng(0).integers(
+        0, 255, size=(12, 16, 3), dtype=np.uint8)
+
+    ring.write_clip(index, image_tensor)
+    face_shape = ring.write_face(index, face_image)
+
+    assert torch.equal(ring.clip_tensor(index), image_tensor)
+    assert face_shape == (12, 16)
+    assert np.array_equal(ring.face_array(index, *face_shape), face_image)
+
+
+def test_slots_do_not_overlap(ring):
+    first, second = ring.acquire(), ring.acquire()
+    ring.write_clip(first, torch.zeros(3, 8, 8))
+    ring.write_face(first, np.zeros((16, 16, 3), dtype=np.uint8))
+    ring.write_clip(second, torch.ones(3, 8, 8))
+    ring.write_face(second, np.full((16, 16, 3), 255, dtype=np.uint8))
+
+    assert ring.clip_tensor(first).sum() == 0
+    assert ring.face_array(first, 16, 16).max() == 0
+
+
+def test_full_ring_waits_then_raises(ring):
+    ring.acquire(), ring.acquire()
+
+    with pytest.raises(RingFullError):
+        ring.acquire(timeout=0.01)
+    ring.release(1)
+    assert ring.acquire(timeout=0.01) == 1
+    assert ring.get_stats()["waits"] == 1
+
+
+def test_oversized_face_image_is_rejected(ring):
+    assert not ring.fits_face(17, 16)
+    with pytest.raises(ValueError):
+        ring.write_face(ring.acquire(), np.zeros((17, 16, 3), dtype=np.uint8))
+
+
+def read_slot(ring, index, written, results):
+    written.wait(10)
+    results.put((ring.clip_tensor(index).sum().item(),
+                 int(ring.face_array(index, 4, 4).sum())))
+
+
+def test_forked_process_reads_slot_written_after_fork(ring):
+    ctx = multiprocessing.get_context("fork")
+    written, results = ctx.Event(), ctx.Queue()
+    index = ring.acquire()
+    process = ctx.Process(target=read_slot, args=(
+        ring, index, written, results))
+    process.start()
+
+    ring.write_clip(index, torch.full((3, 8, 8), 0.5))
+    ring.write_face(index, np.ones((4, 4, 3), dtype=np.uint8))
+    written.set()
+
+    assert results.get(timeout=10) == (96.0, 48)
+    process.join(10)
@@ -0,0 +1,143 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from app.services.inference_workers import InferenceWorkerPool, PoolBusyError, TaskTimeoutError, WorkerCrashedError
+
+
+class Target:
+    def __init__(self):
+        # loaded before the fork -> inherited by every worker
+        self.weight = np.arange(4, dtype=np.float32)
+        self.initialized = False
+
+    def score(self, features):
+        return float(self.weight @ np.asarray(features, dtype=np.float32))
+
+    def worker_state(self):
+        return os.getpid(), self.initialized
+
+    def fail(self):
+        raise ValueError("bad image")
+
+    def crash(self):
+        os._exit(3)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+
+def initialize(target):
+    target.initialized = True
+
+
+@pytest.fixture
+def pool():
+    pool = InferenceWorkerPool(Target(), processes=2,
+                               concurrency=2, initializer=initialize)
+    yield pool
+    pool.close()
+
+
+def test_jobs_run_in_forked_workers(pool):
+    futures = [pool.submit("score", [1, 0, 0, i]) for i in range(8)]
+
+    assert [future.result(10) for future in futures] == [3.0 * i for i in range(8)]
+    pid, initialized = pool.submit("worker_state").result(10)
+    assert pid != os.getpid() and initialized
+    assert pool.get_stats()["completed"] == 9
+
+
+def test_exception_is_raised_in_caller(pool):
+    with pytest.raises(RuntimeError, match="bad image"):
+        pool.submit("fail").result(10)
+    assert pool.get_stats()["failed"] == 1
+
+
+def test_crashed_worker_fails_its_job_and_is_replaced(pool):
+    with pytest.raises(WorkerCrashedError):
+        pool.submit("crash").result(10)
+
+    assert pool.submit("score", [0, 1, 0, 0]).result(10) == 1.0
+    stats = pool.get_stats()
+    assert stats["crashes"] == 1 and stats["alive"] == 2
+
+
+def test_closed_pool_rejects_jobs():
+    pool = InferenceWorkerPool(Target(), processes=1)
+    pool.close()
+
+    with pytest.raises(RuntimeError):
+        pool.submit("score", [1, 1, 1, 1])
+
+
+def test_full_pool_rejects_jobs_after_waiting():
+    pool = InferenceWorkerPool(Target(), processes=1, concurrency=1,
+                               max_pending=1, submit_timeout=0.05)
+    try:
+        running = pool.submit("sleep", 0.5)
+        with pytest.raises(PoolBusyError):
+            pool.submit("sleep", 0)
+
+        assert running.result(10) == 0.5
+        # room again once the running job is done
+        assert pool.submit("sleep", 0).result(10) == 0
+        assert pool.get_stats()["rejected"] == 1
+    finally:
+        pool.close()
+
+
+def test_job_past_its_timeout_kills_the_worker():
+    pool = InferenceWorkerPool(
+        Target(), processes=1, concurrency=1, task_timeout=0.2)
+    try:
+        with pytest.raises(TaskTimeoutError):
+            pool.submit("sleep", 30).result(10)
+
+        assert pool.submit("sleep", 0).result(10) == 0
+        stats = pool.get_stats()
+        assert stats["timeouts"] == 1 and stats["alive"] == 1
+    finally:
+        pool.close()
+
+
+def test_crash_with_concurrent_jobs_does_not_hang_the_pool():
+    pool = InferenceWorkerPool(Target(), processes=1, concurrency=2)
+    try:
+        futures = [pool.submit("sleep", 0.2) for _ in range(2)]
+        futures.append(pool.submit("crash"))
+        futures += [pool.submit("sleep", 0) for _ in range(3)]
+
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result(10))
+            except WorkerCrashedError:
+                outcomes.append("crashed")
+
+        # the jobs sharing the worker with the crash fail with it, none hangs
+        assert outcomes[2] == "crashed"
+        assert all(outcome in (0.2, 0, "crashed") for outcome in outcomes)
+        assert pool.submit("sleep", 0).result(10) == 0
+        stats = pool.get_stats()
+        assert stats["pending"] == 0 and stats["alive"] == 1 and stats["crashes"] == 1
+    finally:
+        pool.close()
+
+
+def test_job_cancelled_while_queued_never_runs():
+    pool = InferenceWorkerPool(Target(), processes=1, concurrency=1, max_pending=2)
+    try:
+        running = pool.submit("sleep", 0.3)
+        queued = pool.submit("worker_state")
+
+        assert queued.cancel() and not running.cancel()
+        assert running.result(10) == 0.3
+        assert pool.submit("sleep", 0).result(10) == 0
+        stats = pool.get_stats()
+        assert stats["pending"] == 0 and stats["completed"] == 2
+    finally:
+        pool.close()
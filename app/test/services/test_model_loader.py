@@ -0,0 +1,56 @@
+import threading
+
+from app.services.model_loader import FAILED, LOADING, PENDING, READY, ModelLoader
+
+
+def test_steps_load_in_order_and_share_objects():
+    warmed = []
+    loader = ModelLoader()
+    loader.register("clip", lambda: "clip-model", warm_up_fn=warmed.append)
+    loader.register("service", lambda: f"service({loader.get('clip')})")
+
+    loader.run()
+
+    assert loader.is_ready()
+    assert loader.get("service") == "service(clip-model)"
+    assert warmed == ["clip-model"]
+    status = loader.status()
+    assert status["ready"] is True
+    assert status["models"]["clip"]["state"] == READY
+    assert status["models"]["clip"]["warm_up_ms"] is not None
+    assert status["models"]["service"]["warm_up_ms"] is None
+
+
+def test_failed_step_stops_the_loader():
+    def fail():
+        raise RuntimeError("no weights")
+
+    loader = ModelLoader()
+    loader.register("labels", lambda: "labels")
+    loader.register("clip", fail)
+    loader.register("service", lambda: "service")
+
+    loader.run()
+
+    models = loader.status()["models"]
+    assert models["labels"]["state"] == READY
+    assert models["clip"]["state"] == FAILED
+    assert models["clip"]["error"] == "no weights"
+    assert models["service"]["state"] == PENDING
+    assert loader.get("clip") is None and not loader.is_ready()
+    assert loader.done.is_set()
+
+
+def test_status_while_loading_in_background():
+    release = threading.Event()
+    loader = ModelLoader()
+    loader.register("clip", lambda: release.wait(5) and "clip-model")
+
+    loader.start()
+    assert not loader.wait(0.05)
+    assert loader.status()["models"]["clip"]["state"] == LOADING
+    assert loader.is_ready("clip") is False
+
+    release.set()
+    assert loader.wait(5)
+    assert loader.get("clip") == "clip-model"
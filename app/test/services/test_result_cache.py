@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from app.services.result_cache import FACES, IMAGE_FEATURES, LABELS, ResultCache, content_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite3"), max_bytes=10_000)
+    yield cache
+    cache.close()
+
+
+def test_content_key_depends_on_bytes_only():
+    assert content_key(b"image") == content_key(b"image")
+    assert content_key(b"image") != content_key(b"other image")
+
+
+def test_image_features_round_trip(cache):
+    features = np.arange(4, dtype=np.float32)
+    cache.set("key", IMAGE_FEATURES, "v1", features)
+
+    result = cache.get("key", IMAGE_FEATURES, "v1")
+    assert result.dtype == np.float32
+    assert np.array_equal(result, features)
+
+
+def test_labels_round_trip(cache):
+    labels = {"location_labels": [{"beach": 0.9}], "action_labels": [], "event_labels": []}
+    cache.set("key", LABELS, "v1", labels)
+
+    assert cache.get("key", LABELS, "v1") == labels
+
+
+def test_faces_round_trip(cache):
+    faces = ([(1, 2, 3, 4)], [np.array([0.1, 0.2])])
+    cache.set("key", FACES, "v1", faces)
+
+    face_locations, face_encodings = cache.get("key", FACES, "v1")
+    assert face_locations == [(1, 2, 3, 4)]
+    assert np.allclose(face_encodings[0], [0.1, 0.2])
+
+
+def test_version_mismatch_is_a_miss(cache):
+    cache.set("key", LABELS, "v1", {"a": 1})
+
+    assert cache.get("key", LABELS, "v2") is None
+    stats = cache.get_stats()
+    assert stats["misses"] == 1
+
+
+def test_get_many(cache):
+    cache.set("key", LABELS, "v1", {"a": 1})
+
+    found = cache.get_many("key", {LABELS: "v1", FACES: "v1"})
+    assert found == {LABELS: {"a": 1}}
+
+
+def test_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResultCache(path)
+    cache.set("key", LABELS, "v1", {"a": 1})
+    cache.close()
+
+    reopened = ResultCache(path)
+    assert reopened.get("key", LABELS, "v1") == {"a": 1}
+    reopened.close()
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    features = np.zeros(500, dtype=np.float32)  # 2000 bytes per entry
+    for i in range(4):
+        cache.set(f"key-{i}", IMAGE_FEATURES, "v1", features)
+    # touch the oldest entry so it becomes most recently used
+    cache.get("key-0", IMAGE_FEATURES, "v1")
+
+    for i in range(4, 6):
+        cache.set(f"key-{i}", IMAGE_FEATURES, "v1", features)
+
+    assert cache.total_bytes() <= cache.max_bytes
+    assert cache.get("key-0", IMAGE_FEATURES, "v1") is not None
+    assert cache.get("key-1", IMAGE_FEATURES, "v1") is None
+
+
+def test_size_counter_tracks_replaces_and_evictions(cache):
+    for i in range(8):
+        cache.set(f"key-{i % 6}", LABELS, "v1", {"text": "x" * (500 + i)})
+
+    assert cache.total_bytes() == cache._conn.execute(
+        "SELECT SUM(size) FROM result_cache").fetchone()[0]
+    assert cache.total_bytes() <= cache.max_bytes
+
+
+def test_counter_starts_from_an_existing_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResultCache(path)
+    cache.set("key", LABELS, "v1", {"a": 1})
+    cache._conn.execute("DROP TABLE result_cache_size")
+    cache.close()
+
+    reopened = ResultCache(path)
+    assert reopened.total_bytes() == len(b'{"a": 1}')
+    reopened.close()
+
+
+def test_reads_update_last_access_in_batches(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite3"), touch_batch=2, touch_interval=3600)
+    cache.set("key-0", LABELS, "v1", {"a": 1})
+    cache.set("key-1", LABELS, "v1", {"a": 1})
+
+    def last_access():
+        return [row[0] for row in cache._conn.execute("SELECT last_access FROM result_cache ORDER BY key")]
+
+    written = last_access()
+    cache.get("key-0", LABELS, "v1")
+    assert last_access() == written
+    cache.get("key-1", LABELS, "v1")
+    assert all(after > before for after, before in zip(last_access(), written))
+    cache.close()
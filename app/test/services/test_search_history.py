@@ -0,0 +1,121 @@
+import json
+
+import pytest
+import torch
+
+from app.services.search_history import SearchHistoryStore
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.rows = []
+        self.finds = 0
+        self.touched = []
+
+    def find_search_history(self, user_id, contents):
+        self.finds += 1
+        return [row for row in self.rows
+                if row['user_id'] == user_id and row['content'] in contents]
+
+    def save_text_features_to_search_history_many(self, texts, user_id, text_features):
+        ids = []
+        for text, features in zip(texts, text_features):
+            row = {'id': f"h{len(self.rows)}", 'content': text, 'user_id': user_id,
+                   'hit_count': 1, 'text_features': json.dumps(features)}
+            self.rows.append(row)
+            ids.append(row['id'])
+        return ids
+
+    def touch_search_history(self, hit_counts, last_used_at):
+        self.touched.append(dict(hit_counts))
+
+
+def encode_many(texts):
+    return torch.tensor([[float(len(text)), 1.0] for text in texts])
+
+
+@pytest.fixture
+def supabase():
+    return FakeSupabase()
+
+
+def test_repeated_query_reuses_row_and_features(supabase):
+    store = SearchHistoryStore(supabase)
+    calls = []
+
+    def encode(text):
+        calls.append(text)
+        return encode_many([text])
+
+    first_id, first_features = store.get_or_create("u1", "Beach", encode)
+    second_id, second_features = store.get_or_create("u1", " beach ", encode)
+
+    assert first_id == second_id
+    assert torch.equal(first_features, second_features)
+    assert calls == ["Beach"]
+    assert len(supabase.rows) == 1
+
+
+def test_existing_row_found_in_database(supabase):
+    supabase.rows.append({'id': 'old', 'content': 'birthday', 'user_id': 'u1',
+                          'hit_count': 4, 'text_features': '[0.5,0.5]'})
+    store = SearchHistoryStore(supabase)
+
+    search_history_id, features = store.get_or_create(
+        "u1", "Birthday", lambda text: pytest.fail("encoder must not run"))
+
+    assert search_history_id == 'old'
+    assert features.tolist() == [[0.5, 0.5]]
+    store.flush()
+    assert supabase.touched == [{'old': 1}]
+
+
+def test_rows_are_per_user(supabase):
+    store = SearchHistoryStore(supabase)
+    store.get_or_create("u1", "beach", lambda text: encode_many([text]))
+    store.get_or_create("u2", "beach", lambda text: encode_many([text]))
+
+    assert len(supabase.rows) == 2
+
+
+def test_batch_inserts_new_queries_once(supabase):
+    store = SearchHistoryStore(supabase)
+    store.get_or_create("u1", "beach", lambda text: encode_many([text]))
+    supabase.finds = 0
+
+    ids, features = store.get_or_create_many(
+        "u1", ["beach", "party", "Party", "wedding"], encode_many)
+
+    assert ids[0] == 'h0' and ids[1] == ids[2]
+    assert features.shape == (4, 2)
+    assert [row['content'] for row in supabase.rows] == ["beach", "party", "wedding"]
+    assert supabase.finds == 1
+
+
+def test_hits_are_flushed_in_bulk(supabase):
+    store = SearchHistoryStore(supabase)
+    for _ in range(3):
+        store.get_or_create("u1", "beach", lambda text: encode_many([text]))
+    store.get_or_create("u1", "party", lambda text: encode_many([text]))
+    store.get_or_create("u1", "party", lambda text: encode_many([text]))
+
+    assert store.flush() == 2
+    assert supabase.touched == [{'h0': 2, 'h1': 1}]
+    assert store.flush() == 0
+
+
+def test_failed_flush_keeps_counts(supabase):
+    store = SearchHistoryStore(supabase)
+    store.get_or_create("u1", "beach", lambda text: encode_many([text]))
+    store.get_or_create("u1", "beach", lambda text: encode_many([text]))
+
+    def fail(hit_counts, last_used_at):
+        raise ConnectionError("db down")
+    supabase.touch_search_history = fail
+    with pytest.raises(ConnectionError):
+        store.flush()
+
+    del supabase.touch_search_history
+    store.get_or_create("u1", "beach", lambda text: encode_many([text]))
+    assert store.flush() == 1
+    assert supabase.touched == [{'h0': 2}]
@@ -0,0 +1,69 @@
+import pytest
+
+from app.services.search_pagination import decode_cursor, encode_cursor, order_matches, page_after, rows_page_after
+
+
+def test_cursor_round_trip():
+    state = {"h": "history-id", "s": 0.31, "id": "img"}
+
+    assert decode_cursor(encode_cursor(state)) == state
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", encode_cursor({"s": 0.3})])
+def test_invalid_cursor_raises(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_order_matches_breaks_ties_by_id():
+    matches = [("b", 0.5), ("c", 0.9), ("a", 0.5)]
+
+    assert order_matches(matches) == [("c", 0.9), ("a", 0.5), ("b", 0.5)]
+
+
+def test_pages_cover_every_match_once():
+    matches = order_matches([(f"img{i}", 1 - i / 10) for i in range(7)])
+
+    pages, state = [], None
+    while True:
+        page, state = page_after(matches, state, 3)
+        pages.append(page)
+        if state is None:
+            break
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [match for page in pages for match in page] == matches
+
+
+def test_new_match_does_not_shift_next_page():
+    matches = order_matches([("a", 0.9), ("b", 0.8), ("c", 0.7), ("d", 0.6)])
+    first, state = page_after(matches, None, 2)
+
+    # an image added before the cursor position between two requests
+    matches = order_matches(matches + [("e", 0.95)])
+    second, _ = page_after(matches, state, 2)
+
+    assert [image_id for image_id, _ in first] == ["a", "b"]
+    assert [image_id for image_id, _ in second] == ["c", "d"]
+
+
+def test_last_page_has_no_cursor():
+    page, state = page_after([("a", 0.9)], None, 5)
+
+    assert page == [("a", 0.9)] and state is None
+
+
+def test_rows_page_after_uses_offsets():
+    rows = [{"id": i} for i in range(5)]
+
+    page, state = rows_page_after(rows, None, 2)
+    assert page == rows[:2] and state == {"o": 2}
+    page, state = rows_page_after(rows, {"h": "x", **state}, 4)
+    assert page == rows[2:] and state is None
+
+
+def test_cursor_of_the_other_search_path_is_rejected():
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        page_after([("a", 0.9)], {"h": "x", "o": 2}, 2)
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        rows_page_after([{"id": 1}], {"h": "x", "s": 0.5, "id": "a"}, 2)
@@ -0,0 +1,119 @@
+import pytest
+import torch
+
+from app.services.text_embedding_cache import TextEmbeddingCache, normalize_query
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        features = torch.tensor([[float(len(text)), 1.0]
+                                for text in texts])
+        return features / features.norm(dim=-1, keepdim=True)
+
+
+class FakeRedis:
+    def __init__(self, fail=False):
+        self.values = {}
+        self.fail = fail
+
+    def get(self, key):
+        if self.fail:
+            raise ConnectionError("redis down")
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.values[key] = value
+
+
+@pytest.fixture
+def encoder():
+    return FakeEncoder()
+
+
+def test_normalize_query():
+    assert normalize_query("  Beach\tSunset  ") == "beach sunset"
+    assert normalize_query("ＢＥＡＣＨ") == "beach"
+
+
+def test_repeat_query_hits_memory(encoder):
+    cache = TextEmbeddingCache(encoder, "v1")
+
+    first = cache.get("Beach")
+    second = cache.get(" beach ")
+
+    assert torch.equal(first, second)
+    assert first.shape == (1, 2)
+    assert encoder.calls == [["beach"]]
+    assert cache.get_stats()["hits"] == 1
+    assert cache.get_stats()["misses"] == 1
+
+
+def test_lru_evicts_oldest(encoder):
+    cache = TextEmbeddingCache(encoder, "v1", max_entries=2)
+
+    cache.get("a")
+    cache.get("bb")
+    cache.get("a")
+    cache.get("ccc")  # evicts "bb"
+    cache.get("a")
+    cache.get("bb")
+
+    assert encoder.calls == [["a"], ["bb"], ["ccc"], ["bb"]]
+
+
+def test_redis_tier_shared_between_caches(encoder):
+    redis = FakeRedis()
+    TextEmbeddingCache(encoder, "v1", redis_client=redis).get("birthday")
+
+    other = TextEmbeddingCache(encoder, "v1", redis_client=redis)
+    features = other.get("Birthday")
+
+    assert encoder.calls == [["birthday"]]
+    assert other.get_stats()["redis_hits"] == 1
+    assert torch.allclose(features, encoder(["birthday"]))
+
+
+def test_redis_keys_depend_on_version(encoder):
+    redis = FakeRedis()
+    TextEmbeddingCache(encoder, "v1", redis_client=redis).get("beach")
+    TextEmbeddingCache(encoder, "v2", redis_client=redis).get("beach")
+
+    assert len(redis.values) == 2
+    assert len(encoder.calls) == 2
+
+
+def test_redis_errors_fall_back_to_encoder(encoder):
+    cache = TextEmbeddingCache(encoder, "v1", redis_client=FakeRedis(fail=True))
+
+    assert cache.get("beach").shape == (1, 2)
+    assert encoder.calls == [["beach"]]
+
+
+def test_prewarm_batches_and_skips_cached(encoder):
+    cache = TextEmbeddingCache(encoder, "v1")
+    cache.get("beach")
+
+    encoded = cache.prewarm(["Beach", "party", "PARTY", "wedding", ""], batch_size=1)
+
+    assert encoded == 2
+    assert encoder.calls == [["beach"], ["party"], ["wedding"]]
+    cache.get("wedding")
+    assert len(encoder.calls) == 3
+
+
+def test_get_many_encodes_misses_in_one_call(encoder):
+    cache = TextEmbeddingCache(encoder, "v1")
+    cache.get("beach")
+
+    features = cache.get_many(["Party", "beach", "party ", "wedding"])
+
+    assert features.shape == (4, 2)
+    assert encoder.calls == [["beach"], ["party", "wedding"]]
+    assert torch.equal(features[0], features[2])
+    assert cache.get_stats()["misses"] == 3
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.services.vector_index import UserVectorIndexRegistry, VectorIndex, on_image_features_saved
+
+
+def random_features(n, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float16])
+def test_search_matches_brute_force(dtype):
+    features = random_features(100)
+    query = random_features(1, seed=1)[0]
+    query /= np.linalg.norm(query)
+    index = VectorIndex(dim=8, dtype=dtype)
+    index.upsert(list(range(100)), features)
+
+    results = index.search(query, threshold=0.2)
+
+    normalized = features / np.linalg.norm(features, axis=1, keepdims=True)
+    scores = normalized @ query
+    expected = [int(i) for i in np.argsort(-scores) if scores[i] >= 0.2]
+    if dtype == np.float32:
+        assert [image_id for image_id, _ in results] == expected
+    atol = 1e-5 if dtype == np.float32 else 2e-3
+    for image_id, score in results:
+        assert score == pytest.approx(scores[image_id], abs=atol)
+
+
+def test_limit_returns_top_k_sorted():
+    index = VectorIndex(dim=2)
+    index.upsert(["a", "b", "c"], [[1, 0], [0.8, 0.6], [0, 1]])
+
+    results = index.search([1, 0], limit=2)
+
+    assert [image_id for image_id, _ in results] == ["a", "b"]
+    assert results[0][1] == pytest.approx(1.0)
+
+
+def test_upsert_replaces_and_remove_keeps_rows_contiguous():
+    index = VectorIndex(dim=2)
+    index.upsert(["a", "b", "c"], [[1, 0], [0, 1], [1, 1]])
+    index.upsert(["a"], [[0, 1]])
+    index.remove(["b", "missing"])
+
+    assert len(index) == 2
+    results = dict(index.search([0, 1]))
+    assert results["a"] == pytest.approx(1.0)
+    assert results["c"] == pytest.approx(np.sqrt(0.5))
+
+
+def test_mismatched_ids_raise():
+    with pytest.raises(ValueError):
+        VectorIndex(dim=2).upsert(["a"], [[1, 0], [0, 1]])
+
+
+def test_registry_builds_lazily_once():
+    calls = []
+
+    def loader(user_id):
+        calls.append(user_id)
+        return ["a"], np.array([[1.0, 0.0]])
+
+    registry = UserVectorIndexRegistry(loader, dim=2)
+    registry.add("user", "b", [0.0, 1.0])  # not loaded yet -> ignored
+
+    assert registry.search("user", [1, 0], threshold=0.5) == [("a", pytest.approx(1.0))]
+    registry.add("user", "b", [0.0, 1.0])
+    assert [image_id for image_id, _ in registry.search("user", [0, 1], threshold=0.5)] == ["b"]
+    assert calls == ["user"]
+
+
+def test_registry_keeps_writes_made_while_loading():
+    started, release = threading.Event(), threading.Event()
+
+    def loader(user_id):
+        started.set()
+        release.wait(5)
+        return ["a"], np.array([[1.0, 0.0]])
+
+    registry = UserVectorIndexRegistry(loader, dim=2)
+    thread = threading.Thread(target=registry.get, args=("user",))
+    thread.start()
+    started.wait(5)
+    registry.add("user", "b", [0.0, 1.0])
+    release.set()
+    thread.join(5)
+
+    assert len(registry.get("user")) == 2
+
+
+def test_registry_evicts_least_recent_user():
+    registry = UserVectorIndexRegistry(
+        lambda user_id: ([], np.empty((0, 2))), dim=2, max_users=1)
+    registry.get("first")
+    registry.get("second")
+
+    assert registry.get_stats()["users"] == 1
+
+
+def test_registry_rebuilds_index_past_its_ttl():
+    # rows of the database: another replica adds "b" and deletes "a"
+    rows = {"a": [1.0, 0.0]}
+    registry = UserVectorIndexRegistry(
+        lambda user_id: (list(rows), np.array(list(rows.values()))), dim=2, ttl=0.05)
+    registry.get("user")
+    rows.pop("a")
+    rows["b"] = [0.0, 1.0]
+
+    assert [image_id for image_id, _ in registry.search("user", [1, 0])] == ["a"]
+    time.sleep(0.06)
+    assert [image_id for image_id, _ in registry.search("user", [1, 0])] == ["b"]
+
+
+def test_listener_updates_loaded_index():
+    registry = UserVectorIndexRegistry(
+        lambda user_id: ([], np.empty((0, 2))), dim=2)
+    registry.get("user")
+
+    on_image_features_saved(registry)(
+        {"id": "img", "uploader_id": "user"}, [1.0, 0.0])
+
+    assert registry.search("user", [1, 0]) == [("img", pytest.approx(1.0))]
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float16])
+def test_search_many_matches_single_searches(dtype):
+    features = random_features(50)
+    queries = random_features(3, seed=2)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    index = VectorIndex(dim=8, dtype=dtype)
+    index.upsert(list(range(50)), features)
+
+    batched = index.search_many(queries, threshold=0.1, limit=5)
+
+    assert len(batched) == 3
+    for query, results in zip(queries, batched):
+        single = index.search(query, threshold=0.1, limit=5)
+        assert [image_id for image_id, _ in results] == [image_id for image_id, _ in single]
+        assert [score for _, score in results] == pytest.approx(
+            [score for _, score in single], abs=1e-5)
+        assert len(results) <= 5
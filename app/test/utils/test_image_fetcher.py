@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import pytest
+import httpx
+import requests
+from unittest.mock import patch, MagicMock
+
+from app.utils.image_fetcher import ImageFetcher, ImageTooLargeError
+
+
+def mock_response(chunks, headers=None):
+    response = MagicMock()
+    response.headers = headers or {}
+    response.iter_content.return_value = iter(chunks)
+    response.__enter__.return_value = response
+    return response
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = ImageFetcher(max_bytes=10, per_host_concurrency=2)
+    yield fetcher
+    fetcher.close()
+
+
+def test_fetch_streams_body(fetcher):
+    response = mock_response([b'abc', b'def'])
+    with patch.object(fetcher.session, 'get', return_value=response) as mock_get:
+        data = fetcher.fetch('https://storage.example.com/a.jpg')
+
+    assert data == b'abcdef'
+    # streamed read with connect/read timeouts
+    _, kwargs = mock_get.call_args
+    assert kwargs['stream'] is True
+    assert kwargs['timeout'] == (fetcher.connect_timeout, fetcher.timeout)
+
+
+def test_fetch_rejects_large_body(fetcher):
+    response = mock_response([b'123456', b'789012'])
+    with patch.object(fetcher.session, 'get', return_value=response):
+        with pytest.raises(ImageTooLargeError):
+            fetcher.fetch('https://storage.example.com/a.jpg')
+
+
+def test_fetch_rejects_large_content_length(fetcher):
+    response = mock_response([b'1'], headers={'content-length': '100'})
+    with patch.object(fetcher.session, 'get', return_value=response):
+        with pytest.raises(ImageTooLargeError):
+            fetcher.fetch('https://storage.example.com/a.jpg')
+    # body was never read
+    response.iter_content.assert_not_called()
+
+
+def test_fetch_request_exception(fetcher):
+    with patch.object(fetcher.session, 'get', side_effect=requests.RequestException):
+        with pytest.raises(RuntimeError) as excinfo:
+            fetcher.fetch('https://storage.example.com/a.jpg')
+    assert "Failed to download image from URL" in str(excinfo.value)
+
+
+def test_host_slots_are_shared_per_host(fetcher):
+    with fetcher._host_slot('https://a.example.com/1.jpg'):
+        pass
+    with fetcher._host_slot('https://a.example.com/2.jpg'):
+        pass
+    with fetcher._host_slot('https://b.example.com/1.jpg'):
+        pass
+    assert set(fetcher._host_slots) == {'a.example.com', 'b.example.com'}
+
+
+def run_async_fetch(fetcher, url, handler):
+    async def run():
+        fetcher._get_async_client(url)
+        # swap the real transport for a mock one, keep pooling settings
+        fetcher._async_client = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler))
+        return await fetcher.fetch_async(url)
+    return asyncio.run(run())
+
+
+def test_fetch_async(fetcher):
+    data = run_async_fetch(fetcher, 'https://storage.example.com/a.jpg',
+                           lambda request: httpx.Response(200, content=b'abcdef'))
+    assert data == b'abcdef'
+
+
+def test_fetch_async_rejects_large_body(fetcher):
+    with pytest.raises(ImageTooLargeError):
+        run_async_fetch(fetcher, 'https://storage.example.com/a.jpg',
+                        lambda request: httpx.Response(200, content=b'x' * 20))
+
+
+def test_fetch_async_http_error(fetcher):
+    with pytest.raises(RuntimeError) as excinfo:
+        run_async_fetch(fetcher, 'https://storage.example.com/a.jpg',
+                        lambda request: httpx.Response(404))
+    assert "Failed to download image from URL" in str(excinfo.value)
+
+
+def test_async_client_of_a_previous_loop_is_closed(fetcher):
+    other_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=other_loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        async def create():
+            return fetcher._get_async_client('https://storage.example.com/a.jpg')[0]
+        old_client = asyncio.run_coroutine_threadsafe(create(), other_loop).result(5)
+
+        async def create_and_close():
+            client, _ = fetcher._get_async_client('https://storage.example.com/a.jpg')
+            await fetcher.aclose()
+            return client
+        new_client = asyncio.run(create_and_close())
+
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.1), other_loop).result(5)
+        assert new_client is not old_client
+        assert old_client.is_closed and new_client.is_closed
+        assert fetcher._async_client is None
+    finally:
+        other_loop.call_soon_threadsafe(other_loop.stop)
+        thread.join(5)
+        other_loop.close()
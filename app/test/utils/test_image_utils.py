@@ -2,38 +2,41 @@ import pytest
 from unittest.mock import patch, MagicMock
 from io import BytesIO
 from PIL import Image, UnidentifiedImageError
-import requests
 
-from app.utils.image_utils import load_image_from_url, load_image_file_from_url
+from app.utils.image_utils import decode_image, load_image_from_url, load_image_file_from_url
 
 
 @pytest.fixture
-def mock_response():
+def mock_fetcher():
     mock = MagicMock()
-    mock.content = b'fake image content'
+    mock.fetch.return_value = b'fake image content'
     return mock
 
 
-def test_load_image_from_url(mock_response):
-    # mock response
-    with patch('requests.get', return_value=mock_response), \
+def test_load_image_from_url(mock_fetcher):
+    # mock fetcher
+    with patch('app.utils.image_utils.get_image_fetcher', return_value=mock_fetcher), \
             patch('PIL.Image.open', return_value=MagicMock(spec=Image.Image)):
         image = load_image_from_url(
             'http://example.com/image.jpg')
         assert image is not None
+        mock_fetcher.fetch.assert_called_once_with(
+            'http://example.com/image.jpg')
 
 
-def test_load_image_from_url_request_exception():
-    with patch('requests.get', side_effect=requests.RequestException):
+def test_load_image_from_url_request_exception(mock_fetcher):
+    mock_fetcher.fetch.side_effect = RuntimeError(
+        "Failed to download image from URL: http://example.com/image.jpg")
+    with patch('app.utils.image_utils.get_image_fetcher', return_value=mock_fetcher):
         with pytest.raises(RuntimeError) as excinfo:
             load_image_from_url('http://example.com/image.jpg')
         assert "Failed to download image from URL" in str(excinfo.value)
 
 
-def test_load_image_file_from_url(mock_response):
+def test_load_image_file_from_url(mock_fetcher):
     mock_image = MagicMock()
 
-    with patch('requests.get', return_value=mock_response), \
+    with patch('app.utils.image_utils.get_image_fetcher', return_value=mock_fetcher), \
             patch('PIL.Image.open', return_value=mock_image):
         image_file = load_image_file_from_url(
             'https://placehold.co/600x400/EEE/31343C')
@@ -41,8 +44,42 @@ def test_load_image_file_from_url(mock_response):
         assert image_file.getvalue() == b'fake image content'
 
 
-def test_load_image_file_from_url_request_exception():
-    with patch('requests.get', side_effect=requests.RequestException):
+def test_load_image_file_from_url_request_exception(mock_fetcher):
+    mock_fetcher.fetch.side_effect = RuntimeError(
+        "Failed to download image from URL: http://example.com/image.jpg")
+    with patch('app.utils.image_utils.get_image_fetcher', return_value=mock_fetcher):
         with pytest.raises(RuntimeError) as excinfo:
             load_image_file_from_url('http://example.com/image.jpg')
         assert "Failed to download image from URL" in str(excinfo.value)
+
+
+def jpeg_bytes(size=(1600, 1200)):
+    image_data = BytesIO()
+    Image.new("RGB", size, (120, 80, 40)).save(image_data, "JPEG")
+    return image_data.getvalue()
+
+
+def test_decode_image_full_resolution():
+    image, original_size = decode_image(jpeg_bytes())
+    assert original_size == (1600, 1200)
+    assert image.size == (1600, 1200)
+
+
+def test_decode_image_draft_covers_requested_size():
+    image, original_size = decode_image(jpeg_bytes(), (224, 224))
+    assert original_size == (1600, 1200)
+    # 1/4 DCT scale is the smallest that still covers 224x224
+    assert image.size == (400, 300)
+
+
+def test_decode_image_draft_size_function():
+    image, _ = decode_image(jpeg_bytes(), lambda width, height: (
+        width // 2, height // 2))
+    assert image.size == (800, 600)
+
+
+def test_decode_image_draft_ignored_for_png():
+    image_data = BytesIO()
+    Image.new("RGB", (800, 600)).save(image_data, "PNG")
+    image, _ = decode_image(image_data.getvalue(), (100, 100))
+    assert image.size == (800, 600)
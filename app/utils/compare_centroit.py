@@ -1,10 +1,16 @@
 import json
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 from app.libs.logger.log import log_info
 from app.services.supabase_service import SupabaseService
 
+
+def cosine_similarity(X, Y):
+    # sklearn imported on first use, keep it off the app.main import path
+    from sklearn.metrics.pairwise import cosine_similarity as pairwise_cosine_similarity
+    return pairwise_cosine_similarity(X, Y)
+
+
 # for each new cluster, compare with all old clusters
 # -> find the most similar old cluster
 # 1. new_cluster -> {[new_cluster_id_label]: [new_cluster_centroid]}
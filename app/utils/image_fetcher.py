@@ -0,0 +1,188 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app.core.config import settings
+from app.libs.logger.log import log_info
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageTooLargeError(RuntimeError):
+    pass
+
+
+class ImageFetcher:
+    """
+    Shared image downloader for the storage host.
+
+    Keeps keep-alive connection pools (requests.Session for threads,
+    httpx.AsyncClient for asyncio), limits in-flight requests per host,
+    applies connect/read timeouts and streams the body with a max-bytes
+    cutoff instead of buffering an unbounded response.
+
+    The AsyncClient belongs to one event loop: a fetch from another loop
+    closes the previous client on its own loop (when it still runs) and
+    creates a new one. aclose() on app shutdown closes the current one.
+    """
+
+    def __init__(self, timeout: float = 15, connect_timeout: float = 5, max_bytes: int = 30 * 1024 * 1024,
+                 per_host_concurrency: int = 8, pool_size: int = 16, retries: int = 2):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_bytes = max_bytes
+        self.per_host_concurrency = per_host_concurrency
+        self.pool_size = pool_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, backoff_factor=0.2, status_forcelist=(
+                502, 503, 504), allowed_methods=("GET",)),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+
+        # asyncio primitives are bound to the loop they were created on
+        self._async_loop = None
+        self._async_client = None
+        self._async_host_slots = {}
+
+    # sync entry point
+    def fetch(self, url: str) -> bytes:
+        try:
+            with self._host_slot(url):
+                with self.session.get(url, stream=True, timeout=(self.connect_timeout, self.timeout)) as response:
+                    response.raise_for_status()
+                    self._check_content_length(url, response.headers)
+                    return self._read_capped(url, response.iter_content(CHUNK_SIZE))
+        except requests.RequestException:
+            raise RuntimeError(f"Failed to download image from URL: {url}")
+
+    # asyncio entry point
+    async def fetch_async(self, url: str) -> bytes:
+        client, slot = self._get_async_client(url)
+        try:
+            async with slot:
+                async with client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    self._check_content_length(url, response.headers)
+                    chunks = []
+                    size = 0
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise ImageTooLargeError(
+                                f"Image larger than {self.max_bytes} bytes: {url}")
+                        chunks.append(chunk)
+                    return b"".join(chunks)
+        except httpx.HTTPError:
+            raise RuntimeError(f"Failed to download image from URL: {url}")
+
+    def close(self):
+        self.session.close()
+        with self._lock:
+            self._retire_async_client()
+
+    async def aclose(self):
+        """close() from the event loop of the async client, awaits its connections closing."""
+        self.session.close()
+        with self._lock:
+            client, loop = self._async_client, self._async_loop
+            if loop is asyncio.get_running_loop():
+                self._async_client, self._async_loop = None, None
+            else:
+                client = None
+                self._retire_async_client()
+        if client is not None:
+            await client.aclose()
+
+    @contextmanager
+    def _host_slot(self, url: str):
+        host = urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host_concurrency)
+                self._host_slots[host] = slot
+        with slot:
+            yield
+
+    def _get_async_client(self, url: str):
+        loop = asyncio.get_running_loop()
+        host = urlsplit(url).netloc
+        with self._lock:
+            if self._async_loop is not loop:
+                self._retire_async_client()
+                self._async_loop = loop
+                self._async_client = httpx.AsyncClient(
+                    timeout=httpx.Timeout(
+                        self.timeout, connect=self.connect_timeout),
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                    transport=httpx.AsyncHTTPTransport(retries=1),
+                    follow_redirects=True,
+                )
+                self._async_host_slots = {}
+            slot = self._async_host_slots.get(host)
+            if slot is None:
+                slot = asyncio.Semaphore(self.per_host_concurrency)
+                self._async_host_slots[host] = slot
+            return self._async_client, slot
+
+    def _retire_async_client(self):
+        """Close the client of the previous event loop on that loop, its connections are bound to it."""
+        client, loop = self._async_client, self._async_loop
+        self._async_client, self._async_loop = None, None
+        if client is None:
+            return
+        if loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            # the loop is gone, its sockets close with the client object
+            log_info("Image fetcher: event loop of the previous async client is closed, dropping it")
+
+    def _check_content_length(self, url: str, headers):
+        content_length = headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise ImageTooLargeError(
+                f"Image larger than {self.max_bytes} bytes: {url}")
+
+    def _read_capped(self, url: str, chunks) -> bytes:
+        data = bytearray()
+        for chunk in chunks:
+            data.extend(chunk)
+            if len(data) > self.max_bytes:
+                raise ImageTooLargeError(
+                    f"Image larger than {self.max_bytes} bytes: {url}")
+        return bytes(data)
+
+
+image_fetcher = None
+_image_fetcher_lock = threading.Lock()
+
+
+def get_image_fetcher() -> ImageFetcher:
+    global image_fetcher
+    if image_fetcher is None:
+        with _image_fetcher_lock:
+            if image_fetcher is None:
+                image_fetcher = ImageFetcher(
+                    timeout=settings.image_fetch_timeout,
+                    connect_timeout=settings.image_fetch_connect_timeout,
+                    max_bytes=settings.image_fetch_max_bytes,
+                    per_host_concurrency=settings.image_fetch_per_host_concurrency,
+                    pool_size=settings.image_fetch_pool_size,
+                )
+                log_info(
+                    f"Image fetcher created (per host concurrency: {settings.image_fetch_per_host_concurrency})")
+    return image_fetcher
@@ -1,27 +1,46 @@
-import requests
 from PIL import Image, UnidentifiedImageError
 from io import BytesIO
 
+from app.utils.image_fetcher import get_image_fetcher
+
+
+def fetch_image_bytes(url: str) -> bytes:
+    return get_image_fetcher().fetch(url)
+
+
+async def fetch_image_bytes_async(url: str) -> bytes:
+    return await get_image_fetcher().fetch_async(url)
+
+
+def decode_image(image_data: bytes, draft_size: tuple = None):
+    """
+    Decode downloaded bytes once, the result is shared by every consumer.
+
+    :param draft_size: (width, height) the consumers need at least, or a
+        function (width, height) -> (width, height) of the original size.
+        JPEGs are then decoded by libjpeg at the largest 1/2, 1/4 or 1/8 DCT
+        scale that still covers it instead of at full resolution.
+    :return: tuple of (decoded PIL image, original (width, height))
+    """
+    image = Image.open(BytesIO(image_data))
+    original_size = image.size
+    if callable(draft_size):
+        draft_size = draft_size(*original_size)
+    if draft_size is not None and image.format == "JPEG":
+        image.draft(None, draft_size)
+    image.load()
+    return image, original_size
+
 
 def load_image_from_url(url: str) -> Image.Image:
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        image_data = BytesIO(response.content)
-        return Image.open(image_data)
-    except requests.RequestException:
-        raise RuntimeError(f"Failed to download image from URL: {url}")
+    image_data = BytesIO(fetch_image_bytes(url))
+    return Image.open(image_data)
 
 
 def load_image_file_from_url(url: str) -> BytesIO:
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        image_data = BytesIO(response.content)
-        # Validate it's an actual image
-        Image.open(image_data).verify()
-        # Reset file pointer after verification
-        image_data.seek(0)
-        return image_data
-    except requests.RequestException:
-        raise RuntimeError(f"Failed to download image from URL: {url}")
+    image_data = BytesIO(fetch_image_bytes(url))
+    # Validate it's an actual image
+    Image.open(image_data).verify()
+    # Reset file pointer after verification
+    image_data.seek(0)
+    return image_data
@@ -0,0 +1,4 @@
+-- usage columns of search_history, written in bulk by SearchHistoryStore.flush
+alter table public.search_history
+    add column if not exists hit_count integer not null default 1,
+    add column if not exists last_used_at timestamptz;
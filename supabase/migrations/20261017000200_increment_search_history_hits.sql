@@ -0,0 +1,16 @@
+-- adds per-row hit deltas instead of overwriting hit_count -> safe with several server processes
+-- hits: {"<search_history id>": <new hits>, ...}
+create or replace function public.increment_search_history_hits(hits jsonb, used_at timestamptz)
+returns integer
+language sql
+as $$
+    with updated as (
+        update public.search_history as h
+        set hit_count = h.hit_count + d.value::integer,
+            last_used_at = greatest(h.last_used_at, used_at)
+        from jsonb_each_text(hits) as d
+        where h.id = d.key::uuid
+        returning h.id
+    )
+    select count(*)::integer from updated;
+$$;
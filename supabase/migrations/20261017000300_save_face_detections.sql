@@ -0,0 +1,27 @@
+-- person rows of a batch of images + their face detection flag in one transaction.
+-- A face already stored for the image (same coordinate) is not inserted again, so a
+-- batch retried after a crash or run twice by two processes writes no duplicates.
+-- records: person rows as json ({"embedding", "coordinate", "image_id", "user_id"})
+create or replace function public.save_face_detections(records jsonb, image_ids uuid[])
+returns integer
+language plpgsql
+as $$
+declare
+    inserted integer;
+begin
+    -- serializes concurrent saves of the same images
+    perform 1 from public.image where id = any(image_ids) for update;
+
+    insert into public.person (embedding, coordinate, image_id, user_id)
+    select distinct on (r.image_id, r.coordinate::text) r.embedding, r.coordinate, r.image_id, r.user_id
+    from jsonb_populate_recordset(null::public.person, records) as r
+    where not exists (
+        select 1 from public.person as p
+        where p.image_id = r.image_id and p.coordinate::text = r.coordinate::text
+    );
+    get diagnostics inserted = row_count;
+
+    update public.image set is_face_detection = true where id = any(image_ids);
+    return inserted;
+end;
+$$;
@@ -0,0 +1,18 @@
+-- image.updated_at from the database clock on every write, whatever the writer sends:
+-- the embedding store syncs by it, writer clocks (naive local time) must not matter
+create or replace function public.set_image_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at = clock_timestamp();
+    return new;
+end;
+$$;
+
+drop trigger if exists image_set_updated_at on public.image;
+create trigger image_set_updated_at
+    before insert or update on public.image
+    for each row execute function public.set_image_updated_at();
+
+create index if not exists image_updated_at_id_idx on public.image (updated_at, id);
@@ -0,0 +1,36 @@
+-- person gate decision of the image's face detection, null -> detected without the gate.
+-- Audit: select id, person_gate_score from image where person_gate_skipped;
+-- re-run after changing the threshold: update image set is_face_detection = false where person_gate_skipped;
+alter table public.image
+    add column if not exists person_gate_score real,
+    add column if not exists person_gate_skipped boolean;
+
+-- save_face_detections + the gate decisions: gates = {"<image id>": {"score", "skip"}, ...}
+drop function if exists public.save_face_detections(jsonb, uuid[]);
+create or replace function public.save_face_detections(records jsonb, image_ids uuid[], gates jsonb default '{}')
+returns integer
+language plpgsql
+as $$
+declare
+    inserted integer;
+begin
+    -- serializes concurrent saves of the same images
+    perform 1 from public.image where id = any(image_ids) for update;
+
+    insert into public.person (embedding, coordinate, image_id, user_id)
+    select distinct on (r.image_id, r.coordinate::text) r.embedding, r.coordinate, r.image_id, r.user_id
+    from jsonb_populate_recordset(null::public.person, records) as r
+    where not exists (
+        select 1 from public.person as p
+        where p.image_id = r.image_id and p.coordinate::text = r.coordinate::text
+    );
+    get diagnostics inserted = row_count;
+
+    update public.image as i
+    set is_face_detection = true,
+        person_gate_score = (gates -> i.id::text ->> 'score')::real,
+        person_gate_skipped = (gates -> i.id::text ->> 'skip')::boolean
+    where i.id = any(image_ids);
+    return inserted;
+end;
+$$;